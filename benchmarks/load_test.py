@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Dashboard load test.
+
+Simulates concurrent users of a running dashboard: each user repeatedly
+picks a random ride and fires every callback the ride selector triggers
+(the summary and, for the graphs app, each time series), one after another
+as one page view, the way the browser does. This runs at each concurrency
+level in turn and reports callback latency (p50/p95/p99), callbacks/s and page
+views/s per level, so you can see where a server saturates.
+
+The rides and callbacks are discovered from the app (/_dash-layout and
+/_dash-dependencies), so either dashboard works. Point it at a running
+server with --url, or give --cache-dir to have it start
+`cyclingdata serve --production` itself for each --web-workers count and
+compare them. Only the standard library is needed.
+
+The first view of a ride loads and renders it, later views come from the
+worker's render cache; with few rides most requests are cache hits.
+
+Usage: python benchmarks/load_test.py --cache-dir /tmp/cache --web-workers 1,4 --concurrency 1,4,16
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+RESULTS_VERSION = 1
+SELECTOR_ID = 'file-selector'
+SERVER_START_TIMEOUT_S = 120
+REQUEST_TIMEOUT_S = 120
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=REQUEST_TIMEOUT_S) as response:
+        return json.load(response)
+
+def _find_component(node, component_id):
+    if isinstance(node, dict):
+        if node.get('props', {}).get('id') == component_id:
+            return node
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        found = _find_component(child, component_id)
+        if found is not None:
+            return found
+    return None
+
+def discover(url):
+    """(ride ids in the selector, callbacks the selector triggers) of a running dashboard."""
+    selector = _find_component(_get_json(f'{url}/_dash-layout'), SELECTOR_ID)
+    if selector is None:
+        raise SystemExit(f"No '{SELECTOR_ID}' in the dashboard at {url}")
+    rides = [option['value'] for option in selector['props'].get('options') or []]
+    callbacks = [dependency for dependency in _get_json(f'{url}/_dash-dependencies')
+                 if any(i['id'] == SELECTOR_ID and i['property'] == 'value' for i in dependency['inputs'])]
+    return rides, callbacks
+
+def callback_payload(dependency, ride):
+    """The /_dash-update-component body the browser sends when the ride selector changes."""
+    output_id, output_property = dependency['output'].rsplit('.', 1)
+    inputs = [{'id': i['id'], 'property': i['property'],
+               'value': ride if i['id'] == SELECTOR_ID else None} for i in dependency['inputs']]
+    return json.dumps({
+        'output': dependency['output'],
+        'outputs': {'id': output_id, 'property': output_property},
+        'inputs': inputs,
+        'changedPropIds': [f'{SELECTOR_ID}.value'],
+        'state': [],
+    }).encode()
+
+def post_callback(url, body):
+    """Latency in seconds of one callback request, or None when it failed."""
+    request = urllib.request.Request(f'{url}/_dash-update-component', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_S) as response:
+            response.read()
+    except (urllib.error.URLError, OSError):
+        return None
+    return time.perf_counter() - start
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+def run_level(url, rides, callbacks, users, duration_s, seed=0):
+    """Runs users concurrent users for duration_s and returns the latency and throughput figures."""
+    latencies = []
+    errors = [0]
+    page_views = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration_s
+
+    def user(index):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            ride = rng.choice(rides)
+            view = [post_callback(url, callback_payload(dependency, ride)) for dependency in callbacks]
+            with lock:
+                latencies.extend(latency for latency in view if latency is not None)
+                errors[0] += sum(1 for latency in view if latency is None)
+                page_views[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        list(executor.map(user, range(users)))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        'users': users,
+        'seconds': seconds,
+        'callbacks': len(latencies),
+        'errors': errors[0],
+        'page_views': page_views[0],
+        'callbacks_per_s': len(latencies) / seconds,
+        'page_views_per_s': page_views[0] / seconds,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+    print(f"{users:>5} users {result['callbacks_per_s']:8.1f} callbacks/s {result['page_views_per_s']:7.1f} views/s "
+          f"p50 {result['p50_ms'] or 0:8.1f} ms p95 {result['p95_ms'] or 0:8.1f} ms "
+          f"p99 {result['p99_ms'] or 0:8.1f} ms errors {errors[0]}")
+    return result
+
+def wait_for_server(url, process):
+    deadline = time.perf_counter() + SERVER_START_TIMEOUT_S
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"The server exited with code {process.returncode}")
+        try:
+            _get_json(f'{url}/_dash-dependencies')
+            return
+        except (urllib.error.URLError, OSError, ValueError):
+            time.sleep(0.5)
+    raise SystemExit(f"The server did not answer at {url} within {SERVER_START_TIMEOUT_S} s")
+
+def start_server(args, web_workers):
+    """Starts `cyclingdata serve --production` on the cache and waits until it answers."""
+    command = [sys.executable, '-m', 'cyclingdata', 'serve', '--production', '--cache-dir', args.cache_dir,
+               '--app', args.app, '--host', '127.0.0.1', '--port', str(args.port),
+               '--web-workers', str(web_workers), '--threads', str(args.threads)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=root, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_server(f'http://127.0.0.1:{args.port}', process)
+    except BaseException:
+        process.terminate()
+        raise
+    return process
+
+def run_load_test(url, concurrency, duration_s, seed):
+    rides, callbacks = discover(url)
+    if not rides:
+        raise SystemExit(f"The dashboard at {url} lists no rides")
+    print(f"{len(rides)} rides, {len(callbacks)} callbacks per page view")
+    return [run_level(url, rides, callbacks, users, duration_s, seed) for users in concurrency]
+
+def _int_list(text):
+    return [int(value) for value in text.split(',') if value]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure dashboard callback latency and throughput under concurrent users.')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='running dashboard to test (ignored with --cache-dir)')
+    parser.add_argument('--cache-dir', help='start `cyclingdata serve --production` on this cache for each --web-workers')
+    parser.add_argument('--app', choices=['graphs', 'summary'], default='graphs', help='dashboard to start with --cache-dir')
+    parser.add_argument('--port', type=int, default=8765, help='port for the server started with --cache-dir')
+    parser.add_argument('--web-workers', type=_int_list, default=[1, 4], help='server processes to compare, e.g. 1,2,4')
+    parser.add_argument('--threads', type=int, default=4, help='threads per server process')
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 2, 4, 8, 16], help='concurrent users per level')
+    parser.add_argument('--duration-s', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_test_results.json', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    runs = []
+    if args.cache_dir:
+        for web_workers in args.web_workers:
+            print(f"\n{web_workers} web workers x {args.threads} threads")
+            process = start_server(args, web_workers)
+            try:
+                levels = run_load_test(f'http://127.0.0.1:{args.port}', args.concurrency, args.duration_s, args.seed)
+            finally:
+                process.terminate()
+                process.wait()
+            runs.append({'web_workers': web_workers, 'threads': args.threads, 'levels': levels})
+    else:
+        runs.append({'url': args.url, 'levels': run_load_test(args.url, args.concurrency, args.duration_s, args.seed)})
+
+    results = {'version': RESULTS_VERSION, 'app': args.app, 'duration_s': args.duration_s, 'cpus': os.cpu_count(),
+               'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
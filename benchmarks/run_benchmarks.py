@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Ingest benchmark suite.
+
+Generates a synthetic archive (see synthetic_fit.py) in a scratch directory
+and times each ingest stage on it:
+
+* find_and_decompress - legacy discovery that writes decompressed copies
+* discover_sources    - the parallel scandir walk alone (scan_fit_sources)
+* process_fit_files   - decoding every source into DataFrames, fed from the walk as it goes
+* decode_selected     - the same with only the declared record fields (SCHEMA_RECORD_FIELDS)
+* ingest_cold         - update_ingest_manifest into an empty cache
+* ingest_warm         - update_ingest_manifest again with nothing changed (no records decoded)
+* workout_summaries   - calculate_workout_summary on every cached ride
+* summarize_rides     - the batched summary of all cached rides
+
+Each stage reports wall time, files/s, records/s, peak RSS (of this process
+while the stage ran, and of the worker processes so far) and the bytes it
+read and wrote. Results are printed and saved as JSON; pass --compare with
+an earlier results file to see the change per stage.
+
+Usage: python benchmarks/run_benchmarks.py --rides 50 --duration-s 7200 --output results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_fit import add_archive_arguments, archive_options, write_archive
+from cyclingdata.fit_ingest import (SCHEMA_RECORD_FIELDS, find_and_decompress_fit_files, load_cached_ride,
+                                    load_cached_rides, process_fit_files, scan_fit_sources, update_ingest_manifest)
+from cyclingdata.ride_summary import calculate_workout_summary, summarize_rides
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RESULTS_VERSION = 1
+RSS_SAMPLE_INTERVAL_S = 0.01
+
+def _current_rss_bytes():
+    """Resident set size of this process, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _max_rss_bytes(who):
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024  # bytes on macOS, KiB elsewhere
+
+class _RssSampler:
+    """Samples this process's RSS in a background thread and keeps the peak."""
+
+    def __init__(self):
+        self.peak = _current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL_S):
+            rss = _current_rss_bytes()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def directory_bytes(path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+def run_stage(name, func, files, records, bytes_read=0, output_directory=None):
+    """Runs func() once and returns its timing and resource figures."""
+    written_before = directory_bytes(output_directory) if output_directory else 0
+    with _RssSampler() as sampler:
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+    written = directory_bytes(output_directory) - written_before if output_directory else 0
+    result = {
+        'stage': name,
+        'seconds': seconds,
+        'files': files,
+        'records': records,
+        'files_per_s': files / seconds if seconds > 0 else None,
+        'records_per_s': records / seconds if seconds > 0 else None,
+        'peak_rss_bytes': sampler.peak,
+        'max_rss_bytes': _max_rss_bytes(resource.RUSAGE_SELF) if resource else None,
+        'workers_max_rss_bytes': _max_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+        'bytes_read': bytes_read,
+        'bytes_written': max(written, 0),
+    }
+    print(f"{name:<20} {seconds:8.2f} s {result['files_per_s'] or 0:10.1f} files/s "
+          f"{result['records_per_s'] or 0:12.0f} records/s "
+          f"peak RSS {(sampler.peak or 0) / 2**20:8.1f} MiB")
+    return result
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(work_directory, archive, workers=None):
+    archive_directory = os.path.join(work_directory, 'archive')
+    decompressed_directory = os.path.join(work_directory, 'decompressed')
+    cache_directory = os.path.join(work_directory, 'cache')
+    stages = []
+
+    start = time.perf_counter()
+    sources = write_archive(archive_directory, **archive)
+    print(f"Generated {len(sources)} rides in {time.perf_counter() - start:.2f} s")
+    files = len(sources)
+    source_bytes = sum(os.path.getsize(path) for path in sources)
+    records = files * len(range(0, archive['duration_s'], archive['sample_interval_s']))
+
+    stages.append(run_stage('find_and_decompress',
+                            lambda: find_and_decompress_fit_files(archive_directory, decompressed_directory),
+                            files, 0, bytes_read=sum(os.path.getsize(p) for p in sources if p.endswith('.gz')),
+                            output_directory=decompressed_directory))
+    def discovered():
+        return (source_path for source_path, _, _ in scan_fit_sources(archive_directory))
+    stages.append(run_stage('discover_sources', lambda: list(discovered()), files, 0))
+    stages.append(run_stage('process_fit_files',
+                            lambda: process_fit_files(discovered(), workers=workers),
+                            files, records, bytes_read=source_bytes))
+    stages.append(run_stage('decode_selected',
+                            lambda: process_fit_files(discovered(), workers=workers, fields=SCHEMA_RECORD_FIELDS),
+                            files, records, bytes_read=source_bytes))
+    stages.append(run_stage('ingest_cold',
+                            lambda: update_ingest_manifest(archive_directory, cache_directory, workers=workers),
+                            files, records, bytes_read=source_bytes, output_directory=cache_directory))
+    rides = {}
+    stages.append(run_stage('ingest_warm',
+                            lambda: rides.update(update_ingest_manifest(archive_directory, cache_directory,
+                                                                        workers=workers)),
+                            files, 0, output_directory=cache_directory))
+
+    cache_bytes = directory_bytes(cache_directory)
+    def summarize_each():
+        for entry in rides.values():
+            calculate_workout_summary(load_cached_ride(entry, cache_directory))
+    stages.append(run_stage('workout_summaries', summarize_each, files, records, bytes_read=cache_bytes))
+    stages.append(run_stage('summarize_rides',
+                            lambda: summarize_rides(load_cached_rides(rides, cache_directory)),
+                            files, records, bytes_read=cache_bytes))
+    return stages
+
+def compare_results(results, baseline):
+    """Prints each stage's time and throughput relative to a baseline results file."""
+    previous = {stage['stage']: stage for stage in baseline.get('stages', [])}
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'}:")
+    for stage in results['stages']:
+        before = previous.get(stage['stage'])
+        if not before or not before['seconds']:
+            continue
+        print(f"{stage['stage']:<20} {before['seconds']:8.2f} s -> {stage['seconds']:8.2f} s "
+              f"({stage['seconds'] / before['seconds']:5.2f}x time)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time each ingest stage on a synthetic FIT archive.')
+    add_archive_arguments(parser)
+    parser.add_argument('--workers', type=int, default=None, help='decode processes (default: one per CPU)')
+    parser.add_argument('--work-directory', help='scratch directory (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    archive = archive_options(args)
+    work_directory = args.work_directory or tempfile.mkdtemp(prefix='cyclingdata_bench_')
+    try:
+        stages = run_benchmarks(work_directory, archive, args.workers)
+    finally:
+        if not args.work_directory:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workers': args.workers,
+        'archive': archive,
+        'stages': stages,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(results, json.load(f))
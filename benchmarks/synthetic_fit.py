@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic .fit / .fit.gz rides for benchmarks.
+
+Writes minimal but valid FIT files (file_id, device_info, record, lap and
+session messages with correct header and file CRCs) that fitdecode reads like a head unit's
+export. Ride count, duration, sample interval, field mix and the share of
+gzipped files are configurable, and the content is deterministic for a
+given seed, so benchmark runs are comparable between versions.
+
+Usage: python benchmarks/synthetic_fit.py OUTPUT_DIR [--rides N] [--duration-s S] ...
+"""
+import argparse
+import gzip
+import math
+import os
+import random
+import struct
+
+FIT_EPOCH = 631065600  # 1989-12-31T00:00:00Z in Unix seconds
+DEFAULT_START = 1715000000  # 2024-05-06
+
+_CRC_TABLE = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+              0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+
+# FIT base type -> struct format
+_BASE_TYPE_FORMATS = {0x00: 'B', 0x01: 'b', 0x02: 'B', 0x84: 'H', 0x85: 'i', 0x86: 'I', 0x8C: 'I'}
+
+# record field group -> [(field number, base type)], in message order
+RECORD_FIELD_GROUPS = {
+    'gps': [(0, 0x85), (1, 0x85)],
+    'altitude': [(2, 0x84)],
+    'heart_rate': [(3, 0x02)],
+    'cadence': [(4, 0x02)],
+    'distance': [(5, 0x86)],
+    'speed': [(6, 0x84)],
+    'power': [(7, 0x84)],
+    'temperature': [(13, 0x01)],
+}
+DEFAULT_FIELDS = ['gps', 'altitude', 'heart_rate', 'cadence', 'distance', 'speed', 'power']
+
+_FILE_ID_FIELDS = [(0, 0x00), (1, 0x84), (2, 0x84), (3, 0x8C), (4, 0x86)]
+_SESSION_FIELDS = [(253, 0x86), (2, 0x86), (5, 0x00), (6, 0x00), (7, 0x86), (8, 0x86), (9, 0x86)]
+_LAP_FIELDS = [(253, 0x86), (2, 0x86), (7, 0x86), (8, 0x86), (9, 0x86)]
+_DEVICE_INFO_FIELDS = [(253, 0x86), (0, 0x02), (2, 0x84), (3, 0x8C), (4, 0x84)]
+
+def crc16(data, crc=0):
+    for byte in data:
+        tmp = _CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ _CRC_TABLE[byte & 0xF]
+        tmp = _CRC_TABLE[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ _CRC_TABLE[(byte >> 4) & 0xF]
+    return crc
+
+def _definition(local_type, global_number, fields):
+    message = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields))
+    for number, base_type in fields:
+        message += struct.pack('<BBB', number, struct.calcsize(_BASE_TYPE_FORMATS[base_type]), base_type)
+    return message
+
+def _data_struct(fields):
+    return struct.Struct('<B' + ''.join(_BASE_TYPE_FORMATS[base_type] for _, base_type in fields))
+
+def make_fit(start_unix, duration_s, sample_interval_s=1, fields=DEFAULT_FIELDS, serial=1234, seed=0):
+    """Returns the bytes of one synthetic ride of duration_s seconds."""
+    rnd = random.Random(seed)
+    start = start_unix - FIT_EPOCH
+    record_fields = [(253, 0x86)] + [field for group in fields for field in RECORD_FIELD_GROUPS[group]]
+    record = _data_struct(record_fields)
+
+    body = bytearray()
+    body += _definition(0, 0, _FILE_ID_FIELDS)
+    body += _data_struct(_FILE_ID_FIELDS).pack(0, 4, 1, 2697, serial, start)  # activity file, garmin edge
+    body += _definition(3, 23, _DEVICE_INFO_FIELDS)
+    body += _data_struct(_DEVICE_INFO_FIELDS).pack(3, start, 1, 1, serial + 1, 1)  # garmin hrm1 strap
+    body += _definition(1, 20, record_fields)
+
+    lat, lon, distance = 40.0, -105.0, 0.0
+    for t in range(0, duration_s, sample_interval_s):
+        speed = 8 + rnd.random()
+        distance += speed * sample_interval_s
+        lat += 0.00005 * sample_interval_s
+        values = {
+            'gps': (int(lat * 2**31 / 180), int(lon * 2**31 / 180)),
+            'altitude': (int((1600 + 20 * math.sin(t / 300) + 500) * 5),),
+            'heart_rate': (140 + t % 30,),
+            'cadence': (85 + t % 10,),
+            'distance': (int(distance * 100),),
+            'speed': (int(speed * 1000),),
+            'power': (max(0, int(200 + 80 * math.sin(t / 60) + rnd.gauss(0, 30))),),
+            'temperature': (20 + (t // 600) % 5,),
+        }
+        body += record.pack(1, start + t, *(value for group in fields for value in values[group]))
+
+    body += _definition(3, 19, _LAP_FIELDS)
+    body += _data_struct(_LAP_FIELDS).pack(3, start + duration_s, start, duration_s * 1000, duration_s * 1000,
+                                            int(distance * 100))
+    body += _definition(2, 18, _SESSION_FIELDS)
+    body += _data_struct(_SESSION_FIELDS).pack(2, start + duration_s, start, 2, 0, duration_s * 1000,
+                                                duration_s * 1000, int(distance * 100))
+    header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(body), b'.FIT')
+    header += struct.pack('<H', crc16(header))
+    fit = header + bytes(body)
+    return fit + struct.pack('<H', crc16(fit))
+
+def write_archive(output_directory, rides=10, duration_s=3600, sample_interval_s=1, fields=DEFAULT_FIELDS,
+                  gzip_fraction=0.5, rides_per_directory=100, seed=0):
+    """
+    Writes rides synthetic rides (one per day) under output_directory, in
+    subdirectories of rides_per_directory files. About gzip_fraction of them
+    are written as .fit.gz. Returns the list of written paths.
+    """
+    paths = []
+    gzip_every = round(1 / gzip_fraction) if gzip_fraction > 0 else 0
+    for i in range(rides):
+        directory = os.path.join(output_directory, f'batch{i // rides_per_directory:04d}')
+        os.makedirs(directory, exist_ok=True)
+        fit = make_fit(DEFAULT_START + i * 86400, duration_s, sample_interval_s, fields,
+                       serial=1000 + i % 2, seed=seed + i)
+        if gzip_every and i % gzip_every == gzip_every - 1:
+            path = os.path.join(directory, f'ride{i:05d}.fit.gz')
+            with gzip.open(path, 'wb') as f:
+                f.write(fit)
+        else:
+            path = os.path.join(directory, f'ride{i:05d}.fit')
+            with open(path, 'wb') as f:
+                f.write(fit)
+        paths.append(path)
+    return paths
+
+def add_archive_arguments(parser):
+    parser.add_argument('--rides', type=int, default=20, help='number of rides to generate')
+    parser.add_argument('--duration-s', type=int, default=3600, help='length of each ride in seconds')
+    parser.add_argument('--sample-interval-s', type=int, default=1, help='seconds between records')
+    parser.add_argument('--fields', default=','.join(DEFAULT_FIELDS),
+                        help=f"comma-separated record fields, from: {', '.join(RECORD_FIELD_GROUPS)}")
+    parser.add_argument('--gzip-fraction', type=float, default=0.5, help='share of rides written as .fit.gz')
+    parser.add_argument('--seed', type=int, default=0)
+
+def archive_options(args):
+    fields = [field for field in args.fields.split(',') if field]
+    unknown = [field for field in fields if field not in RECORD_FIELD_GROUPS]
+    if unknown:
+        raise SystemExit(f"Unknown record fields: {', '.join(unknown)}")
+    return {'rides': args.rides, 'duration_s': args.duration_s, 'sample_interval_s': args.sample_interval_s,
+            'fields': fields, 'gzip_fraction': args.gzip_fraction, 'seed': args.seed}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output_directory')
+    add_archive_arguments(parser)
+    args = parser.parse_args()
+    written = write_archive(args.output_directory, **archive_options(args))
+    print(f"Wrote {len(written)} rides to {args.output_directory}")
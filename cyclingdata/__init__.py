@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+CyclingData: ingest, summarize and browse TrainingPeaks .fit/.fit.gz ride archives.
+
+Importing the package has no side effects and pulls in no heavy
+dependencies; import the modules you need (cyclingdata.fit_ingest,
+cyclingdata.power_metrics, ...) or use the command line (python -m cyclingdata).
+"""
+__version__ = '0.1.0'
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""python -m cyclingdata: see cyclingdata.cli."""
+import sys
+from cyclingdata.cli import main
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Command-line entry point: cyclingdata ingest | watch | summarize | segment | serve.
+
+    cyclingdata ingest --root D:/rides --cache-dir D:/rides/cache --workers 4
+    cyclingdata watch --root D:/rides
+    cyclingdata summarize --cache-dir D:/rides/cache --plot
+    cyclingdata segment --cache-dir D:/rides/cache --points "40.01,-105.27;40.03,-105.29"
+    cyclingdata serve --root D:/rides --app graphs --port 8000
+    cyclingdata serve --cache-dir D:/rides/cache --production --web-workers 4
+
+The archive root and cache directory can also come from the CYCLINGDATA_ROOT
+and CYCLINGDATA_CACHE environment variables. Only argparse is imported up
+front; pandas, fitdecode, Dash and matplotlib are imported by the command
+that needs them, so --help and decode workers start quickly.
+"""
+import argparse
+import os
+import sys
+from cyclingdata.config import CACHE_ENV_VAR, ROOT_ENV_VAR
+
+DEFAULT_CACHE_SUBDIRECTORY = 'cache'
+SCHEMA_FIELDS_OPTION = 'schema'
+WATCH_REFRESH_INTERVAL_S = 3
+
+def run_ingest(root_directory, cache_directory, decompressed_directory=None, workers=None,
+               profile_mode=None, metrics_log_path=None, fields=None):
+    """
+    Brings the ride cache in line with the files under root_directory and
+    prints the stage timings. fields selects the record fields to decode (see
+    fit_ingest.decode_ride). Returns the manifest entries of the rides that
+    have record data, keyed by source path.
+    """
+    from cyclingdata.fit_ingest import update_ingest_manifest
+    from cyclingdata.instrumentation import enable_json_log, print_metrics, profile_capture
+
+    if metrics_log_path:
+        enable_json_log(metrics_log_path)
+    with profile_capture('ingest', profile_mode):
+        rides = update_ingest_manifest(root_directory, cache_directory, decompressed_directory, workers=workers,
+                                       fields=fields)
+    duplicates = sum(1 for entry in rides.values() if entry.get('duplicate_of'))
+    rides = {source_path: entry for source_path, entry in rides.items() if entry.get('cache_file')}
+    if rides:
+        print(f"\nIndexed {len(rides)} rides.")
+    else:
+        print("Warning: No workout data available. Please check the root directory.")
+    if duplicates:
+        print(f"Skipped {duplicates} files that duplicate an indexed ride.")
+    print_metrics()
+    return rides
+
+def _resolve_directories(parser, args, root_required):
+    args.root = args.root or os.environ.get(ROOT_ENV_VAR)
+    args.cache_dir = args.cache_dir or os.environ.get(CACHE_ENV_VAR)
+    if root_required and not args.root:
+        parser.error(f"--root (or {ROOT_ENV_VAR}) is required")
+    if not args.cache_dir:
+        if not args.root:
+            parser.error(f"--cache-dir (or {CACHE_ENV_VAR}) is required without --root")
+        args.cache_dir = os.path.join(args.root, DEFAULT_CACHE_SUBDIRECTORY)
+
+def _decode_fields(args):
+    """--fields as a decode_ride selection: None, the declared record fields, or the listed fields."""
+    if not args.fields:
+        return None
+    if args.fields == SCHEMA_FIELDS_OPTION:
+        from cyclingdata.fit_ingest import SCHEMA_RECORD_FIELDS
+        return SCHEMA_RECORD_FIELDS
+    return tuple(field.strip() for field in args.fields.split(',') if field.strip())
+
+def _check_fields(parser, args):
+    """Reports unknown --fields names up front instead of from a decode worker after the archive walk."""
+    fields = _decode_fields(args)
+    if fields is None:
+        return
+    from cyclingdata.fit_ingest import record_field_selection
+    try:
+        record_field_selection(fields)
+    except ValueError as e:
+        parser.error(f"--fields: {e}")
+
+def _load_rides(args):
+    """Ingests first when an archive root is given, otherwise uses the cache as it is."""
+    from cyclingdata.fit_ingest import cached_rides
+
+    if args.root and not getattr(args, 'no_ingest', False):
+        return run_ingest(args.root, args.cache_dir, args.decompressed_dir, args.workers,
+                          args.profile, args.metrics_log, _decode_fields(args))
+    return cached_rides(args.cache_dir)
+
+def command_ingest(parser, args):
+    _resolve_directories(parser, args, root_required=True)
+    run_ingest(args.root, args.cache_dir, args.decompressed_dir, args.workers, args.profile, args.metrics_log,
+               _decode_fields(args))
+
+def start_watcher(args):
+    """Starts a RideWatcher ingesting rides that arrive under --root, see ride_watcher.py."""
+    from cyclingdata.ride_watcher import RideWatcher
+
+    watcher = RideWatcher(args.root, args.cache_dir, args.decompressed_dir, _decode_fields(args),
+                          poll_interval_s=args.poll_interval, use_events=not args.poll)
+    return watcher.start()
+
+def command_watch(parser, args):
+    _resolve_directories(parser, args, root_required=True)
+    import time
+
+    run_ingest(args.root, args.cache_dir, args.decompressed_dir, args.workers, args.profile, args.metrics_log,
+               _decode_fields(args))
+    watcher = start_watcher(args)
+    print(f"Watching {args.root} for new rides (Ctrl+C to stop).")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+def command_summarize(parser, args):
+    _resolve_directories(parser, args, root_required=False)
+    from cyclingdata.report import plot_summary_report, print_summary_report
+
+    rides = _load_rides(args)
+    summaries, season = print_summary_report(rides, args.cache_dir, args.ftp, show_columns=args.columns)
+    if args.plot:
+        plot_summary_report(summaries, season)
+
+def _segment_points(parser, text):
+    try:
+        points = [tuple(float(value) for value in point.split(',')) for point in text.split(';') if point.strip()]
+    except ValueError:
+        points = []
+    if len(points) < 2 or any(len(point) != 2 for point in points):
+        parser.error('--points needs at least two "lat,lon" points separated by ";"')
+    return points
+
+def command_segment(parser, args):
+    _resolve_directories(parser, args, root_required=False)
+    import pandas as pd
+    from cyclingdata.route_index import find_segment_efforts
+
+    points = _segment_points(parser, args.points)
+    rides = _load_rides(args)
+    efforts = find_segment_efforts(args.cache_dir, rides, points, args.radius)
+    if efforts.empty:
+        print("No rides pass through this segment.")
+        return
+    table = pd.DataFrame({
+        'ride': [os.path.basename(ride_id) for ride_id in efforts['ride_id']],
+        'start': efforts['start_time'],
+        'elapsed': pd.to_timedelta(efforts['elapsed_s'].round(), unit='s'),
+        'km': (efforts['distance_m'] / 1000).round(2),
+        'km/h': (efforts['mean_speed'] * 3.6).round(1),
+        'W': efforts['mean_power'].round(),
+        'bpm': efforts['mean_heart_rate'].round(),
+    })
+    print(table.head(args.limit).to_string(index=False))
+    print(f"\n{len(efforts)} efforts on {efforts['ride_id'].nunique()} rides.")
+
+def command_serve(parser, args):
+    _resolve_directories(parser, args, root_required=False)
+    if args.app == 'graphs':
+        from cyclingdata import graphs_app as dashboard_app
+        options = {'ftp_watts': args.ftp, 'cp_watts': args.cp, 'w_prime_joules': args.w_prime}
+    else:
+        from cyclingdata import summary_app as dashboard_app
+        options = {'ftp_watts': args.ftp}
+
+    rides = _load_rides(args)
+    port = args.port or dashboard_app.DEFAULT_PORT
+    if args.watch:
+        if not args.root:
+            parser.error(f"--watch needs --root (or {ROOT_ENV_VAR})")
+        start_watcher(args)
+    refresh_interval = args.refresh_interval or (WATCH_REFRESH_INTERVAL_S if args.watch else None)
+    if refresh_interval:
+        options['live_refresh_s'] = refresh_interval
+    if args.production:
+        from cyclingdata.serving import create_production_app, run_production_server
+        app = create_production_app(args.app, args.cache_dir, rides, profile_mode=args.profile, **options)
+        run_production_server(app, args.host, port, args.web_workers, args.threads)
+        return
+    app = dashboard_app.create_app(args.cache_dir, rides, profile_mode=args.profile, **options)
+    # the debug reloader would run a second watcher in its child process
+    app.run(host=args.host, port=port, debug=args.debug, use_reloader=args.debug and not args.watch)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cyclingdata', description='Ingest, summarize and browse .fit ride archives.')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--root', help=f'directory with the .fit/.fit.gz files (default: ${ROOT_ENV_VAR})')
+    common.add_argument('--cache-dir', help=f'ingest manifest and ride cache (default: ${CACHE_ENV_VAR} or ROOT/cache)')
+    common.add_argument('--decompressed-dir', help='also keep decompressed .fit copies of .fit.gz files here')
+    common.add_argument('--workers', type=int, default=None, help='decode processes (default: one per CPU)')
+    common.add_argument('--fields', help=f"decode only these record fields, e.g. record.timestamp,record.power, "
+                                         f"or '{SCHEMA_FIELDS_OPTION}' for the declared ones (default: all fields)")
+    common.add_argument('--profile', choices=['cprofile', 'pyinstrument'], help='write a profile to profiles/')
+    common.add_argument('--metrics-log', help='append JSON stage timings to this file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', parents=[common], help='decode new and changed rides into the cache')
+    ingest.set_defaults(handler=command_ingest, command_parser=ingest)
+
+    watch_options = argparse.ArgumentParser(add_help=False)
+    watch_options.add_argument('--poll', action='store_true',
+                               help='poll for new rides even when watchdog is installed (for folders without events)')
+    watch_options.add_argument('--poll-interval', type=float, default=1.0, help='seconds between polls (default: 1)')
+
+    watch = subparsers.add_parser('watch', parents=[common, watch_options],
+                                  help='ingest, then keep ingesting rides as they arrive under --root')
+    watch.set_defaults(handler=command_watch, command_parser=watch)
+
+    summarize = subparsers.add_parser('summarize', parents=[common],
+                                      help='print ride summaries, weekly totals, zones and the season power curve '
+                                           '(ingests first when --root is given)')
+    summarize.add_argument('--ftp', type=float, default=250, help='FTP in watts for the power zones')
+    summarize.add_argument('--columns', action='store_true', help="also list each ride's columns")
+    summarize.add_argument('--plot', action='store_true', help='show the charts (needs matplotlib and seaborn)')
+    summarize.set_defaults(handler=command_summarize, command_parser=summarize)
+
+    segment = subparsers.add_parser('segment', parents=[common],
+                                    help='list the efforts on a segment across all rides, fastest first '
+                                         '(ingests first when --root is given)')
+    segment.add_argument('--points', required=True,
+                         help='start;[points along the route;]end as "lat,lon;lat,lon" in degrees')
+    segment.add_argument('--radius', type=float, default=30, help='metres a track may pass from each point (default: 30)')
+    segment.add_argument('--limit', type=int, default=50, help='efforts to print (default: 50)')
+    segment.set_defaults(handler=command_segment, command_parser=segment)
+
+    serve = subparsers.add_parser('serve', parents=[common, watch_options], help='run a Dash dashboard (ingests first when --root is given)')
+    serve.add_argument('--app', choices=['graphs', 'summary'], default='graphs')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=None, help='default: 8000 for graphs, 8050 for summary')
+    serve.add_argument('--debug', action='store_true', help="run Dash's debug server with hot reloading")
+    serve.add_argument('--production', action='store_true',
+                       help='serve from the memory-mapped serving store with gunicorn or waitress (see serving.py)')
+    serve.add_argument('--web-workers', type=int, default=None, help='--production server processes (default: up to 4)')
+    serve.add_argument('--threads', type=int, default=None, help='--production threads per server process (default: 4)')
+    serve.add_argument('--watch', action='store_true',
+                       help='keep ingesting rides that arrive under --root and add them to the dropdown')
+    serve.add_argument('--refresh-interval', type=float, default=None,
+                       help=f'seconds between dropdown checks for new rides (default: {WATCH_REFRESH_INTERVAL_S} with --watch, '
+                            'otherwise never; set it to see rides a separate `cyclingdata watch` ingests)')
+    serve.add_argument('--no-ingest', action='store_true', help='serve the cache as it is, even with --root')
+    serve.add_argument('--ftp', type=float, default=250, help='FTP in watts for IF, TSS and the training load chart')
+    serve.add_argument('--cp', type=float, default=250, help="critical power in watts for W' balance")
+    serve.add_argument('--w-prime', type=float, default=20000, help="W' in joules")
+    serve.set_defaults(handler=command_serve, command_parser=serve)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    _check_fields(args.command_parser, args)
+    args.handler(args.command_parser, args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
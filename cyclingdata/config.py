@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+Environment variables shared by the command line and the serving entry
+points. Kept free of imports so the CLI can read them before anything heavy
+is loaded.
+"""
+ROOT_ENV_VAR = 'CYCLINGDATA_ROOT' # archive root with the .fit/.fit.gz files
+CACHE_ENV_VAR = 'CYCLINGDATA_CACHE' # ingest manifest and ride cache
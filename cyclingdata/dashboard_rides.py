@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+The rides a dashboard lists, shared by graphs_app and summary_app.
+
+DashboardRides holds the lightweight index of ingested rides (source path
+-> manifest entry) and their date/sport/device listing from the ride index.
+Ride DataFrames are never loaded here; the apps load them on selection.
+
+refresh replaces the rides and listing when the ingest manifest changes,
+also when another process ingested. The ingest syncs the ride index before
+it saves the manifest, and the stamp is read before the index, so a new
+stamp is never paired with an index that lacks its rides. version counts
+the replacements so browsers only fetch the dropdown options again when
+they changed. Dash serves callbacks from several threads, so a lock makes
+sure only one of them reloads.
+"""
+import threading
+import dash
+from dash import dcc
+from dash import html
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from cyclingdata.fit_ingest import load_manifest, manifest_stamp
+from cyclingdata.ride_index import listing_choices, query_ride_listing, ride_listing_options
+
+class DashboardRides:
+    """
+    Rides (source path -> manifest entry) of the cache in cache_directory and
+    their listing. on_changed(source_path), if given, is called by refresh for
+    every ride that was re-ingested or removed, to drop its loaded data.
+    """
+
+    def __init__(self, cache_directory, rides, on_changed=None):
+        self.cache_directory = cache_directory
+        self.on_changed = on_changed
+        self.entries = {}
+        self.listing = None
+        self.version = 0
+        self.stamp = None
+        self._lock = threading.Lock()
+        self.set_rides(rides)
+
+    def set_rides(self, rides):
+        """Makes rides the listed rides and reloads their listing from the ride index."""
+        self.stamp = manifest_stamp(self.cache_directory)
+        self.entries = {source_path: entry for source_path, entry in rides.items() if entry.get('cache_file')}
+        self.listing = query_ride_listing(self.cache_directory)
+        self.version += 1
+
+    def get(self, source_path):
+        """The manifest entry of a listed ride, or None."""
+        return self.entries.get(source_path)
+
+    def refresh(self):
+        """Picks up rides ingested since the listing was loaded; True if it changed."""
+        with self._lock:
+            if manifest_stamp(self.cache_directory) == self.stamp:
+                return False
+            previous = self.entries
+            self.set_rides(load_manifest(self.cache_directory)['rides'])
+        if self.on_changed is not None:
+            for source_path, entry in previous.items():
+                if self.entries.get(source_path, {}).get('sha1') != entry['sha1']:
+                    self.on_changed(source_path)
+        return True
+
+    def options(self, sport=None, device=None):
+        """Dropdown options of the rides matching the sport and device filters."""
+        return ride_listing_options(self.listing, self.entries, sport, device)
+
+    def layout(self, live_refresh_s=None):
+        """The sport/device filters, the ride selector and the refresh timer and version store."""
+        return [
+            html.Div([
+                dcc.Dropdown(id='sport-filter', options=listing_choices(self.listing, 'sport'),
+                             placeholder="All sports"),
+                dcc.Dropdown(id='device-filter', options=listing_choices(self.listing, 'device'),
+                             placeholder="All devices"),
+            ]),
+            dcc.Dropdown(id='file-selector', options=self.options(), placeholder="Select a .fit file"),
+            dcc.Interval(id='ride-refresh', interval=(live_refresh_s or 60) * 1000, disabled=not live_refresh_s),
+            dcc.Store(id='listing-version', data=self.version),
+        ]
+
+    def update_options(self, sport, device, n_intervals=None, client_version=None):
+        """
+        (ride options, sport choices, device choices, listing version) for the
+        filters. Refresh ticks only send them when the listing changed since
+        the browser last got them.
+        """
+        refreshed = self.refresh()
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+        if triggered == ['ride-refresh.n_intervals'] and not refreshed and client_version == self.version:
+            raise PreventUpdate
+        return (self.options(sport, device), listing_choices(self.listing, 'sport'),
+                listing_choices(self.listing, 'device'), self.version)
+
+    def register_callback(self, app, extra_selectors=()):
+        """
+        Registers the listing callback: the filters and refresh ticks update
+        file-selector and every component id in extra_selectors (more ride
+        dropdowns) with the matching rides.
+        """
+        selectors = ['file-selector', *extra_selectors]
+
+        def update_ride_options(sport, device, n_intervals=None, client_version=None):
+            options, sports, devices, version = self.update_options(sport, device, n_intervals, client_version)
+            return (*[options] * len(selectors), sports, devices, version)
+
+        app.callback([Output(selector, 'options') for selector in selectors]
+                     + [Output('sport-filter', 'options'), Output('device-filter', 'options'),
+                        Output('listing-version', 'data')],
+                     [Input('sport-filter', 'value'), Input('device-filter', 'value'),
+                      Input('ride-refresh', 'n_intervals')],
+                     [State('listing-version', 'data')])(update_ride_options)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Server-side downsampling for time-series figures.
+
+A long ride has far more 1 Hz samples than a graph has pixels. Reducing each
+trace to a couple of points per pixel before it is sent to the browser keeps
+the callback payload small without visibly changing the line:
+
+* min/max bucketing keeps the lowest and highest sample of every pixel-wide
+  bucket, so spikes (sprints, HR peaks) always survive;
+* LTTB (Largest-Triangle-Three-Buckets) keeps the one sample per bucket that
+  best preserves the shape of the line.
+
+Both return sample positions, so the caller can pick the matching x values,
+hover data etc. from the original arrays.
+"""
+import numpy as np
+import pandas as pd
+
+DEFAULT_PLOT_WIDTH_PX = 1200
+
+def _as_float(values):
+    """float64 view of numeric or datetime values; datetimes become epoch nanoseconds."""
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy(dtype='datetime64[ns]').astype('int64').astype('float64')
+    return values.to_numpy(dtype='float64', na_value=np.nan)
+
+def minmax_indices(y, n_out):
+    """
+    Positions of the min and max sample in each of n_out // 2 equal buckets,
+    plus the first and last sample, in ascending order. NaNs are ignored.
+    """
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    buckets = max(n_out // 2, 1)
+    bucket_size = -(-n // buckets)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, bucket_size)
+
+    # all-NaN buckets are skipped, not passed to nanargmin/nanargmax
+    valid = ~np.all(np.isnan(padded), axis=1)
+    rows = np.flatnonzero(valid)
+    filled_low = np.where(np.isnan(padded[valid]), np.inf, padded[valid])
+    filled_high = np.where(np.isnan(padded[valid]), -np.inf, padded[valid])
+    low = rows * bucket_size + np.argmin(filled_low, axis=1)
+    high = rows * bucket_size + np.argmax(filled_high, axis=1)
+    return np.unique(np.concatenate(([0], low, high, [n - 1])))
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: positions of n_out samples that best keep
+    the visual shape of the (x, y) line. x must be increasing; y must not
+    contain NaNs (drop them first, see downsample).
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets between the first and last sample, which are always kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        # twice the area of the triangle (previous point, candidate, next bucket average)
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+def downsample(x, y, n_out, method='minmax'):
+    """
+    Reduces an (x, y) series to about n_out points with 'minmax' or 'lttb'.
+    Samples where y is missing are dropped first. Returns the selected (x, y)
+    values as Series in their original dtypes.
+    """
+    x = pd.Series(x).reset_index(drop=True)
+    y = pd.Series(y).reset_index(drop=True)
+    present = np.flatnonzero(y.notna().to_numpy())
+    if len(present) > n_out:
+        y_values = _as_float(y.iloc[present])
+        if method == 'lttb':
+            chosen = lttb_indices(_as_float(x.iloc[present]), y_values, n_out)
+        elif method == 'minmax':
+            chosen = minmax_indices(y_values, n_out)
+        else:
+            raise ValueError(f"Unknown downsampling method: {method}")
+        present = present[chosen]
+    return x.iloc[present].reset_index(drop=True), y.iloc[present].reset_index(drop=True)
+
+def points_for_width(plot_width_px=DEFAULT_PLOT_WIDTH_PX, method='minmax'):
+    """Number of points to keep for a plot plot_width_px pixels wide."""
+    return 2 * plot_width_px if method == 'minmax' else plot_width_px
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Selective, columnar FIT decoding.
+
+fitdecode turns every message of a file into a frame object and every field
+into a FieldData, developer and unknown fields included, before the caller
+can look at it. decode_fit_columns instead takes the messages and fields the
+caller needs, e.g. ['record.timestamp', 'record.power', 'record.heart_rate'],
+and walks the file's message headers only: messages of other types, and the
+bytes of unselected fields and developer fields, are stepped over without
+being unpacked. The positions of the selected messages are collected per
+message type and their fields are gathered into typed NumPy columns in one
+step at the end, so the cost per message is a few integer operations.
+
+Field names, scale/offset, enums and subfields come from fitdecode's
+profile, so values match what fitdecode reports: scaled fields are floats,
+date_time fields are UTC datetimes, enums are their names and invalid values
+are missing. Array-valued and byte fields are not decoded, and file CRCs are
+not checked (fitdecode only warns about them by default). Decoding errors
+raise fitdecode's FitError subclasses.
+
+fit_fingerprint uses the same scan to identify an activity independently of
+its file name and compression, for duplicate detection during ingest.
+"""
+import hashlib
+import struct
+import numpy as np
+import pandas as pd
+from fitdecode import profile
+from fitdecode.exceptions import FitEOFError, FitHeaderError, FitParseError
+from fitdecode.processors import FIT_DATETIME_MIN, FIT_UTC_REFERENCE
+from fitdecode.types import BASE_TYPES
+
+TIMESTAMP_FIELD_NUMBER = 253
+STRING_BASE_TYPE = 0x07
+ZERO_INVALID_BASE_TYPES = {0x0a, 0x8b, 0x8c, 0x90}  # uint8z, uint16z, uint32z, uint64z
+
+MESSAGE_NUMBERS = {message.name: number for number, message in profile.MESSAGE_TYPES.items()}
+
+_HEADER = struct.Struct('<BBHI4s')
+
+def _message_field_names(message_type):
+    """name -> (field, parent def_num or None) for a message's fields and subfields."""
+    names = {}
+    for def_num, field in message_type.fields.items():
+        names[field.name] = (field, None)
+        for subfield in field.subfields or ():
+            names.setdefault(subfield.name, (subfield, def_num))
+    return names
+
+def parse_field_selection(fields):
+    """
+    Normalizes a field selection to {message name: tuple of field names}.
+
+    fields is an iterable of 'message.field' names ('record.power',
+    'file_id.garmin_product') or a mapping of message name -> field names.
+    Unknown message or field names raise ValueError.
+    """
+    if hasattr(fields, 'items'):
+        pairs = [(message, name) for message, names in fields.items() for name in names]
+    else:
+        pairs = []
+        for qualified in fields:
+            message, sep, name = qualified.partition('.')
+            if not sep or not name:
+                raise ValueError(f"Expected 'message.field', got {qualified!r}")
+            pairs.append((message, name))
+
+    selection = {}
+    for message, name in pairs:
+        if message not in MESSAGE_NUMBERS:
+            raise ValueError(f"Unknown FIT message type: {message!r}")
+        if name not in _message_field_names(profile.MESSAGE_TYPES[MESSAGE_NUMBERS[message]]):
+            raise ValueError(f"Unknown field {name!r} in FIT message {message!r}")
+        names = selection.setdefault(message, [])
+        if name not in names:
+            names.append(name)
+    return {message: tuple(names) for message, names in selection.items()}
+
+class _MessagePlan:
+    """The selected fields of one message type, and where its messages were found."""
+
+    def __init__(self, message_type, names):
+        known = _message_field_names(message_type)
+        self.name = message_type.name
+        self.outputs = []  # (column name, field or subfield, def_num of the stored value, ref fields)
+        self.def_nums = set()
+        for name in names:
+            field, parent = known[name]
+            def_num = field.def_num if parent is None else parent
+            ref_fields = [] if parent is None else [(ref.def_num, ref.raw_value) for ref in field.ref_fields]
+            self.outputs.append((name, field, def_num, ref_fields))
+            self.def_nums.add(def_num)
+            self.def_nums.update(ref_num for ref_num, _ in ref_fields)
+        self.offsets = []  # start of every message's content in the data
+        self.runs = []  # (index of the first message, definition) whenever the definition changes
+        self.compressed_timestamps = {}  # message index -> timestamp from a compressed header
+        self.definition = None
+
+class _Definition:
+    """A definition message: layout of the data messages using its local type."""
+
+    def __init__(self, layout, endian, global_number, field_defs, size, plan):
+        self.layout = layout
+        self.endian = endian
+        self.global_number = global_number
+        self.size = size
+        self.plan = plan
+        self.timestamp_offset = None
+        self.timestamp_struct = None
+        self.fields = {}  # def_num -> (offset in the message, base type identifier, size)
+        offset = 0
+        for def_num, field_size, base_type in field_defs:
+            if def_num not in self.fields:
+                self.fields[def_num] = (offset, base_type, field_size)
+            if def_num == TIMESTAMP_FIELD_NUMBER and field_size == 4:
+                self.timestamp_offset = offset
+                self.timestamp_struct = struct.Struct(endian + 'I')
+            offset += field_size
+
+def _field_dtype(endian, base_type, field_size):
+    """NumPy dtype of one stored field, or None for array and byte fields."""
+    if base_type == STRING_BASE_TYPE:
+        return np.dtype(f'S{field_size}')
+    base = BASE_TYPES.get(base_type)
+    if base is None or base.size != field_size:
+        return None
+    return np.dtype(endian + base.fmt)
+
+def _read_definition(data, pos, end, has_developer_fields):
+    """Parses a definition message at pos. Returns (raw definition bytes, end position)."""
+    if pos + 5 > end:
+        raise FitEOFError(5, end - pos, pos)
+    field_count = data[pos + 4]
+    content_end = pos + 5 + 3 * field_count
+    if has_developer_fields:
+        if content_end >= end:
+            raise FitEOFError(1, 0, content_end)
+        content_end += 1 + 3 * data[content_end]
+    if content_end > end:
+        raise FitEOFError(content_end - pos, end - pos, pos)
+    return data[pos:content_end], content_end
+
+def _build_definition(raw, has_developer_fields, plans):
+    endian = '>' if raw[1] else '<'
+    global_number = struct.unpack_from(endian + 'H', raw, 2)[0]
+    field_count = raw[4]
+    field_defs = [tuple(raw[5 + 3 * i:8 + 3 * i]) for i in range(field_count)]
+    size = sum(field_size for _, field_size, _ in field_defs)
+    if has_developer_fields:
+        start = 5 + 3 * field_count
+        # developer fields are only stepped over
+        size += sum(raw[start + 1 + 3 * i + 1] for i in range(raw[start]))
+    return _Definition(bytes(raw), endian, global_number, field_defs, size, plans.get(global_number))
+
+def _scan(data, plans):
+    """Walks every FIT file in data and records the positions of the selected messages in plans."""
+    length = len(data)
+    pos = 0
+    accumulated_timestamp = 0
+    timestamp_definition = None  # last message with a timestamp field, read only when needed
+    timestamp_pos = 0
+    known_definitions = {}
+    while pos < length:
+        if length - pos < _HEADER.size:
+            raise FitHeaderError(f'Truncated FIT header at offset {pos}')
+        header_size, _, _, data_size, signature = _HEADER.unpack_from(data, pos)
+        if signature != b'.FIT' or header_size < _HEADER.size:
+            raise FitHeaderError(f'Invalid FIT header at offset {pos}')
+        pos += header_size
+        end = pos + data_size
+        if end + 2 > length:
+            raise FitEOFError(end + 2 - pos, length - pos, pos)
+
+        definitions = {}
+        while pos < end:
+            record_header = data[pos]
+            pos += 1
+            if record_header & 0x80:
+                # compressed timestamp header: 5-bit offset from the last timestamp
+                definition = definitions.get((record_header >> 5) & 0x03)
+                if definition is None:
+                    raise FitParseError(pos - 1, f'local message {(record_header >> 5) & 0x03} not defined')
+                if timestamp_definition is not None:
+                    value = timestamp_definition.timestamp_struct.unpack_from(
+                        data, timestamp_pos + timestamp_definition.timestamp_offset)[0]
+                    if value != 0xFFFFFFFF:
+                        accumulated_timestamp = value
+                    timestamp_definition = None
+                time_offset = record_header & 0x1F
+                accumulated_timestamp = (accumulated_timestamp & ~0x1F) + time_offset + (
+                    0x20 if time_offset < (accumulated_timestamp & 0x1F) else 0)
+                plan = definition.plan
+                if plan is not None:
+                    if plan.definition is not definition:
+                        plan.runs.append((len(plan.offsets), definition))
+                        plan.definition = definition
+                    plan.compressed_timestamps[len(plan.offsets)] = accumulated_timestamp
+                    plan.offsets.append(pos)
+                pos += definition.size
+            elif record_header & 0x40:
+                raw, pos = _read_definition(data, pos, end, record_header & 0x20)
+                definition = known_definitions.get(raw)
+                if definition is None:
+                    definition = known_definitions[raw] = _build_definition(raw, record_header & 0x20, plans)
+                definitions[record_header & 0x0F] = definition
+            else:
+                definition = definitions.get(record_header & 0x0F)
+                if definition is None:
+                    raise FitParseError(pos - 1, f'local message {record_header & 0x0F} not defined')
+                plan = definition.plan
+                if plan is not None:
+                    if plan.definition is not definition:
+                        plan.runs.append((len(plan.offsets), definition))
+                        plan.definition = definition
+                    plan.offsets.append(pos)
+                if definition.timestamp_offset is not None:
+                    timestamp_definition, timestamp_pos = definition, pos
+                pos += definition.size
+        if pos > end:
+            raise FitEOFError(pos - end, 0, end)
+        pos = end + 2  # file CRC
+
+def _invalid_mask(values, base_type):
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    if base_type in ZERO_INVALID_BASE_TYPES:
+        return values == 0
+    return values == np.iinfo(values.dtype).max
+
+def _render(field, values, base_type, missing):
+    """Converts raw values of one field to a Series the way fitdecode reports them."""
+    if values.dtype.kind == 'S':
+        decoded = [v.split(b'\0', 1)[0].decode('utf-8', errors='replace') or None for v in values]
+        return pd.Series(decoded, dtype=object)
+
+    missing = missing | _invalid_mask(values, base_type)
+    field_type = field.type
+    if getattr(field_type, 'name', None) == 'date_time':
+        seconds = values.astype('int64')
+        missing = missing | (seconds < FIT_DATETIME_MIN)
+        seconds = np.where(missing, 0, seconds + FIT_UTC_REFERENCE)
+        timestamps = pd.Series(seconds.astype('datetime64[s]')).dt.tz_localize('UTC')
+        return timestamps.mask(missing)
+    if field_type.enum:
+        names = [None if m else field_type.enum.get(v, v) for v, m in zip(values.tolist(), missing.tolist())]
+        return pd.Series(names, dtype=object)
+    if field.scale or field.offset:
+        scaled = values.astype('float64')
+        if field.scale:
+            scaled /= field.scale
+        if field.offset:
+            scaled -= field.offset
+        scaled[missing] = np.nan
+        return pd.Series(scaled)
+    if values.dtype.kind == 'f':
+        return pd.Series(values.astype(values.dtype.newbyteorder('=')))
+    return pd.Series(pd.arrays.IntegerArray(values.astype(values.dtype.newbyteorder('=')), missing))
+
+def _decode_run(u8, plan, offsets, definition, compressed_timestamps, first_index):
+    """Gathers and renders the selected fields of consecutive messages sharing one definition."""
+    count = len(offsets)
+    names, formats, field_offsets = [], [], []
+    base_types = {}
+    for def_num in sorted(plan.def_nums):
+        if def_num not in definition.fields:
+            continue
+        offset, base_type, field_size = definition.fields[def_num]
+        dtype = _field_dtype(definition.endian, base_type, field_size)
+        if dtype is not None:
+            names.append(str(def_num))
+            formats.append(dtype)
+            field_offsets.append(offset)
+            base_types[def_num] = base_type
+
+    raw = {}
+    if names and definition.size:
+        rows = u8[offsets[:, None] + np.arange(definition.size)]
+        records = rows.view(np.dtype({'names': names, 'formats': formats, 'offsets': field_offsets,
+                                      'itemsize': definition.size})).ravel()
+        raw = {int(name): records[name] for name in names}
+
+    columns = {}
+    no_missing = np.zeros(count, dtype=bool)
+    for name, field, def_num, ref_fields in plan.outputs:
+        if def_num == TIMESTAMP_FIELD_NUMBER and compressed_timestamps:
+            values = raw.get(def_num, np.full(count, 0xFFFFFFFF, dtype=np.uint32)).astype(np.uint32)
+            for index, timestamp in compressed_timestamps.items():
+                if first_index <= index < first_index + count:
+                    values[index - first_index] = timestamp
+            columns[name] = _render(field, values, 0x86, no_missing)
+            continue
+        if def_num not in raw:
+            continue
+        missing = no_missing
+        if ref_fields:
+            # a subfield only applies where its reference field has one of the listed values
+            applies = np.zeros(count, dtype=bool)
+            for ref_num, ref_value in ref_fields:
+                if ref_num in raw:
+                    applies |= raw[ref_num] == ref_value
+            if not applies.any():
+                continue
+            missing = ~applies
+        columns[name] = _render(field, raw[def_num], base_types[def_num], missing)
+    return count, columns
+
+def _concat_runs(runs):
+    """Concatenates per-run columns; runs without a column get missing values of the same dtype."""
+    total = sum(count for count, _ in runs)
+    if len(runs) == 1:
+        return pd.DataFrame(runs[0][1], index=pd.RangeIndex(total))
+    names = []
+    dtypes = {}
+    for _, columns in runs:
+        for name, series in columns.items():
+            if name not in dtypes:
+                names.append(name)
+                dtypes[name] = series.dtype
+    frame = {}
+    for name in names:
+        parts = [columns[name] if name in columns else pd.Series(index=pd.RangeIndex(count), dtype=dtypes[name])
+                 for count, columns in runs]
+        frame[name] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(frame, index=pd.RangeIndex(total))
+
+def decode_fit_columns(data, fields):
+    """
+    Decodes the selected messages and fields from the bytes of a FIT file.
+
+    fields is a selection as accepted by parse_field_selection. Returns
+    {message name: DataFrame} with one row per message of that type in file
+    order and one column per selected field the file contains; fields a
+    message does not carry are missing in its row.
+    """
+    selection = parse_field_selection(fields)
+    plans = {MESSAGE_NUMBERS[message]: _MessagePlan(profile.MESSAGE_TYPES[MESSAGE_NUMBERS[message]], names)
+             for message, names in selection.items()}
+    _scan(data, plans)
+    u8 = np.frombuffer(data, dtype=np.uint8)
+    return {plan.name: _plan_frame(u8, plan) for plan in plans.values()}
+
+def _plan_runs(plan):
+    """(message offsets, definition, index of the first message) for each run of a scanned plan."""
+    offsets = np.asarray(plan.offsets, dtype=np.int64)
+    bounds = [start for start, _ in plan.runs[1:]] + [len(offsets)]
+    return [(offsets[start:stop], definition, start) for (start, definition), stop in zip(plan.runs, bounds)]
+
+def _plan_frame(u8, plan):
+    runs = [_decode_run(u8, plan, offsets, definition, plan.compressed_timestamps, start)
+            for offsets, definition, start in _plan_runs(plan)]
+    return _concat_runs(runs) if runs else pd.DataFrame()
+
+def fit_fingerprint(data):
+    """
+    Fingerprint of the activity in the bytes of a FIT file: a SHA-1 hex
+    digest of the device serial number, the file creation time and the raw
+    record messages (layouts and contents). It does not depend on the file
+    name, gzip compression or header, and only the message headers are
+    parsed to compute it.
+    """
+    file_id = _MessagePlan(profile.MESSAGE_TYPES[MESSAGE_NUMBERS['file_id']], ('serial_number', 'time_created'))
+    record = _MessagePlan(profile.MESSAGE_TYPES[MESSAGE_NUMBERS['record']], ())
+    _scan(data, {MESSAGE_NUMBERS['file_id']: file_id, MESSAGE_NUMBERS['record']: record})
+
+    u8 = np.frombuffer(data, dtype=np.uint8)
+    digest = hashlib.sha1()
+    file_ids = _plan_frame(u8, file_id)
+    for name in ('serial_number', 'time_created'):
+        value = file_ids[name].iloc[0] if name in file_ids.columns and len(file_ids) else None
+        digest.update(f'{name}={value};'.encode())
+    for offsets, definition, _ in _plan_runs(record):
+        digest.update(definition.layout)
+        digest.update(u8[offsets[:, None] + np.arange(definition.size)].tobytes())
+    return digest.hexdigest()
@@ -0,0 +1,778 @@
+# -*- coding: utf-8 -*-
+"""
+Shared .fit/.fit.gz ingest helpers for the analysis script and the Dash apps.
+
+A persistent manifest in the cache directory remembers the size, mtime and
+content hash of every source file, so re-runs only decompress and decode
+rides that are new or modified, drop rides whose source was deleted, and load
+everything else straight from the Parquet ride store (see ride_store.py).
+"""
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import closing, contextmanager
+import fitdecode
+import pandas as pd
+from cyclingdata.fit_columns import decode_fit_columns, fit_fingerprint, parse_field_selection
+from cyclingdata.instrumentation import (drain_worker_metrics, merge_worker_metrics, record_file, record_stage, reset_metrics,
+                                         stage_timer, timed)
+from cyclingdata.ride_metadata import METADATA_FIELDS, extract_ride_metadata
+from cyclingdata.ride_index import connect_ride_index, delete_rides, field_selection_key, indexed_ride_states, replace_ride_cells, upsert_ride_summaries
+from cyclingdata.ride_schema import ENHANCED_FIELDS, RECORD_FIELD_TYPES, compact_ride
+from cyclingdata.ride_summary import DEFAULT_BATCH_SIZE, SUMMARY_COLUMNS, summarize_rides
+from cyclingdata.ride_grids import GRID_AXES, GRID_SOURCE_COLUMNS, ride_grids
+from cyclingdata.power_metrics import normalized_power, power_per_second
+from cyclingdata.route_index import ride_cells
+from cyclingdata.training_load import ride_days, update_training_load
+from cyclingdata.ride_store import (RIDE_FILE_EXTENSION, SERVING_FILE_EXTENSION, extras_path, grid_path, laps_path,
+                                    load_ride, load_ride_extras, load_ride_grid, load_ride_laps, load_serving_ride,
+                                    read_ride_columns, save_ride, save_ride_grids, write_serving_copy)
+
+MANIFEST_FILE_NAME = 'manifest.json'
+SERVING_DIRECTORY_NAME = 'serving'
+MANIFEST_VERSION = 6
+DEFAULT_CHUNKSIZE = 4
+STREAM_BUFFER_SIZE = 256 * 1024
+FIT_SOURCE_SUFFIXES = ('.fit', '.fit.gz')
+DISCOVERY_THREADS = 8 # directories listed (and .fit.gz files gunzipped) at once; listing is I/O bound on network and synced folders
+
+# decode_ride(fields=SCHEMA_RECORD_FIELDS) keeps the declared record fields and skips everything else
+SCHEMA_RECORD_FIELDS = tuple(f'record.{name}' for name in RECORD_FIELD_TYPES)
+
+@timed('decompress_fit_gz')
+def decompress_fit_gz(gz_file_path, output_directory=None):
+    try:
+        with gzip.open(gz_file_path, 'rb') as gz_file:
+            file_content = gz_file.read()
+
+        base_name, ext = os.path.splitext(gz_file_path)
+        output_file_path = base_name #+ ".fit"
+
+        if output_directory:
+            os.makedirs(output_directory, exist_ok=True)
+            output_file_path = os.path.join(output_directory, os.path.basename(output_file_path))
+
+        with open(output_file_path, 'wb') as fit_file:
+            fit_file.write(file_content)
+
+        return output_file_path
+    except Exception as e:
+        print(f"Error decompressing {gz_file_path}: {e}")
+        return None
+
+def find_and_decompress_fit_files(root_directory, output_directory=None, threads=DISCOVERY_THREADS):
+    """
+    Recursively searches for .fit and .fit.gz files, decompresses the .fit.gz
+    files, and returns a list of paths to all .fit files (original and decompressed).
+    The .fit.gz files are decompressed by a thread pool as the walk finds them.
+    """
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        found = []
+        for source_path, _, _ in scan_fit_sources(root_directory, (output_directory,), threads):
+            if source_path.lower().endswith(".fit.gz"):
+                found.append(executor.submit(decompress_fit_gz, source_path, output_directory))
+            else:
+                found.append(source_path)
+        fit_file_paths = [path if isinstance(path, str) else path.result() for path in found]
+    return [path for path in fit_file_paths if path]
+
+class _TimedGzipReader(io.RawIOBase):
+    """Raw reader over a gzip stream that adds up the time spent decompressing."""
+
+    def __init__(self, file_path):
+        self._gzip_file = gzip.open(file_path, 'rb')
+        self.seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        count = self._gzip_file.readinto(buffer)
+        self.seconds += time.perf_counter() - start
+        return count
+
+    def close(self):
+        self._gzip_file.close()
+        super().close()
+
+def open_fit_stream(file_path):
+    """
+    Opens a .fit or .fit.gz file for binary reading. Gzipped files are
+    decompressed on the fly through a read buffer, no temporary copy is written.
+    """
+    if file_path.lower().endswith('.gz'):
+        return io.BufferedReader(_TimedGzipReader(file_path), buffer_size=STREAM_BUFFER_SIZE)
+    return open(file_path, 'rb')
+
+def _read_all_records(fit_file):
+    """
+    Every field of every record message as one dict per record, via fitdecode,
+    and the METADATA_FIELDS of the metadata messages as {message name: DataFrame}.
+    """
+    record_data = []
+    metadata_rows = {name: [] for name in METADATA_FIELDS}
+    for frame in fitdecode.FitReader(fit_file):
+        if isinstance(frame, fitdecode.records.FitDataMessage):
+            if frame.name == 'record':
+                record = {}
+                for field in frame.fields:
+                    record[field.name] = field.value
+                record_data.append(record)
+            elif frame.name in metadata_rows:
+                metadata_rows[frame.name].append({name: frame.get_value(name, fallback=None)
+                                                  for name in METADATA_FIELDS[frame.name]})
+    return record_data, {name: pd.DataFrame(rows) for name, rows in metadata_rows.items()}
+
+def record_field_selection(fields):
+    """
+    The decode_fit_columns selection for decode_ride(fields=...): the given
+    record fields, the enhanced counterparts of altitude and speed (merged by
+    compact_ride) and the METADATA_FIELDS of the metadata messages. Only
+    record fields may be selected.
+    """
+    selection = parse_field_selection(fields)
+    if set(selection) - {'record'}:
+        raise ValueError(f"Only record fields can be selected, got {sorted(set(selection) - {'record'})}")
+    record_fields = list(selection.get('record', ()))
+    for enhanced, plain in ENHANCED_FIELDS.items():
+        if plain in record_fields and enhanced not in record_fields:
+            record_fields.append(enhanced)
+    selection['record'] = tuple(record_fields)
+    selection.update(parse_field_selection(METADATA_FIELDS))
+    return selection
+
+def _read_selected_records(fit_file, selection):
+    """The selected record fields and the metadata messages, decoded with decode_fit_columns."""
+    frames = decode_fit_columns(fit_file.read(), selection)
+    return frames.pop('record', None), frames
+
+def decode_ride(file_path, fields=None):
+    """
+    Extracts the record data from a single .fit or .fit.gz file and returns
+    (records, extras, metadata, laps): the compact DataFrames of
+    ride_schema.compact_ride, the ride_metadata dict (device, sport, session
+    totals, ...) and the lap table (or None), all read in the same pass.
+    Returns (None, None, None, None) if the file could not be decoded or has no records.
+
+    By default every record field is decoded with fitdecode, undeclared ones
+    ending up in extras. Pass fields, e.g. ('record.timestamp', 'record.power')
+    or SCHEMA_RECORD_FIELDS, to decode only those record fields with
+    fit_columns.decode_fit_columns, which skips all other messages and fields.
+    """
+    selection = record_field_selection(fields) if fields is not None else None
+    start = time.perf_counter()
+    try:
+        with open_fit_stream(file_path) as fit_file:
+            if selection is None:
+                record_data, messages = _read_all_records(fit_file)
+            else:
+                record_data, messages = _read_selected_records(fit_file, selection)
+            # gunzip time is measured separately, the rest is frame parsing
+            gunzip_seconds = getattr(fit_file.raw, 'seconds', 0.0)
+    except fitdecode.exceptions.FitError as e:
+        print(f"Error decoding .fit file: {file_path} - {e}")
+        return None, None, None, None
+    except FileNotFoundError:
+        print(f"Error: File not found: {file_path}")
+        return None, None, None, None
+    except (OSError, EOFError, zlib.error) as e:
+        print(f"Error decompressing {file_path}: {e}")
+        return None, None, None, None
+
+    if record_data is None or not len(record_data):
+        print(f"No 'record' data found in: {file_path}")
+        return None, None, None, None
+    if gunzip_seconds:
+        record_stage('gunzip', gunzip_seconds, files=1)
+    record_stage('fit_frames', time.perf_counter() - start - gunzip_seconds, files=1, records=len(record_data))
+
+    with stage_timer('to_dataframe', records=len(record_data)):
+        df = pd.DataFrame(record_data)
+    with stage_timer('compact_ride', records=len(record_data)):
+        records, extras = compact_ride(df)
+    metadata, laps = extract_ride_metadata(messages)
+    record_file(file_path, len(records), time.perf_counter() - start)
+    return records, extras, metadata, laps
+
+def decode_fit_file(file_path, fields=None):
+    """
+    Extracts the record data from a single .fit or .fit.gz file and returns it as a
+    compact Pandas DataFrame, or None if the file could not be decoded or has no records.
+    """
+    return decode_ride(file_path, fields)[0]
+
+def _decode_keyed(file_path, fields=None):
+    return file_path, decode_fit_file(file_path, fields)
+
+def _apply_to_chunk(func, chunk):
+    # runs in a pool worker: the stage timings measured here go back with the results
+    results = [func(*args) for args in chunk]
+    return results, drain_worker_metrics()
+
+@contextmanager
+def process_pool(workers=None):
+    """
+    A process pool of workers processes for parallel_map_unordered, or None
+    for one worker (everything then runs in this process). Workers come from
+    a forkserver where the platform has one (spawned elsewhere), never forked
+    from this process: its scandir threads may hold locks, and a forked
+    worker would also inherit this process's stage totals. The initializer
+    still clears them, so drain_worker_metrics only ships back what the
+    worker measured itself.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield None
+        return
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                          else 'spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=reset_metrics) as executor:
+        yield executor
+
+def parallel_map_unordered(func, arg_tuples, workers=None, chunksize=DEFAULT_CHUNKSIZE, executor=None):
+    """
+    Calls func(*args) for every tuple in arg_tuples and yields the results in
+    completion order. With more than one worker the calls are dispatched to a
+    process pool in chunks of chunksize, keeping at most two chunks per worker
+    in flight so finished results never pile up faster than they are consumed.
+    Pass an executor from process_pool to share one pool between several
+    maps, e.g. one fed lazily by another's results. func must be a
+    module-level function so it can be pickled.
+    """
+    if executor is None:
+        with process_pool(workers) as executor:
+            yield from _map_in_pool(func, arg_tuples, workers, chunksize, executor)
+    else:
+        yield from _map_in_pool(func, arg_tuples, workers, chunksize, executor)
+
+def _map_in_pool(func, arg_tuples, workers, chunksize, executor):
+    if executor is None:
+        for args in arg_tuples:
+            yield func(*args)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    arg_iter = iter(arg_tuples)
+    chunks = iter(lambda: list(itertools.islice(arg_iter, chunksize)), [])
+    pending = {executor.submit(_apply_to_chunk, func, chunk)
+               for chunk in itertools.islice(chunks, workers * 2)}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for chunk in itertools.islice(chunks, 1):
+                pending.add(executor.submit(_apply_to_chunk, func, chunk))
+            results, metrics = future.result()
+            merge_worker_metrics(metrics)
+            yield from results
+
+def iter_fit_files(file_paths, workers=None, chunksize=DEFAULT_CHUNKSIZE, fields=None):
+    """
+    Decodes .fit files across a process pool and yields (file_path, DataFrame)
+    pairs in completion order. Files that fail to decode are reported as in
+    process_fit_files and skipped. fields selects record fields as in decode_ride.
+    """
+    for file_path, df in parallel_map_unordered(_decode_keyed, ((p, fields) for p in file_paths),
+                                                workers, chunksize):
+        if df is not None:
+            yield file_path, df
+
+def process_fit_files(file_paths, workers=1, chunksize=DEFAULT_CHUNKSIZE, fields=None):
+    """
+    Processes a list of .fit/.fit.gz file paths, extracts the record data from each file, and returns a dictionary where keys are file paths and values are Pandas DataFrames.
+    Pass workers > 1 (or None for one per CPU) to decode in parallel, and fields
+    (e.g. SCHEMA_RECORD_FIELDS) to decode only those record fields.
+    """
+    with stage_timer('process_fit_files') as timer:
+        all_data = dict(iter_fit_files(file_paths, workers, chunksize, fields))
+        timer.files = len(all_data)
+        timer.records = sum(len(df) for df in all_data.values())
+    return all_data
+
+def _scan_directory(directory, excluded):
+    """The .fit/.fit.gz files of one directory as (path, size, mtime_ns), and its subdirectories."""
+    sources, subdirectories = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.normcase(os.path.abspath(entry.path)) not in excluded:
+                            subdirectories.append(entry.path)
+                    elif entry.name.lower().endswith(FIT_SOURCE_SUFFIXES):
+                        stat = entry.stat()
+                        sources.append((entry.path, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    continue  # vanished while listing
+    except OSError:
+        pass  # unreadable or vanished directory, skipped like os.walk does
+    return sources, subdirectories
+
+def scan_fit_sources(root_directory, exclude_directories=(), threads=DISCOVERY_THREADS):
+    """
+    Recursively searches for .fit and .fit.gz files and yields (path, size,
+    mtime_ns) for each as soon as its directory has been listed, so callers
+    can start working on them before the walk finishes. Up to threads
+    directories are listed at once with os.scandir, whose entries carry the
+    stat results (for free on Windows), so no file is stat'ed twice. Files
+    come in no particular order. Directories in exclude_directories (e.g. the
+    decompressed or cache directory living under the root) are not descended into.
+    """
+    excluded = {os.path.normcase(os.path.abspath(d)) for d in exclude_directories if d}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = {executor.submit(_scan_directory, root_directory, excluded)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                sources, subdirectories = future.result()
+                pending.update(executor.submit(_scan_directory, subdirectory, excluded)
+                               for subdirectory in subdirectories)
+                yield from sources
+
+def find_fit_sources(root_directory, exclude_directories=()):
+    """
+    Recursively searches for .fit and .fit.gz files without decompressing
+    anything and returns their sorted paths (see scan_fit_sources).
+    """
+    return sorted(source_path for source_path, _, _ in scan_fit_sources(root_directory, exclude_directories))
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """Returns the SHA-1 hex digest of a file, read in chunks."""
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def manifest_stamp(cache_directory):
+    """
+    The manifest file's mtime, which changes with every ingest; None before
+    the first one. The manifest is saved after the ride index is synced, so
+    a new stamp means the index already has the new rides.
+    """
+    try:
+        return os.stat(os.path.join(cache_directory, MANIFEST_FILE_NAME)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def load_manifest(cache_directory):
+    """
+    Loads the ingest manifest from cache_directory. A missing, unreadable or
+    outdated manifest is treated as empty, which forces a full re-ingest.
+    """
+    manifest_path = os.path.join(cache_directory, MANIFEST_FILE_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {'version': MANIFEST_VERSION, 'rides': {}}
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable ingest manifest {manifest_path}: {e}")
+        return {'version': MANIFEST_VERSION, 'rides': {}}
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        # cached data from an older layout cannot be reused
+        for entry in manifest.get('rides', {}).values():
+            _evict(entry, cache_directory)
+        return {'version': MANIFEST_VERSION, 'rides': {}}
+    return manifest
+
+def cached_rides(cache_directory):
+    """Manifest entries of the rides already in the cache, without scanning the archive."""
+    return {source_path: entry for source_path, entry in load_manifest(cache_directory)['rides'].items()
+            if entry.get('cache_file')}
+
+def save_manifest(manifest, cache_directory):
+    """Writes the manifest atomically so an interrupted run never leaves it half written."""
+    os.makedirs(cache_directory, exist_ok=True)
+    manifest_path = os.path.join(cache_directory, MANIFEST_FILE_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def _stat_or_none(path):
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+def _cache_file_name(source_path):
+    return hashlib.sha1(source_path.encode('utf-8')).hexdigest() + RIDE_FILE_EXTENSION
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _evict(entry, cache_directory):
+    if entry.get('cache_file'):
+        _remove_quietly(os.path.join(cache_directory, entry['cache_file']))
+        _remove_quietly(extras_path(os.path.join(cache_directory, entry['cache_file'])))
+        _remove_quietly(laps_path(os.path.join(cache_directory, entry['cache_file'])))
+        for axis in GRID_AXES:
+            _remove_quietly(grid_path(os.path.join(cache_directory, entry['cache_file']), axis))
+    if entry.get('decompressed_path'):
+        _remove_quietly(entry['decompressed_path'])
+
+def _ingest_source(source_path, cache_directory, decompressed_directory, fields=None):
+    """
+    Decodes one source file into the cache, streaming .fit.gz files straight
+    into the decoder. A decompressed copy is only written when
+    decompressed_directory is set.
+    """
+    entry = {'cache_file': None, 'decompressed_path': None}
+    if fields is not None:
+        entry['fields'] = list(fields)
+    if decompressed_directory and source_path.lower().endswith('.fit.gz'):
+        entry['decompressed_path'] = decompress_fit_gz(source_path, decompressed_directory)
+
+    df, extras, metadata, laps = decode_ride(source_path, fields)
+    if df is not None:
+        entry['cache_file'] = _cache_file_name(source_path)
+        entry['metadata'] = metadata
+        with stage_timer('save_ride', records=len(df)):
+            save_ride(df, os.path.join(cache_directory, entry['cache_file']), extras, laps)
+        with stage_timer('ride_grids', records=len(df)):
+            save_ride_grids(ride_grids(df), os.path.join(cache_directory, entry['cache_file']))
+    return entry
+
+@timed('fingerprint')
+def source_fingerprint(file_path):
+    """
+    fit_columns.fit_fingerprint of a .fit or .fit.gz file: the same activity
+    gets the same fingerprint whatever its file name or compression. Returns
+    None if the file cannot be read as FIT.
+    """
+    try:
+        with open_fit_stream(file_path) as fit_file:
+            return fit_fingerprint(fit_file.read())
+    except (fitdecode.exceptions.FitError, OSError, EOFError, zlib.error):
+        return None
+
+def _inspect_source(source_path, entry, stat_key, fields=None):
+    """
+    Pool task for a source whose stat no longer matches the manifest (or whose
+    cached data is missing, was decoded with other fields or duplicated a
+    ride that changed). Hashes the file; when the bytes are unchanged and the
+    cache is reusable only the stat fields are refreshed. Returns the source
+    path, its manifest entry and None, or for a source that has to be
+    ingested, the old entry and the new entry's hash, stat and fingerprint.
+    """
+    size, mtime_ns, reingest = stat_key
+    content_hash = file_content_hash(source_path)
+    if not reingest and entry and entry['sha1'] == content_hash:
+        entry['size'] = size
+        entry['mtime_ns'] = mtime_ns
+        return source_path, entry, None
+    update = {'sha1': content_hash, 'size': size, 'mtime_ns': mtime_ns,
+              'fingerprint': source_fingerprint(source_path)}
+    if fields is not None:
+        update['fields'] = fields
+    return source_path, entry, update
+
+def _ingest_changed(source_path, update, cache_directory, decompressed_directory, fields=None):
+    """Pool task: ingests one new or changed source and returns its new manifest entry."""
+    entry = _ingest_source(source_path, cache_directory, decompressed_directory, fields)
+    entry.update(update)
+    return source_path, entry
+
+def update_ingest_manifest(root_directory, cache_directory, decompressed_directory=None,
+                           workers=1, chunksize=DEFAULT_CHUNKSIZE, fields=None, source_paths=None):
+    """
+    Brings the ride cache in line with the .fit/.fit.gz files under root_directory.
+
+    Files whose size and mtime match the manifest are skipped without being
+    read. Otherwise the content hash decides: same bytes only refresh the stat
+    fields, new bytes are decoded again, spread over workers processes (None
+    for one per CPU). The archive is walked with scan_fit_sources; stale
+    files are hashed by the workers as the walk finds them, and each new or
+    changed file is decoded in the same pool as soon as it is fingerprinted,
+    before the walk has finished. Entries whose source file has disappeared
+    are evicted together with their cached data.
+    Before decoding, each new or changed file is fingerprinted (device
+    serial, creation time and record messages, see source_fingerprint). A
+    file whose fingerprint is already in the manifest, e.g. the same ride
+    exported as .fit and .fit.gz or under another name, is not decoded: its
+    entry has no cache_file and names the ingested copy in duplicate_of.
+    A copy ingested earlier stays the ingested one while it is unchanged;
+    among copies new in this run the lowest path is ingested, however the
+    workers order them (a copy already decoded when a lower path turns up
+    is evicted again).
+    .fit.gz files are decoded straight from the gzip stream; pass
+    decompressed_directory to also keep decompressed .fit copies there.
+    fields selects the record fields to decode as in decode_ride (None keeps
+    all of them); rides cached with a different selection are decoded again.
+    Unknown field names raise ValueError before anything is read.
+    source_paths limits the update to those files (e.g. the ones a watcher
+    saw arrive, change or disappear) instead of walking root_directory.
+    Returns the manifest's ride entries keyed by source path.
+    """
+    fields = list(fields) if fields is not None else None
+    if fields is not None:
+        record_field_selection(fields)  # unknown names raise here, before the archive is walked
+    os.makedirs(cache_directory, exist_ok=True)
+    manifest = load_manifest(cache_directory)
+    rides = manifest['rides']
+
+    if source_paths is None:
+        scanned = scan_fit_sources(root_directory, (decompressed_directory, cache_directory))
+    else:
+        source_paths = sorted(set(source_paths))
+        scanned = ((source_path, stat.st_size, stat.st_mtime_ns)
+                   for source_path, stat in ((p, _stat_or_none(p)) for p in source_paths) if stat)
+    found = set()
+    stale = {}
+
+    def stale_sources():
+        # consumed lazily by the pool, so hashing starts while the walk goes on
+        for source_path, size, mtime_ns in scanned:
+            found.add(source_path)
+            entry = rides.get(source_path)
+            reingest = bool(entry and (entry.get('fields') != fields
+                                       or (entry.get('cache_file') and not os.path.exists(
+                                           os.path.join(cache_directory, entry['cache_file'])))))
+            if entry and not reingest and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+                continue
+            stale[source_path] = (source_path, entry, (size, mtime_ns, reingest), fields)
+            yield stale[source_path]
+
+    # fingerprint -> path of the ingested copy, for the rides as they stand;
+    # a changed ride's old fingerprint is dropped when its inspection returns
+    ingested = {entry['fingerprint']: source_path for source_path, entry in rides.items()
+                if entry.get('cache_file') and entry.get('fingerprint')}
+    copies = {}  # fingerprint -> {source path: update} of the copies inspected in this run
+    decoded = {}  # fingerprint -> the copy decoded in this run, the lowest path among copies
+    replaced = set()  # copies decoded before a lower path of the same ride turned up
+
+    def decode_tasks(inspected):
+        # consumed lazily by the decode map: a file is decoded as soon as its
+        # fingerprint shows it is not a duplicate, while the walk goes on
+        for source_path, entry, update in inspected:
+            if update is None:
+                rides[source_path] = entry
+                continue
+            if entry:
+                _evict(entry, cache_directory)
+                if ingested.get(entry.get('fingerprint')) == source_path:
+                    del ingested[entry['fingerprint']]
+            fingerprint = update['fingerprint']
+            if not fingerprint:
+                yield source_path, update, cache_directory, decompressed_directory, fields
+                continue
+            copies.setdefault(fingerprint, {})[source_path] = update
+            holder = ingested.get(fingerprint)
+            if holder is not None and holder != decoded.get(fingerprint):
+                # a ride ingested before and kept as it is stays the ingested copy
+                rides[source_path] = dict(update, cache_file=None, decompressed_path=None, duplicate_of=holder)
+                continue
+            # among copies new in this run the lowest path wins, whatever the
+            # order the workers report them in
+            winner = min(copies[fingerprint])
+            rides[source_path] = dict(update, cache_file=None, decompressed_path=None, duplicate_of=winner)
+            if decoded.get(fingerprint) == winner:
+                continue
+            if fingerprint in decoded:
+                replaced.add(decoded[fingerprint])
+            decoded[fingerprint] = ingested[fingerprint] = winner
+            yield winner, copies[fingerprint][winner], cache_directory, decompressed_directory, fields
+
+    def settle_copies():
+        # the copies that lost to a lower path become duplicates of the winner
+        for fingerprint, updates in copies.items():
+            winner = ingested.get(fingerprint)
+            for source_path, update in updates.items():
+                if winner is None or source_path == winner or source_path not in rides:
+                    continue
+                if source_path in replaced:
+                    _evict(rides[source_path], cache_directory)
+                rides[source_path] = dict(update, cache_file=None, decompressed_path=None, duplicate_of=winner)
+        replaced.clear()
+
+    def ingest(tasks, executor):
+        inspected = parallel_map_unordered(_inspect_source, tasks, workers, chunksize, executor)
+        for source_path, entry in parallel_map_unordered(_ingest_changed, decode_tasks(inspected), workers,
+                                                         chunksize, executor):
+            rides[source_path] = entry
+        settle_copies()
+
+    with process_pool(workers) as executor, stage_timer('refresh_sources') as timer:
+        ingest(stale_sources(), executor)
+        vanished = [p for p in (rides if source_paths is None else source_paths) if p in rides and p not in found]
+        for source_path in vanished:
+            entry = rides.pop(source_path)
+            _evict(entry, cache_directory)
+            if ingested.get(entry.get('fingerprint')) == source_path:
+                del ingested[entry['fingerprint']]
+        # a duplicate is checked again when the copy it names no longer holds
+        # its fingerprint: that ride changed or disappeared during this run
+        ingest([(source_path, entry, (entry['size'], entry['mtime_ns'], True), fields)
+                for source_path, entry in rides.items()
+                if entry.get('duplicate_of') and ingested.get(entry['fingerprint']) != entry['duplicate_of']],
+               executor)
+        timer.files = len(stale)
+
+    # the index first: dashboards take a new manifest stamp as the sign that
+    # the index is ready to be read again (see manifest_stamp)
+    with stage_timer('sync_ride_index'):
+        sync_ride_index(rides, cache_directory)
+    save_manifest(manifest, cache_directory)
+    return rides
+
+def sync_ride_index(rides, cache_directory, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Brings the ride-summary index in line with the manifest entries: rides
+    that are new or whose content hash or decoded fields changed are summarized from the ride
+    store (summary and position columns only) and indexed together with their
+    metadata from the manifest, Normalized Power and track cells, rides no
+    longer in the manifest are removed. The daily training load is then
+    updated from the days of the rides that changed.
+    """
+    columns = SUMMARY_COLUMNS + ['position_lat', 'position_long']
+
+    with closing(connect_ride_index(cache_directory)) as conn:
+        indexed = indexed_ride_states(conn)
+        removed = [ride_id for ride_id in indexed if not rides.get(ride_id, {}).get('cache_file')]
+        # a ride decoded again with other fields keeps its hash but not its columns
+        pending = [(source_path, entry) for source_path, entry in rides.items()
+                   if entry.get('cache_file')
+                   and indexed.get(source_path) != (entry['sha1'], field_selection_key(entry.get('fields')))]
+        # the days changed rides were on before, and below the days they are on now
+        load_days = ride_days(conn, removed + [source_path for source_path, _ in pending])
+        delete_rides(conn, removed)
+
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            cells, normalized = {}, {}
+
+            def loaded_rides():
+                for source_path, entry in batch:
+                    df = load_cached_ride(entry, cache_directory, columns)
+                    cells[source_path] = ride_cells(df)
+                    normalized[source_path] = normalized_power(power_per_second(df))
+                    yield source_path, df
+
+            summary = summarize_rides(loaded_rides())
+            summary['normalized_power'] = pd.Series(normalized)
+            upsert_ride_summaries(conn, summary,
+                                  {source_path: entry['sha1'] for source_path, entry in batch},
+                                  {source_path: entry.get('metadata') for source_path, entry in batch},
+                                  {source_path: entry.get('fields') for source_path, entry in batch})
+            replace_ride_cells(conn, cells)
+        load_days |= ride_days(conn, [source_path for source_path, _ in pending])
+        update_training_load(conn, load_days)
+        conn.commit()
+
+def load_cached_ride(entry, cache_directory, columns=None):
+    """Loads the stored DataFrame for one manifest entry, or None if it has no record data."""
+    if not entry or not entry.get('cache_file'):
+        return None
+    return load_ride(os.path.join(cache_directory, entry['cache_file']), columns)
+
+def cached_ride_columns(entry, cache_directory):
+    """Column names of the stored DataFrame for one manifest entry, without loading it."""
+    if not entry or not entry.get('cache_file'):
+        return []
+    return read_ride_columns(os.path.join(cache_directory, entry['cache_file']))
+
+def load_cached_ride_extras(entry, cache_directory):
+    """Loads the side table of undeclared record fields for one manifest entry, or None."""
+    if not entry or not entry.get('cache_file'):
+        return None
+    return load_ride_extras(os.path.join(cache_directory, entry['cache_file']))
+
+def load_cached_ride_laps(entry, cache_directory):
+    """Loads the lap table for one manifest entry, or None if the ride has no laps."""
+    if not entry or not entry.get('cache_file'):
+        return None
+    return load_ride_laps(os.path.join(cache_directory, entry['cache_file']))
+
+def load_cached_ride_grid(entry, cache_directory, axis):
+    """
+    Loads one comparison grid ('time' or 'distance', see ride_grids.py) for a
+    manifest entry, or None. Rides cached before grids existed get theirs
+    computed from the ride store and saved on first use.
+    """
+    if not entry or not entry.get('cache_file'):
+        return None
+    file_path = os.path.join(cache_directory, entry['cache_file'])
+    try:
+        return load_ride_grid(file_path, axis)
+    except FileNotFoundError:
+        grids = ride_grids(load_ride(file_path, GRID_SOURCE_COLUMNS))
+        save_ride_grids(grids, file_path)
+        return grids[axis]
+
+def _serving_file_name(entry):
+    # the content hash is part of the name, so a re-ingested ride never reads an old copy
+    return entry['cache_file'][:-len(RIDE_FILE_EXTENSION)] + '.' + entry['sha1'][:16] + SERVING_FILE_EXTENSION
+
+def build_serving_store(rides, cache_directory):
+    """
+    Brings the serving store (uncompressed Arrow copies of the cached rides in
+    CACHE/serving, see ride_store.write_serving_copy) in line with the
+    manifest entries: missing copies are written and copies of rides that
+    changed or disappeared are removed. Run it once before starting the
+    server workers. Returns the number of copies written.
+    """
+    serving_directory = os.path.join(cache_directory, SERVING_DIRECTORY_NAME)
+    os.makedirs(serving_directory, exist_ok=True)
+    expected = {}
+    for entry in rides.values():
+        if entry.get('cache_file'):
+            expected[_serving_file_name(entry)] = entry
+    for file_name in os.listdir(serving_directory):
+        if file_name not in expected:
+            _remove_quietly(os.path.join(serving_directory, file_name))
+
+    written = 0
+    with stage_timer('build_serving_store') as timer:
+        for file_name, entry in expected.items():
+            serving_path = os.path.join(serving_directory, file_name)
+            if not os.path.exists(serving_path):
+                write_serving_copy(os.path.join(cache_directory, entry['cache_file']), serving_path)
+                written += 1
+        timer.files = written
+    return written
+
+def load_serving_copy(entry, cache_directory, columns=None):
+    """
+    Loads one manifest entry's ride from the serving store, falling back to
+    the Parquet ride store when build_serving_store has not copied it yet.
+    """
+    if not entry or not entry.get('cache_file'):
+        return None
+    serving_path = os.path.join(cache_directory, SERVING_DIRECTORY_NAME, _serving_file_name(entry))
+    try:
+        return load_serving_ride(serving_path, columns)
+    except FileNotFoundError:
+        return load_cached_ride(entry, cache_directory, columns)
+
+def load_cached_rides(rides, cache_directory, columns=None):
+    """
+    Loads the stored DataFrames for manifest entries that produced record data.
+    Pass columns to read only those columns from the ride store.
+    """
+    all_data = {}
+    for source_path, entry in rides.items():
+        if entry.get('cache_file'):
+            all_data[source_path] = load_cached_ride(entry, cache_directory, columns)
+    return all_data
+
+def ingest_fit_files(root_directory, cache_directory, decompressed_directory=None, columns=None,
+                     workers=1, chunksize=DEFAULT_CHUNKSIZE, fields=None):
+    """
+    Incremental replacement for find_and_decompress_fit_files + process_fit_files.
+    Returns a dictionary where keys are source file paths and values are Pandas DataFrames.
+    """
+    rides = update_ingest_manifest(root_directory, cache_directory, decompressed_directory,
+                                   workers, chunksize, fields)
+    return load_cached_rides(rides, cache_directory, columns)
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Dash app to pick a ride and see its summary and time series (power, heart
+rate, speed, cadence, W' balance), and to overlay several rides by elapsed
+time or distance.
+
+Importing this module only defines the layout pieces and callbacks;
+create_app builds a configured app for a set of ingested rides.
+"""
+import os
+import dash
+from dash import dcc
+from dash import html
+from dash.dependencies import Input, Output
+import pandas as pd
+import plotly.graph_objects as go
+from cyclingdata.dashboard_rides import DashboardRides
+from cyclingdata.fit_ingest import load_cached_ride, load_cached_ride_grid, load_serving_copy
+from cyclingdata.ride_cache import RideCache
+from cyclingdata.ride_index import ride_label
+from cyclingdata.instrumentation import add_metrics_route, profile_capture, register_cache, stage_timer
+from cyclingdata.ride_summary import calculate_workout_summary
+from cyclingdata.downsample import downsample, points_for_width
+from cyclingdata.ride_grids import GRID_AXES, grid_slice
+from cyclingdata.power_metrics import ride_power_metrics, w_prime_balance
+
+DEFAULT_PORT = 8000
+
+DEFAULT_SETTINGS = {
+    'ride_cache_budget_mb': 512, # memory budget for ride DataFrames kept loaded between callbacks
+    'plot_width_px': 1200, # approximate rendered width of the time series plots, sets how many points are sent
+    'downsample_method': 'minmax', # 'minmax' keeps every spike, 'lttb' keeps the overall line shape
+    'ftp_watts': 250, # functional threshold power used for IF and TSS
+    'cp_watts': 250, # critical power for W' balance
+    'w_prime_joules': 20000, # W' (anaerobic work capacity above CP)
+    'w_prime_balance_method': 'differential', # 'differential' or 'integral' (Skiba)
+    'render_cache_entries': 256, # rendered summaries/figures kept for revisited rides (6 per ride)
+    'grid_cache_mb': 128, # memory budget for the resampled ride grids of the comparison view
+    'profile_mode': None, # 'cprofile' or 'pyinstrument' to profile the summary callback (written to profiles/)
+    'serving_store': False, # load rides from the memory-mapped serving store (see fit_ingest.build_serving_store)
+    'live_refresh_s': None, # seconds between checks for rides ingested while the app runs (e.g. by a RideWatcher), None to never check
+}
+settings = dict(DEFAULT_SETTINGS, cache_directory=None)
+
+# The listed rides (a DashboardRides, see dashboard_rides.py) and the caches,
+# created by create_app. Ride DataFrames are only loaded when selected,
+# through the size-bounded LRU cache.
+rides = None
+ride_cache = None
+render_cache = None
+grid_cache = None
+
+def load_dashboard_ride(source_path):
+    """Loads a cached ride and adds its W' balance as a w_prime_balance column."""
+    load_ride = load_serving_copy if settings['serving_store'] else load_cached_ride
+    df = load_ride(rides.get(source_path), settings['cache_directory'])
+    if df is not None and 'power' in df.columns and 'timestamp' in df.columns:
+        df['w_prime_balance'] = w_prime_balance(df, settings['cp_watts'], settings['w_prime_joules'],
+                                                settings['w_prime_balance_method']).astype('float32')
+    return df
+
+# (graph id, column, title, y axis title, line color) for each time series plot
+TIME_SERIES_GRAPHS = [
+    ('power-time-series', 'power', 'Power Over Time', 'Power (Watts)', None),
+    ('heart-rate-time-series', 'heart_rate', 'Heart Rate Over Time', 'Heart Rate (bpm)', 'red'),
+    # fitdecode reports speed in m/s
+    ('speed-time-series', 'speed', 'Speed Over Time', 'Speed (m/s)', 'green'),
+    ('cadence-time-series', 'cadence', 'Cadence Over Time', 'Cadence (rpm)', 'purple'),
+    ('wbal-time-series', 'w_prime_balance', "W' Balance Over Time", "W' Balance (J)", 'orange'),
+]
+TIME_SERIES_BY_ID = {graph[0]: graph for graph in TIME_SERIES_GRAPHS}
+
+def render_key(selected_file, view):
+    """
+    Cache key of one rendered view ('summary' or a graph id) of a ride. The
+    content hash is part of the key, so a re-ingested ride never gets the
+    views rendered from its old data.
+    """
+    entry = rides.get(selected_file) or {}
+    return (selected_file, entry.get('sha1'), view)
+
+def render_view(key):
+    """Renders one view for render_cache, or None while the ride cannot be loaded (so that is not cached)."""
+    selected_file, _, view = key
+    if view == 'summary':
+        return build_summary_component(selected_file)
+    return build_full_range_figure(selected_file, view)
+
+def build_summary_component(selected_file):
+    df = ride_cache.get(selected_file)
+    if df is None:
+        return None
+    if 'timestamp' not in df.columns:
+        return html.P(f"Error: 'timestamp' column not found in {os.path.basename(selected_file)}. Cannot plot time series.")
+
+    summary = calculate_workout_summary(df)
+    if 'power' in df.columns:
+        summary.update(ride_power_metrics(df, settings['ftp_watts']))
+        summary['min_w_prime_balance'] = df['w_prime_balance'].min()
+    output_components = [html.H3(f"Summary for: {os.path.basename(selected_file)}")]
+    for key, value in summary.items():
+        if isinstance(value, pd.DataFrame):
+            output_components.append(html.H4(key.replace('_', ' ').title()))
+            output_components.append(html.Pre(value.to_string()))
+        else:
+            output_components.append(html.P(f"{key.replace('_', ' ').title()}: {value}"))
+    return html.Div(output_components)
+
+def update_summary(selected_file):
+    if not selected_file:
+        return html.P("Please select a .fit file to analyze.")
+    with stage_timer('update_summary'), profile_capture('update_summary', settings['profile_mode']):
+        component = render_cache.get(render_key(selected_file, 'summary'))
+    if component is None:
+        return html.P("Error: Selected file not found in processed data.")
+    return component
+
+def visible_time_range(relayout_data):
+    """
+    The (start, end) UTC timestamps of a zoomed x axis from a graph's
+    relayoutData, or None when the graph shows its full range.
+    """
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        bounds = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        bounds = relayout_data['xaxis.range']
+    else:
+        return None
+    start, end = (pd.Timestamp(bound) for bound in bounds)
+    start = start.tz_localize('UTC') if start.tzinfo is None else start
+    end = end.tz_localize('UTC') if end.tzinfo is None else end
+    return start, end
+
+def build_time_series_figure(df, column, title, y_title, color, time_range=None, ui_revision=None):
+    """
+    Line figure of one column over time, downsampled on the server to about
+    two points per pixel of plot_width_px. With a time_range only the samples
+    in that window are used, so zooming in shows them at full resolution.
+    """
+    x, y = df['timestamp'], df[column]
+    if time_range is not None:
+        in_range = ((x >= time_range[0]) & (x <= time_range[1])).to_numpy()
+        x, y = x[in_range], y[in_range]
+    method = settings['downsample_method']
+    x, y = downsample(x, y, points_for_width(settings['plot_width_px'], method), method)
+
+    scatter_kwargs = {'marker': {'color': color}} if color else {}
+    layout = go.Layout(
+        title=title,
+        xaxis={'title': 'Time'},
+        yaxis={'title': y_title},
+        uirevision=ui_revision  # keep the user's zoom when the zoomed data comes back
+    )
+    if time_range is not None:
+        layout.xaxis.range = [time_range[0], time_range[1]]
+    return go.Figure(data=[go.Scatter(x=x, y=y, mode='lines', **scatter_kwargs)], layout=layout)
+
+def build_full_range_figure(selected_file, graph_id):
+    _, column, title, y_title, color = TIME_SERIES_BY_ID[graph_id]
+    df = ride_cache.get(selected_file)
+    if df is None:
+        return None
+    if 'timestamp' not in df.columns or column not in df.columns:
+        return go.Figure()
+    return build_time_series_figure(df, column, title, y_title, color, ui_revision=selected_file)
+
+def register_time_series_callback(app, graph_id, column, title, y_title, color):
+    @app.callback(
+        Output(graph_id, 'figure'),
+        [Input('file-selector', 'value'),
+         Input(graph_id, 'relayoutData')]
+    )
+    def update_time_series(selected_file, relayout_data):
+        if not selected_file:
+            return go.Figure()
+
+        with stage_timer('update_time_series'):
+            # a new ride always starts fully zoomed out; zoom events re-fetch the visible window
+            triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+            time_range = None
+            if f'{graph_id}.relayoutData' in triggered:
+                time_range = visible_time_range(relayout_data)
+            if time_range is None:
+                figure = render_cache.get(render_key(selected_file, graph_id))
+                return go.Figure() if figure is None else figure
+
+            df = ride_cache.get(selected_file)
+            if df is None or 'timestamp' not in df.columns or column not in df.columns:
+                return go.Figure()
+            return build_time_series_figure(df, column, title, y_title, color, time_range, ui_revision=selected_file)
+
+    return update_time_series
+
+# (column, label) choices of the comparison view, and its x axes as (title, grid units per displayed unit)
+COMPARISON_COLUMNS = [(graph[1], graph[3]) for graph in TIME_SERIES_GRAPHS if graph[1] != 'w_prime_balance'] + \
+                     [('altitude', 'Altitude (m)')]
+COMPARISON_AXES = {
+    'time': ('Elapsed Time (min)', 60.0),
+    'distance': ('Distance (km)', 1000.0),
+}
+
+def load_comparison_grid(key):
+    selected_file, _, axis = key
+    return load_cached_ride_grid(rides.get(selected_file), settings['cache_directory'], axis)
+
+def visible_axis_range(relayout_data):
+    """The (start, end) of a zoomed numeric x axis from relayoutData, or None at the full range."""
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return float(relayout_data['xaxis.range[0]']), float(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        return tuple(float(bound) for bound in relayout_data['xaxis.range'])
+    return None
+
+def build_comparison_figure(selected_files, axis, column, x_range=None):
+    """
+    One line per ride of column over elapsed time or distance, from the
+    rides' precomputed grids: each is sliced to x_range (in displayed units)
+    and downsampled, nothing is resampled here.
+    """
+    x_title, scale = COMPARISON_AXES[axis]
+    start, end = (x_range[0] * scale, x_range[1] * scale) if x_range else (None, None)
+    method = settings['downsample_method']
+    n_out = points_for_width(settings['plot_width_px'], method)
+    traces = []
+    for selected_file in selected_files:
+        entry = rides.get(selected_file) or {}
+        grid = grid_cache.get((selected_file, entry.get('sha1'), axis))
+        if grid is None or column not in grid.columns:
+            continue
+        visible = grid_slice(grid, axis, start, end)
+        x, y = downsample(visible[GRID_AXES[axis]] / scale, visible[column], n_out, method)
+        row = rides.listing.loc[selected_file] if selected_file in rides.listing.index else None
+        traces.append(go.Scatter(x=x, y=y, mode='lines', name=ride_label(selected_file, row)))
+    layout = go.Layout(
+        title=f"{dict(COMPARISON_COLUMNS)[column]} by {x_title.split(' (')[0]}",
+        xaxis={'title': x_title},
+        yaxis={'title': dict(COMPARISON_COLUMNS)[column]},
+        uirevision=f'{axis}-{column}',
+        legend={'orientation': 'h'},
+    )
+    if x_range is not None:
+        layout.xaxis.range = list(x_range)
+    return go.Figure(data=traces, layout=layout)
+
+def update_comparison(selected_files, axis, column, relayout_data):
+    if not selected_files:
+        return go.Figure()
+    with stage_timer('update_comparison'):
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+        x_range = visible_axis_range(relayout_data) if 'comparison-graph.relayoutData' in triggered else None
+        return build_comparison_figure(selected_files, axis, column, x_range)
+
+def build_layout():
+    return html.Div([
+        html.H1("TrainingPeaks .fit File Analyzer"),
+
+        *rides.layout(settings['live_refresh_s']),
+
+        html.Div(id='output-summary'),
+
+        # Add Graph components for time series plots
+        html.Div([dcc.Graph(id=graph[0]) for graph in TIME_SERIES_GRAPHS], className='graph-container'),
+
+        html.H2("Compare Rides"),
+        dcc.Dropdown(
+            id='compare-selector',
+            options=rides.options(),
+            multi=True,
+            placeholder="Select rides to overlay"
+        ),
+        dcc.RadioItems(id='compare-axis', value='time', inline=True,
+                       options=[{'label': 'Elapsed time', 'value': 'time'}, {'label': 'Distance', 'value': 'distance'}]),
+        dcc.Dropdown(id='compare-column', value='power', clearable=False,
+                     options=[{'label': label, 'value': column} for column, label in COMPARISON_COLUMNS]),
+        dcc.Graph(id='comparison-graph')
+    ])
+
+def create_app(cache_directory, ride_entries, **options):
+    """
+    Builds the Dash app for ride_entries (source path -> manifest entry, as
+    returned by update_ingest_manifest) cached in cache_directory. options override
+    DEFAULT_SETTINGS. The app also serves the instrumentation metrics at /metrics.
+    """
+    global rides, ride_cache, render_cache, grid_cache
+    unknown = set(options) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise TypeError(f"Unknown dashboard settings: {', '.join(sorted(unknown))}")
+    settings.update(options)
+    settings['cache_directory'] = cache_directory
+    # a re-ingested ride's loaded data is dropped; rendered views are keyed by content hash
+    rides = DashboardRides(cache_directory, ride_entries,
+                           on_changed=lambda source_path: ride_cache.invalidate(source_path))
+
+    ride_cache = RideCache(load_dashboard_ride, max_bytes=settings['ride_cache_budget_mb'] * 1024 * 1024)
+    # Rendered summaries and full-range figures, shared by every browser session.
+    # Zoomed figures depend on the visible window and are always built fresh.
+    render_cache = RideCache(render_view, max_bytes=settings['render_cache_entries'], sizeof=lambda view: 1)
+    # Comparison grids keyed by (ride, content hash, axis)
+    grid_cache = RideCache(load_comparison_grid, max_bytes=settings['grid_cache_mb'] * 1024 * 1024)
+    register_cache('rides', ride_cache)
+    register_cache('rendered_views', render_cache)
+    register_cache('comparison_grids', grid_cache)
+
+    app = dash.Dash(__name__)
+    add_metrics_route(app)
+    app.layout = build_layout()
+    rides.register_callback(app, extra_selectors=['compare-selector'])
+    app.callback(Output('output-summary', 'children'), [Input('file-selector', 'value')])(update_summary)
+    for graph in TIME_SERIES_GRAPHS:
+        register_time_series_callback(app, *graph)
+    app.callback(Output('comparison-graph', 'figure'),
+                 [Input('compare-selector', 'value'), Input('compare-axis', 'value'),
+                  Input('compare-column', 'value'), Input('comparison-graph', 'relayoutData')])(update_comparison)
+    return app
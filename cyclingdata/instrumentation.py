@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Stage timing, cache statistics and opt-in profiling.
+
+Code wraps its expensive steps in stage_timer (or the timed decorator) and
+the wall time, call count and record counts are accumulated per stage name
+in this process. Decode workers send their totals back with every result
+chunk (see fit_ingest.parallel_map_unordered), so the parent sees the whole
+ingest. Registered caches (RideCache instances) report their hit rates.
+
+The totals are read with metrics_snapshot(); the Dash apps serve them at
+/metrics (add_metrics_route), the scripts print them with print_metrics, and
+enable_json_log writes one JSON line per stage call and per decoded file.
+profile_capture wraps a block in cProfile or pyinstrument when asked to.
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_LOGGER_NAME = 'cyclingdata.metrics'
+RECENT_FILES = 50
+PROFILE_MODES = ('cprofile', 'pyinstrument')
+
+_logger = logging.getLogger(METRICS_LOGGER_NAME)
+_lock = threading.Lock()
+_stages = {}  # stage name -> {'calls', 'seconds', 'max_seconds', 'files', 'records'}
+_caches = {}  # cache name -> object with hits, misses, evictions, total_bytes and len()
+_recent_files = deque(maxlen=RECENT_FILES)
+
+def _new_stage():
+    return {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'files': 0, 'records': 0}
+
+def record_stage(name, seconds, calls=1, files=0, records=0, max_seconds=None):
+    """Adds one (or calls) timed runs of a stage to the totals."""
+    with _lock:
+        stage = _stages.setdefault(name, _new_stage())
+        stage['calls'] += calls
+        stage['seconds'] += seconds
+        stage['max_seconds'] = max(stage['max_seconds'], seconds if max_seconds is None else max_seconds)
+        stage['files'] += files
+        stage['records'] += records
+    if _logger.isEnabledFor(logging.INFO):
+        _logger.info(json.dumps({'event': 'stage', 'stage': name, 'seconds': seconds,
+                                 'files': files, 'records': records}))
+
+def record_file(path, records, seconds):
+    """Notes a decoded file's record count and decode time."""
+    event = {'event': 'file', 'path': path, 'records': records, 'seconds': seconds}
+    with _lock:
+        _recent_files.append(event)
+    if _logger.isEnabledFor(logging.INFO):
+        _logger.info(json.dumps(event))
+
+class _StageTimer:
+    """Handle yielded by stage_timer; set files/records before the block ends."""
+
+    def __init__(self):
+        self.files = 0
+        self.records = 0
+        self.seconds = None
+
+@contextmanager
+def stage_timer(name, files=0, records=0):
+    """Times the enclosed block as one call of stage name."""
+    timer = _StageTimer()
+    timer.files, timer.records = files, records
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - start
+        record_stage(name, timer.seconds, files=timer.files, records=timer.records)
+
+def timed(name):
+    """Decorator form of stage_timer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_cache(name, cache):
+    """Includes a cache's hit/miss/eviction counters in the metrics."""
+    with _lock:
+        _caches[name] = cache
+
+def drain_worker_metrics():
+    """
+    Returns and clears this process's stage totals and file events. Used by
+    decode workers to ship their measurements back with each result chunk.
+    """
+    with _lock:
+        stages = dict(_stages)
+        files = list(_recent_files)
+        _stages.clear()
+        _recent_files.clear()
+    return {'stages': stages, 'files': files}
+
+def merge_worker_metrics(metrics):
+    """Adds totals returned by drain_worker_metrics in another process."""
+    for name, totals in metrics['stages'].items():
+        record_stage(name, totals['seconds'], calls=totals['calls'], files=totals['files'],
+                     records=totals['records'], max_seconds=totals['max_seconds'])
+    for event in metrics['files']:
+        record_file(event['path'], event['records'], event['seconds'])
+
+def _cache_metrics(cache):
+    lookups = cache.hits + cache.misses
+    return {
+        'hits': cache.hits,
+        'misses': cache.misses,
+        'hit_rate': cache.hits / lookups if lookups else None,
+        'evictions': cache.evictions,
+        'entries': len(cache),
+        'size': cache.total_bytes,
+    }
+
+def metrics_snapshot():
+    """All stage totals, cache statistics and the most recently decoded files, as a JSON-ready dict."""
+    with _lock:
+        stages = {name: dict(totals) for name, totals in _stages.items()}
+        caches = dict(_caches)
+        recent_files = list(_recent_files)
+    for totals in stages.values():
+        totals['mean_seconds'] = totals['seconds'] / totals['calls'] if totals['calls'] else None
+        totals['records_per_s'] = totals['records'] / totals['seconds'] if totals['records'] and totals['seconds'] else None
+    return {
+        'stages': stages,
+        'caches': {name: _cache_metrics(cache) for name, cache in caches.items()},
+        'recent_files': recent_files,
+    }
+
+def reset_metrics():
+    with _lock:
+        _stages.clear()
+        _recent_files.clear()
+
+def print_metrics():
+    """Prints the stage totals and cache hit rates as a table."""
+    snapshot = metrics_snapshot()
+    if snapshot['stages']:
+        print(f"\n{'stage':<28}{'calls':>8}{'total s':>10}{'mean s':>10}{'max s':>10}{'records/s':>12}")
+        for name, totals in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print(f"{name:<28}{totals['calls']:>8}{totals['seconds']:>10.3f}{totals['mean_seconds']:>10.4f}"
+                  f"{totals['max_seconds']:>10.4f}{totals['records_per_s'] or 0:>12.0f}")
+    for name, cache in snapshot['caches'].items():
+        hit_rate = f"{cache['hit_rate']:.1%}" if cache['hit_rate'] is not None else 'n/a'
+        print(f"cache {name}: {cache['hits']} hits, {cache['misses']} misses ({hit_rate}), "
+              f"{cache['evictions']} evictions, {cache['entries']} entries")
+
+def enable_json_log(path):
+    """Appends one JSON object per line to path for every stage call and decoded file."""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter('{"time": "%(asctime)s", "metrics": %(message)s}'))
+    _logger.addHandler(handler)
+    _logger.setLevel(logging.INFO)
+    _logger.propagate = False
+    return handler
+
+def add_metrics_route(app, path='/metrics'):
+    """Serves metrics_snapshot() as JSON at path on a Dash app's Flask server."""
+    import flask
+
+    @app.server.route(path)
+    def metrics():
+        return flask.jsonify(metrics_snapshot())
+
+    return metrics
+
+@contextmanager
+def profile_capture(name, mode=None, output_directory='profiles'):
+    """
+    Profiles the enclosed block when mode is 'cprofile' (writes
+    <output_directory>/<name>.prof, open with snakeviz or pstats) or
+    'pyinstrument' (writes <name>.html; needs the pyinstrument package).
+    With mode None the block just runs.
+    """
+    if mode is None:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+    os.makedirs(output_directory, exist_ok=True)
+
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            output_path = os.path.join(output_directory, f'{name}.prof')
+            profiler.dump_stats(output_path)
+            print(f"Profile written to {output_path}")
+    else:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("pyinstrument is not installed (pip install pyinstrument), running without profiling.")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            output_path = os.path.join(output_directory, f'{name}.html')
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+            print(f"Profile written to {output_path}")
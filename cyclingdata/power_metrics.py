@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+WKO-style power metrics: Normalized Power, IF, TSS, the mean-maximal
+power (power-duration) curve and W' balance.
+
+Everything works on a ride's power resampled to one sample per second, with
+recording gaps (auto-pause, dropouts) filled with 0 W. Rolling averages come
+from prefix sums, so a window mean is one subtraction instead of a loop over
+the window: NP is O(n), and each duration of the power curve is one
+vectorized O(n) pass.
+"""
+import numpy as np
+import pandas as pd
+
+NP_WINDOW_S = 30
+# durations power curves are usually read at (5 s sprint ... 20 min FTP test);
+# power_curve_durations always includes them so reports can look them up exactly
+STANDARD_DURATIONS_S = (5, 10, 30, 60, 300, 600, 1200, 1800, 3600, 5400, 7200)
+
+def power_per_second(df):
+    """
+    Power of a ride as a float64 array with one sample per second from the
+    first to the last timestamp. Seconds without a record and records without
+    power are 0 W. Samples sharing a second are averaged.
+    """
+    if df is None or df.empty or 'power' not in df.columns or 'timestamp' not in df.columns:
+        return np.zeros(0)
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]')
+    watts = df['power'].to_numpy(dtype='float64', na_value=np.nan)
+    present = ~np.isnat(seconds)
+    seconds, watts = seconds[present].astype('int64'), watts[present]
+    if len(seconds) == 0:
+        return np.zeros(0)
+
+    offsets = seconds - seconds.min()
+    length = int(offsets.max()) + 1
+    watts = np.nan_to_num(watts, nan=0.0)
+    totals = np.bincount(offsets, weights=watts, minlength=length)
+    counts = np.bincount(offsets, minlength=length)
+    return np.divide(totals, counts, out=np.zeros(length), where=counts > 0)
+
+def _prefix_sums(power):
+    return np.concatenate(([0.0], np.cumsum(power, dtype='float64')))
+
+def rolling_mean(power, window):
+    """Trailing window means of a 1 Hz power array (len(power) - window + 1 values)."""
+    if window > len(power):
+        return np.zeros(0)
+    sums = _prefix_sums(power)
+    return (sums[window:] - sums[:-window]) / window
+
+def normalized_power(power, window=NP_WINDOW_S):
+    """
+    Normalized Power: fourth root of the mean of the fourth power of the 30 s
+    rolling average. NaN for rides shorter than the window.
+    """
+    rolling = rolling_mean(np.asarray(power, dtype='float64'), window)
+    if len(rolling) == 0:
+        return np.nan
+    return float(np.mean(rolling ** 4) ** 0.25)
+
+def intensity_factor(normalized_power_w, ftp):
+    return normalized_power_w / ftp
+
+def ride_duration_s(power):
+    """
+    Duration of a ride for TSS, from its power_per_second array: the seconds
+    from the first to the last record, like duration_s in the ride index,
+    which training_load sums its daily stress from.
+    """
+    return max(len(power) - 1, 0)
+
+def training_stress_score(normalized_power_w, duration_s, ftp):
+    """TSS = duration x NP x IF / (FTP x 3600) x 100."""
+    return duration_s * normalized_power_w * intensity_factor(normalized_power_w, ftp) / (ftp * 3600) * 100
+
+def ride_power_metrics(df, ftp, cp=None, w_prime=None):
+    """
+    NP, IF and TSS of one ride DataFrame for a given FTP in watts, as a dict
+    (normalized_power, intensity_factor, training_stress_score). Values are
+    NaN if the ride has no usable power. With cp (W) and w_prime (J) the
+    lowest W' balance of the ride (min_w_prime_balance) is added.
+    """
+    power = power_per_second(df)
+    np_w = normalized_power(power)
+    metrics = {
+        'normalized_power': np_w,
+        'intensity_factor': intensity_factor(np_w, ftp),
+        'training_stress_score': training_stress_score(np_w, ride_duration_s(power), ftp),
+    }
+    if cp is not None and w_prime is not None:
+        metrics['min_w_prime_balance'] = w_prime_balance(df, cp, w_prime).min()
+    return metrics
+
+def power_curve_durations(max_duration_s, step=0.02, every_second_until=120):
+    """
+    Durations (in seconds) for power curves: every second up to
+    every_second_until, then geometrically spaced by step (2 %) up to
+    max_duration_s, which is always included, as are STANDARD_DURATIONS_S up
+    to it. Rides summarized on the same grid can be combined elementwise.
+    """
+    max_duration_s = int(max_duration_s)
+    if max_duration_s < 1:
+        return np.zeros(0, dtype=np.int64)
+    dense = np.arange(1, min(every_second_until, max_duration_s) + 1)
+    if max_duration_s <= every_second_until:
+        return dense
+    count = int(np.ceil(np.log(max_duration_s / every_second_until) / np.log1p(step))) + 1
+    sparse = np.geomspace(every_second_until, max_duration_s, count).round().astype(np.int64)
+    standard = [duration for duration in STANDARD_DURATIONS_S if duration <= max_duration_s]
+    return np.unique(np.concatenate((dense, sparse, standard, [max_duration_s])))
+
+def mean_max_power(power, durations=None):
+    """
+    Mean-maximal power: for each duration, the highest average power over
+    any window of that length. durations defaults to every second from 1 s
+    to the ride length (exact, O(n) per duration; use power_curve_durations
+    for a sparser grid on long rides). Returns a Series indexed by duration
+    in seconds; durations longer than the ride are NaN.
+    """
+    power = np.asarray(power, dtype='float64')
+    if durations is None:
+        durations = np.arange(1, len(power) + 1)
+    durations = np.asarray(durations, dtype=np.int64)
+
+    sums = _prefix_sums(power)
+    best = np.full(len(durations), np.nan)
+    for i, duration in enumerate(durations):
+        if 0 < duration <= len(power):
+            best[i] = np.max(sums[duration:] - sums[:-duration]) / duration
+    return pd.Series(best, index=pd.Index(durations, name='duration_s'), name='power')
+
+def season_power_curve(rides, durations=None):
+    """
+    Best mean-maximal power over many rides. rides is a dict (or iterable
+    of pairs) of ride key -> DataFrame; each ride's curve is computed on the
+    same duration grid and the season curve is their elementwise maximum.
+    durations defaults to power_curve_durations up to the longest ride.
+    Returns a Series indexed by duration in seconds.
+    """
+    if hasattr(rides, 'items'):
+        rides = rides.items()
+    powers = [power_per_second(df) for _, df in rides]
+    if durations is None:
+        durations = power_curve_durations(max((len(p) for p in powers), default=0))
+
+    best = np.full(len(durations), np.nan)
+    for power in powers:
+        best = np.fmax(best, mean_max_power(power, durations).to_numpy())
+    return pd.Series(best, index=pd.Index(np.asarray(durations, dtype=np.int64), name='duration_s'), name='power')
+
+# W' balance: D (the W' expended so far) follows the linear recurrence
+# D_i = a_i * D_(i-1) + b_i, with a_i the recovery decay and b_i the work above
+# CP in step i. Its closed form D_i = A_i * (D_0 + sum_j b_j / A_j), A_i = prod a_j,
+# is evaluated with cumulative sums of log(a); the products are rebased every
+# time log(A) falls by another _LOG_BLOCK so 1 / A_j never overflows.
+_LOG_BLOCK = 300.0
+
+def _linear_recurrence(log_a, b, initial=0.0):
+    """D_i = exp(log_a_i) * D_(i-1) + b_i for all i, vectorized blockwise."""
+    log_a = np.maximum(log_a, -_LOG_BLOCK)  # exp(-300) is already 0 for any W'
+    log_A = np.cumsum(log_a)
+    blocks = np.floor(-log_A / _LOG_BLOCK).astype(np.int64)
+    starts = np.flatnonzero(np.diff(blocks, prepend=blocks[0] - 1))
+    ends = np.append(starts[1:], len(b))
+
+    result = np.empty(len(b))
+    carry, base = initial, 0.0
+    for start, end in zip(starts, ends):
+        relative = log_A[start:end] - base
+        result[start:end] = np.exp(relative) * (carry + np.cumsum(b[start:end] * np.exp(-relative)))
+        carry, base = result[end - 1], log_A[end - 1]
+    return result
+
+def _power_steps(df):
+    """
+    Power, work seconds and gap seconds of each record. A record counts for
+    the time since the previous one, but for at most 1 s of work at its
+    power; the rest of a longer gap is treated as 0 W.
+    """
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]')
+    present = ~np.isnat(seconds)
+    seconds = seconds[present].astype('int64').astype('float64')
+    watts = np.nan_to_num(df['power'].to_numpy(dtype='float64', na_value=np.nan)[present], nan=0.0)
+    # the first record counts as one second; out-of-order or repeated timestamps as none
+    elapsed = np.maximum(np.diff(seconds, prepend=seconds[:1] - 1), 0.0)
+    work_s = np.minimum(elapsed, 1.0)
+    return present, watts, work_s, elapsed - work_s
+
+def w_prime_balance(df, cp, w_prime, method='differential'):
+    """
+    W' balance in joules at every record of a ride, for critical power cp (W)
+    and anaerobic capacity w_prime (J). Returns a Series aligned with df
+    (NaN where the record has no timestamp).
+
+    method 'differential' is Skiba's differential model (recovery rate
+    proportional to the W' still missing and to CP - P); 'integral' is
+    Skiba's original integral model with the recovery time constant
+    tau = 546 * exp(-0.01 * (CP - mean recovery power)) + 316.
+    """
+    balance = pd.Series(np.nan, index=df.index, name='w_prime_balance')
+    if df.empty or 'power' not in df.columns or 'timestamp' not in df.columns:
+        return balance
+    present, watts, work_s, gap_s = _power_steps(df)
+    if not present.any():
+        return balance
+
+    above = np.maximum(watts - cp, 0.0)
+    below = np.maximum(cp - watts, 0.0)
+    work_above = above * work_s
+    if method == 'differential':
+        log_decay = -(below * work_s + cp * gap_s) / w_prime
+    elif method == 'integral':
+        recovering = (watts < cp) & (work_s > 0)
+        recovery_s = work_s[recovering].sum() + gap_s.sum()
+        recovery_power = (watts[recovering] * work_s[recovering]).sum() / recovery_s if recovery_s > 0 else 0.0
+        tau = 546 * np.exp(-0.01 * (cp - recovery_power)) + 316
+        log_decay = -(work_s + gap_s) / tau
+    else:
+        raise ValueError(f"Unknown W' balance method: {method}")
+
+    balance[present] = w_prime - _linear_recurrence(log_decay, work_above)
+    return balance
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Text and chart reports over the ingested rides.
+
+print_summary_report only reads the ride-summary index and streams rides
+through the season aggregates, so it never holds the whole archive in
+memory. plot_summary_report draws the charts; matplotlib and seaborn are
+imported only when it is called.
+"""
+import os
+import pandas as pd
+from cyclingdata.fit_ingest import cached_ride_columns, load_cached_ride
+from cyclingdata.ride_index import query_ride_summaries
+from cyclingdata.season_aggregates import SEASON_COLUMNS, aggregate_season, season_checkpoint_path
+from cyclingdata.training_load import training_load
+
+CURVE_REPORT_DURATIONS = (5, 60, 300, 1200, 3600)
+
+def print_summary_report(rides, cache_directory, ftp_watts=250, show_columns=False):
+    """
+    Prints a preview of the first ride, the per-ride summary table, weekly
+    totals, time in power zones and the season power curve for rides
+    (source path -> manifest entry). Returns (summaries, season), the
+    summary table and the SeasonAggregate, for plot_summary_report.
+    """
+    rides = {source_path: entry for source_path, entry in rides.items() if entry.get('cache_file')}
+    if rides:
+        print("\nSuccessfully processed the .fit files. Here's a preview of the data from the first file:")
+        first_file_path = list(rides.keys())[0]
+        print(f"\nData from: {first_file_path}")
+        print(load_cached_ride(rides[first_file_path], cache_directory).head())
+    else:
+        print("No workout data was extracted from the .fit files.")
+
+    # Summary statistics for every workout, read from the ride-summary index
+    summaries = query_ride_summaries(cache_directory)
+    if not summaries.empty:
+        print("\n--- Summary Statistics ---")
+        print(summaries.drop(columns=['sha1']).to_string())
+    else:
+        print("No workout data available. Please ensure you have processed the .fit files first.")
+
+    if show_columns:
+        for file_path, entry in rides.items():
+            print(f"\nColumns in DataFrame for: {file_path}")
+            print(cached_ride_columns(entry, cache_directory))
+
+    # Season aggregates, streamed from the ride cache one ride at a time and
+    # checkpointed in the cache directory so later runs only add new rides
+    season = aggregate_season({file_path: entry.get('sha1') for file_path, entry in rides.items()},
+                              lambda file_path: load_cached_ride(rides[file_path], cache_directory, columns=SEASON_COLUMNS),
+                              checkpoint_path=season_checkpoint_path(cache_directory))
+    print("\n--- Weekly Totals ---")
+    print(season.weekly_totals().to_string())
+    print("\n--- Time in Power Zones (s) ---")
+    print(season.power_zone_seconds(ftp_watts).to_string())
+
+    season_curve = season.best_effort_curve()
+    if not season_curve.empty:
+        print("\n--- Season Power Curve ---")
+        for duration in CURVE_REPORT_DURATIONS:
+            if duration in season_curve.index:
+                print(f"{duration} s: {season_curve[duration]:.0f} W")
+
+    # Fitness, fatigue and form, kept up to date in the ride index
+    load = training_load(cache_directory, ftp_watts)
+    if not load.empty:
+        print("\n--- Training Load (last 7 days) ---")
+        recent = load.tail(7).round(1)
+        print(recent.set_axis(recent.index.date).to_string())
+    return summaries, season
+
+def plot_summary_report(summaries, season):
+    """Shows the mean-power box plot and the season power curve (blocks until the windows are closed)."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Chart of Mean Power for Each Workout
+    if not summaries.empty:
+        mean_powers = summaries.get('mean_power', pd.Series(dtype='float64')).dropna()
+
+        if not mean_powers.empty:
+            df_boxplot = pd.DataFrame({'Workout': [os.path.basename(p) for p in mean_powers.index],
+                                       'Mean Power (Watts)': mean_powers.to_numpy()})
+            plt.figure(figsize=(10, 6))
+            sns.boxplot(x='Workout', y='Mean Power (Watts)', data=df_boxplot)
+            plt.xlabel("Workout")
+            plt.ylabel("Mean Power (Watts)")
+            plt.title("Distribution of Mean Power Across Workouts")
+            plt.xticks([])
+            plt.tight_layout()
+            plt.show()
+        else:
+            print("No max power data available to create the box plot.")
+    else:
+        print("Please run the summary statistics calculation first.")
+
+    # Season power-duration curve: best average power for each duration over all rides
+    season_curve = season.best_effort_curve()
+    if not season_curve.empty:
+        plt.figure(figsize=(10, 6))
+        plt.plot(season_curve.index, season_curve.to_numpy())
+        plt.xscale('log')
+        plt.xlabel("Duration (s)")
+        plt.ylabel("Mean Maximal Power (Watts)")
+        plt.title("Season Power Curve")
+        plt.tight_layout()
+        plt.show()
+    else:
+        print("No power data available to create the power curve.")
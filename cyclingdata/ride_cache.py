@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Size-bounded LRU cache for ride DataFrames.
+
+The Dash apps only keep a lightweight index of rides in memory and load a
+ride's DataFrame the first time it is selected. Loaded rides are kept here
+until the memory budget is exceeded, at which point the least recently used
+rides are dropped.
+"""
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def dataframe_nbytes(df):
+    """Approximate resident size of a DataFrame, including object column payloads."""
+    return int(df.memory_usage(deep=True).sum())
+
+class RideCache:
+    """
+    LRU mapping of ride key -> DataFrame with a memory budget in bytes.
+
+    loader(key) is called on a miss and should return a DataFrame, or None if
+    the ride cannot be loaded (None results are not cached). The most recently
+    loaded ride is always kept, even if it alone exceeds the budget. Safe to
+    share between the threads of the Dash server.
+
+    sizeof(value) gives each entry's size in the units of max_bytes, so
+    sizeof=lambda value: 1 turns the budget into a maximum number of entries
+    (used for the dashboards' rendered summaries and figures).
+    """
+
+    def __init__(self, loader, max_bytes=DEFAULT_MAX_BYTES, sizeof=dataframe_nbytes):
+        self._loader = loader
+        self._sizeof = sizeof
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes), oldest first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # load outside the lock so a slow read does not block cache hits
+        value = self._loader(key)
+        if value is None:
+            return None
+        nbytes = self._sizeof(value)
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self._total_bytes += nbytes
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        """Drops one ride, or every ride when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._total_bytes = 0
+            elif key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-interval resampled grids of rides, for overlaying several rides.
+
+Overlaying rides (repeats of a climb, the same course in another season)
+needs their samples on a common x axis. Each ride gets two grids, computed
+once at ingest and stored next to the ride (see ride_store.save_ride_grids):
+
+* 'time': one row per GRID_STEPS['time'] seconds of elapsed time since the
+  ride's first record, NaN where nothing was recorded (pauses, dropouts).
+* 'distance': one row per GRID_STEPS['distance'] metres covered, with the
+  elapsed time at which each distance was reached, so rides of the same
+  course line up even when they were paced differently.
+
+Values are float32, aligned on the ride's start. A comparison view then only
+slices each ride's grid to the visible range, with no resampling per request.
+"""
+import numpy as np
+import pandas as pd
+
+GRID_AXES = {'time': 'elapsed_s', 'distance': 'distance_m'}  # grid name -> its x column
+GRID_STEPS = {'time': 1.0, 'distance': 10.0}  # seconds, metres
+GRID_COLUMNS = ['power', 'heart_rate', 'speed', 'cadence', 'altitude']
+# ride columns a grid is computed from
+GRID_SOURCE_COLUMNS = ['timestamp', 'distance'] + GRID_COLUMNS
+
+def _float_values(df, column):
+    return df[column].to_numpy(dtype='float64', na_value=np.nan)
+
+def time_grid(df, step=GRID_STEPS['time']):
+    """
+    The ride's GRID_COLUMNS averaged into step-second bins of elapsed time, as
+    a float32 DataFrame with an elapsed_s column. None without timestamps.
+    """
+    if df is None or df.empty or 'timestamp' not in df.columns:
+        return None
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]')
+    present = ~np.isnat(seconds)
+    if not present.any():
+        return None
+    elapsed = seconds[present].astype('int64')
+    bins = ((elapsed - elapsed.min()) // step).astype('int64')
+    length = int(bins.max()) + 1
+
+    grid = {GRID_AXES['time']: np.arange(length, dtype='float32') * np.float32(step)}
+    for column in GRID_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = _float_values(df, column)[present]
+        known = ~np.isnan(values)
+        totals = np.bincount(bins[known], weights=values[known], minlength=length)
+        counts = np.bincount(bins[known], minlength=length)
+        grid[column] = np.divide(totals, counts, out=np.full(length, np.nan), where=counts > 0).astype('float32')
+    return pd.DataFrame(grid)
+
+def distance_grid(df, step=GRID_STEPS['distance']):
+    """
+    The ride's GRID_COLUMNS and elapsed time interpolated every step metres
+    of distance, as a float32 DataFrame with a distance_m column. Where the
+    rider stood still the first sample at that distance counts. None without
+    distance data.
+    """
+    if df is None or df.empty or 'distance' not in df.columns or 'timestamp' not in df.columns:
+        return None
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]')
+    distance = _float_values(df, 'distance')
+    present = ~np.isnat(seconds) & ~np.isnan(distance)
+    if present.sum() < 2:
+        return None
+    elapsed = seconds[present].astype('int64').astype('float64')
+    elapsed -= elapsed.min()
+    # odometer glitches must not send the distance backwards
+    distance = np.maximum.accumulate(distance[present] - distance[present][0])
+    distance, first = np.unique(distance, return_index=True)
+    if distance[-1] < step:
+        return None
+
+    axis = np.arange(0.0, distance[-1], step)
+    grid = {GRID_AXES['distance']: axis.astype('float32'),
+            'elapsed_s': np.interp(axis, distance, elapsed[first]).astype('float32')}
+    for column in GRID_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = _float_values(df, column)[present][first]
+        known = ~np.isnan(values)
+        if not known.any():
+            continue
+        grid[column] = np.interp(axis, distance[known], values[known]).astype('float32')
+    return pd.DataFrame(grid)
+
+GRID_BUILDERS = {'time': time_grid, 'distance': distance_grid}
+
+def ride_grids(df):
+    """Both grids of a ride as {grid name: DataFrame or None}."""
+    return {name: builder(df) for name, builder in GRID_BUILDERS.items()}
+
+def grid_slice(grid, axis, start=None, end=None):
+    """The rows of a grid whose x value is within [start, end]; a slice, no copy of the arrays."""
+    x = grid[GRID_AXES[axis]].to_numpy()
+    first = 0 if start is None else int(np.searchsorted(x, start, side='left'))
+    last = len(x) if end is None else int(np.searchsorted(x, end, side='right'))
+    return grid.iloc[first:last]
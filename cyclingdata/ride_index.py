@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent ride-summary index.
+
+A small SQLite table in the cache directory holds one row per ride: start
+time, duration, the ride metadata (device, sport, session totals, laps,
+sensors; see ride_metadata.py) and the aggregates from ride_summary. The ingest keeps
+it up to date incrementally, so cross-ride questions (filters, distributions,
+charts) are answered from the index without loading any record streams.
+Each row keeps the content hash and the record-field selection the ride was
+decoded with, so a ride decoded again with other fields is summarized again.
+A second table maps the grid cells each ride's GPS track passes through to
+the ride (see route_index.py), and a third holds the daily training load
+and its CTL/ATL state (see training_load.py).
+"""
+import json
+import os
+import sqlite3
+from contextlib import closing
+import pandas as pd
+from cyclingdata.ride_metadata import METADATA_COLUMNS
+from cyclingdata.ride_summary import SUMMARY_AGGREGATES
+
+RIDE_INDEX_FILE_NAME = 'ride_index.sqlite'
+RIDE_INDEX_VERSION = 5
+SQL_PARAMETER_BATCH = 500 # values per IN (...) list, below SQLite's parameter limit
+
+LISTING_COLUMNS = ['start_time', 'sport', 'sub_sport', 'device']
+
+AGGREGATE_COLUMNS = ([name for aggregations in SUMMARY_AGGREGATES.values() for name, _ in aggregations]
+                     + ['altitude_gain', 'normalized_power'])
+RIDE_COLUMNS = ['ride_id', 'sha1', 'fields', 'start_time', 'duration_s', 'records'] + list(METADATA_COLUMNS) + AGGREGATE_COLUMNS
+
+_CREATE_RIDES_TABLE = f"""
+CREATE TABLE IF NOT EXISTS rides (
+    ride_id TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    fields TEXT, -- JSON list of the decoded record fields, NULL for all
+    start_time INTEGER,
+    duration_s REAL,
+    records INTEGER NOT NULL,
+    {', '.join(f'{name} {sql_type}' for name, sql_type in METADATA_COLUMNS.items())},
+    {', '.join(f'{name} REAL' for name in AGGREGATE_COLUMNS)}
+)
+"""
+
+_CREATE_CELLS_TABLE = """
+CREATE TABLE IF NOT EXISTS ride_cells (
+    cell INTEGER NOT NULL,
+    ride_id TEXT NOT NULL,
+    PRIMARY KEY (cell, ride_id)
+) WITHOUT ROWID
+"""
+
+# one row per day (days since the epoch, UTC) from the first ride on; stress
+# is FTP-independent, see training_load.py
+_CREATE_DAILY_LOAD_TABLE = """
+CREATE TABLE IF NOT EXISTS daily_load (
+    day INTEGER PRIMARY KEY,
+    stress REAL NOT NULL,
+    ctl REAL NOT NULL,
+    atl REAL NOT NULL
+)
+"""
+
+def ride_index_path(cache_directory):
+    return os.path.join(cache_directory, RIDE_INDEX_FILE_NAME)
+
+def connect_ride_index(cache_directory):
+    """
+    Opens (creating if needed) the ride index in cache_directory. An index
+    written by an older layout is dropped; the next sync rebuilds it.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    conn = sqlite3.connect(ride_index_path(cache_directory))
+    if conn.execute('PRAGMA user_version').fetchone()[0] != RIDE_INDEX_VERSION:
+        conn.execute('DROP TABLE IF EXISTS rides')
+        conn.execute('DROP TABLE IF EXISTS ride_cells')
+        conn.execute('DROP TABLE IF EXISTS daily_load')
+        conn.execute(f'PRAGMA user_version = {RIDE_INDEX_VERSION}')
+    conn.execute(_CREATE_RIDES_TABLE)
+    conn.execute(_CREATE_CELLS_TABLE)
+    conn.execute(_CREATE_DAILY_LOAD_TABLE)
+    conn.execute('CREATE INDEX IF NOT EXISTS ride_cells_ride ON ride_cells (ride_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS rides_start_time ON rides (start_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS rides_device ON rides (device)')
+    conn.execute('CREATE INDEX IF NOT EXISTS rides_sport ON rides (sport)')
+    conn.commit()
+    return conn
+
+def indexed_ride_hashes(conn):
+    """Returns ride_id -> content hash for every ride in the index."""
+    return dict(conn.execute('SELECT ride_id, sha1 FROM rides'))
+
+def field_selection_key(fields):
+    """How a field selection (None for all fields) is stored in the index."""
+    return None if fields is None else json.dumps(list(fields))
+
+def indexed_ride_states(conn):
+    """Returns ride_id -> (content hash, field_selection_key) for every ride in the index."""
+    return {ride_id: (sha1, fields) for ride_id, sha1, fields in conn.execute('SELECT ride_id, sha1, fields FROM rides')}
+
+def _to_sql_value(value):
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return int(value.timestamp())
+    if isinstance(value, pd.Timedelta):
+        return value.total_seconds()
+    return value.item() if hasattr(value, 'item') else value
+
+def upsert_ride_summaries(conn, summary, hashes, metadata=None, fields=None):
+    """
+    Inserts or replaces index rows from a summarize_rides table. hashes (and
+    optionally metadata and fields) map each ride id in the summary's index
+    to its content hash (ride_metadata dict, decoded field selection). Rides
+    without a record timestamp get their session start time.
+    """
+    metadata = metadata or {}
+    fields = fields or {}
+    rows = []
+    for ride_id, row in summary.iterrows():
+        ride_metadata = metadata.get(ride_id) or {}
+        values = {
+            'ride_id': ride_id,
+            'sha1': hashes[ride_id],
+            'fields': field_selection_key(fields.get(ride_id)),
+            'start_time': row.get('start_time'),
+            'duration_s': row.get('duration'),
+            'records': row.get('records', 0),
+        }
+        if values['start_time'] is None or pd.isna(values['start_time']):
+            values['start_time'] = ride_metadata.get('session_start_time')
+        for name in METADATA_COLUMNS:
+            values[name] = ride_metadata.get(name)
+        for name in AGGREGATE_COLUMNS:
+            values[name] = row.get(name)
+        rows.append(tuple(_to_sql_value(values[column]) for column in RIDE_COLUMNS))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO rides ({', '.join(RIDE_COLUMNS)}) VALUES ({', '.join('?' * len(RIDE_COLUMNS))})",
+        rows)
+
+def delete_rides(conn, ride_ids):
+    ride_ids = list(ride_ids)
+    conn.executemany('DELETE FROM rides WHERE ride_id = ?', ((ride_id,) for ride_id in ride_ids))
+    conn.executemany('DELETE FROM ride_cells WHERE ride_id = ?', ((ride_id,) for ride_id in ride_ids))
+
+def replace_ride_cells(conn, cells):
+    """Stores the track cells of rides, given as ride_id -> array of cell ids, replacing their old ones."""
+    for ride_id, ride_cells in cells.items():
+        conn.execute('DELETE FROM ride_cells WHERE ride_id = ?', (ride_id,))
+        conn.executemany('INSERT INTO ride_cells (cell, ride_id) VALUES (?, ?)',
+                         ((int(cell), ride_id) for cell in ride_cells))
+
+def rides_in_cells(conn, cells):
+    """The ids of the rides whose tracks pass through any of cells."""
+    cells = [int(cell) for cell in cells]
+    ride_ids = set()
+    for start in range(0, len(cells), SQL_PARAMETER_BATCH):
+        batch = cells[start:start + SQL_PARAMETER_BATCH]
+        ride_ids.update(ride_id for ride_id, in conn.execute(
+            f"SELECT DISTINCT ride_id FROM ride_cells WHERE cell IN ({', '.join('?' * len(batch))})", batch))
+    return ride_ids
+
+def query_ride_summaries(cache_directory, where=None, params=(), order_by='start_time', columns=None):
+    """
+    Returns indexed ride summaries as a DataFrame indexed by ride_id, with
+    start_time as UTC datetimes and duration as timedeltas. where is an
+    optional SQL condition on the rides table columns, e.g.
+    query_ride_summaries(cache_dir, 'mean_power > ? AND sport = ?', (200, 'cycling')).
+    Pass columns to select only some columns (ride_id is always included).
+    """
+    selected = ', '.join(['ride_id'] + [c for c in columns if c != 'ride_id']) if columns else '*'
+    sql = f'SELECT {selected} FROM rides'
+    if where:
+        sql += f' WHERE {where}'
+    if order_by:
+        sql += f' ORDER BY {order_by}'
+    with closing(connect_ride_index(cache_directory)) as conn:
+        summaries = pd.read_sql_query(sql, conn, params=params, index_col='ride_id')
+    if 'start_time' in summaries.columns:
+        summaries['start_time'] = pd.to_datetime(summaries['start_time'], unit='s', utc=True)
+    if 'duration_s' in summaries.columns:
+        duration = pd.to_timedelta(summaries.pop('duration_s'), unit='s')
+        position = summaries.columns.get_loc('start_time') + 1 if 'start_time' in summaries.columns else 0
+        summaries.insert(position, 'duration', duration)
+    if 'session_start_time' in summaries.columns:
+        summaries['session_start_time'] = pd.to_datetime(summaries['session_start_time'], unit='s', utc=True)
+    return summaries
+
+def query_ride_listing(cache_directory):
+    """Start time, sport and device of every indexed ride, newest first: enough to list and filter rides."""
+    return query_ride_summaries(cache_directory, order_by='start_time DESC', columns=LISTING_COLUMNS)
+
+def ride_label(ride_id, row=None):
+    """'2024-05-06 12:53 | cycling | garmin edge530 | ride.fit.gz' for a listing row."""
+    parts = []
+    if row is not None:
+        if pd.notna(row['start_time']):
+            parts.append(f"{row['start_time']:%Y-%m-%d %H:%M}")
+        parts.extend(str(row[name]) for name in ('sport', 'device') if pd.notna(row[name]))
+    parts.append(os.path.basename(ride_id))
+    return ' | '.join(parts)
+
+def ride_listing_options(listing, ride_ids, sport=None, device=None):
+    """
+    Dropdown options ({'label', 'value'}) for the rides in ride_ids, in
+    listing order and labelled with date, sport and device. sport and device
+    keep only matching rides. Rides missing from the listing come last,
+    labelled by file name, and only when no filter is set.
+    """
+    ride_ids = set(ride_ids)
+    rows = listing[listing.index.isin(ride_ids)]
+    if sport:
+        rows = rows[rows['sport'] == sport]
+    if device:
+        rows = rows[rows['device'] == device]
+    options = [{'label': ride_label(ride_id, row), 'value': ride_id} for ride_id, row in rows.iterrows()]
+    if not sport and not device:
+        options.extend({'label': ride_label(ride_id), 'value': ride_id}
+                       for ride_id in sorted(ride_ids - set(listing.index)))
+    return options
+
+def listing_choices(listing, column):
+    """Sorted distinct non-empty values of a listing column, as dropdown options."""
+    return [{'label': value, 'value': value} for value in sorted(listing[column].dropna().unique())]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Per-ride metadata from the file_id, session, lap and device_info messages.
+
+These messages are decoded in the same pass as the records (see
+fit_ingest.decode_ride) and reduced here to a small JSON-ready dict (device,
+serial number, sport, session totals, lap count, sensors) that the ingest
+keeps in the manifest and the ride index, plus a laps table stored next to
+the ride. Listing, sorting and filtering rides by date, sport or device then
+never touches the record streams.
+"""
+from datetime import datetime
+import pandas as pd
+
+FILE_ID_FIELDS = ['manufacturer', 'garmin_product', 'product_name', 'product', 'serial_number']
+SESSION_FIELDS = ['start_time', 'sport', 'sub_sport', 'total_elapsed_time', 'total_timer_time',
+                  'total_distance', 'total_ascent', 'total_calories']
+LAP_FIELDS = ['start_time', 'timestamp', 'total_elapsed_time', 'total_timer_time', 'total_distance',
+              'total_ascent', 'avg_power', 'max_power', 'avg_heart_rate', 'max_heart_rate',
+              'avg_cadence', 'avg_speed', 'intensity', 'lap_trigger']
+DEVICE_INFO_FIELDS = ['device_index', 'manufacturer', 'garmin_product', 'product_name', 'product', 'serial_number']
+
+# message name -> fields, a decode_fit_columns selection
+METADATA_FIELDS = {
+    'file_id': FILE_ID_FIELDS,
+    'session': SESSION_FIELDS,
+    'lap': LAP_FIELDS,
+    'device_info': DEVICE_INFO_FIELDS,
+}
+
+# session totals summed over all sessions of a (multisport) file
+SESSION_TOTALS = ['total_elapsed_time', 'total_timer_time', 'total_distance', 'total_ascent', 'total_calories']
+
+# ride metadata keys, in index order, with their SQLite column types
+METADATA_COLUMNS = {
+    'device': 'TEXT',
+    'serial_number': 'INTEGER',
+    'sport': 'TEXT',
+    'sub_sport': 'TEXT',
+    'session_start_time': 'INTEGER',
+    **{name: 'REAL' for name in SESSION_TOTALS},
+    'lap_count': 'INTEGER',
+    'sensors': 'TEXT',
+}
+
+def _value(row, name):
+    """A message value as a plain Python object, None when missing."""
+    value = row.get(name)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return value.item() if hasattr(value, 'item') else value
+
+def device_name(get_value):
+    """'manufacturer product' from a file_id or device_info message's values, e.g. 'garmin edge530'."""
+    manufacturer = get_value('manufacturer')
+    product = None
+    for name in ('garmin_product', 'product_name', 'product'):
+        product = get_value(name)
+        if product is not None:
+            break
+    parts = [str(part) for part in (manufacturer, product) if part is not None]
+    return ' '.join(parts) or None
+
+def message_rows(frame):
+    """The rows of a decoded message table as dicts (an empty list for None)."""
+    if frame is None or frame.empty:
+        return []
+    return frame.to_dict('records')
+
+def extract_ride_metadata(messages):
+    """
+    Reduces decoded metadata messages ({message name: DataFrame}, columns
+    named as in METADATA_FIELDS) to (metadata, laps). metadata has one key
+    per METADATA_COLUMNS entry; laps is the lap table, or None without laps.
+    """
+    metadata = dict.fromkeys(METADATA_COLUMNS)
+
+    file_ids = message_rows(messages.get('file_id'))
+    if file_ids:
+        metadata['device'] = device_name(lambda name: _value(file_ids[0], name))
+        metadata['serial_number'] = _value(file_ids[0], 'serial_number')
+
+    sessions = message_rows(messages.get('session'))
+    if sessions:
+        metadata['sport'] = _value(sessions[0], 'sport')
+        metadata['sub_sport'] = _value(sessions[0], 'sub_sport')
+        metadata['session_start_time'] = _value(sessions[0], 'start_time')
+        for name in SESSION_TOTALS:
+            values = [_value(session, name) for session in sessions]
+            values = [value for value in values if value is not None]
+            metadata[name] = float(sum(values)) if values else None
+
+    sensors = []
+    for device in message_rows(messages.get('device_info')):
+        if _value(device, 'device_index') == 'creator':
+            continue  # the head unit itself, already named by file_id
+        name = device_name(lambda field: _value(device, field))
+        if name and name not in sensors:
+            sensors.append(name)
+    metadata['sensors'] = ', '.join(sorted(sensors)) or None
+
+    laps = messages.get('lap')
+    if laps is not None:
+        # fields no lap of this file carries
+        laps = laps.dropna(axis=1, how='all')
+        if laps.empty:
+            laps = None
+    metadata['lap_count'] = 0 if laps is None else len(laps)
+    return metadata, laps
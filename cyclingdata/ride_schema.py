@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Declared schema for decoded ride record streams.
+
+fitdecode hands back one dict per record message, which Pandas turns into
+int64/float64/object columns plus a mostly-NaN column for every sparse
+developer field. Rides are instead kept as a compact records table holding
+only the declared fields below, with small fixed dtypes, and a side table for
+any other fields the device wrote.
+
+In memory the integer fields use Pandas' nullable integer dtypes so dropped
+sensor samples stay missing instead of turning the column into float64.
+timestamp is int64 epoch seconds (datetime64[s, UTC], 8 bytes per sample).
+A declared field whose values do not fit its type is stored with the type
+Arrow infers; that is logged once per field name and process, not per ride.
+"""
+import logging
+import pandas as pd
+import pyarrow as pa
+
+SCHEMA_VERSION = 2
+
+RECORD_SCHEMA = pa.schema([
+    ('timestamp', pa.timestamp('s', tz='UTC')),
+    ('position_lat', pa.int32()),
+    ('position_long', pa.int32()),
+    ('distance', pa.float32()),
+    ('altitude', pa.float32()),
+    ('speed', pa.float32()),
+    ('grade', pa.float32()),
+    ('heart_rate', pa.uint8()),
+    ('cadence', pa.uint8()),
+    ('fractional_cadence', pa.float32()),
+    ('power', pa.uint16()),
+    ('accumulated_power', pa.uint32()),
+    ('temperature', pa.int8()),
+])
+RECORD_FIELD_TYPES = {field.name: field.type for field in RECORD_SCHEMA}
+
+# fitdecode reports these alongside the plain fields they extend; the
+# enhanced value wins where both exist and only one column is kept
+ENHANCED_FIELDS = {'enhanced_altitude': 'altitude', 'enhanced_speed': 'speed'}
+
+EXTRAS_INDEX_COLUMN = 'record_index'
+
+_logger = logging.getLogger(__name__)
+_misfit_columns = set()  # declared fields already reported as not fitting their type
+
+_PANDAS_INTEGER_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+    pa.uint8(): pd.UInt8Dtype(),
+    pa.uint16(): pd.UInt16Dtype(),
+    pa.uint32(): pd.UInt32Dtype(),
+    pa.uint64(): pd.UInt64Dtype(),
+}
+
+def table_to_dataframe(table):
+    """Converts an Arrow table to Pandas, keeping integer columns as nullable integers."""
+    return table.to_pandas(types_mapper=_PANDAS_INTEGER_TYPES.get)
+
+def _column_to_arrow(name, values):
+    """Converts one column, using the declared type when it fits."""
+    declared_type = RECORD_FIELD_TYPES.get(name)
+    if declared_type is not None:
+        try:
+            return pa.array(values, from_pandas=True).cast(declared_type)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            if name not in _misfit_columns:
+                _misfit_columns.add(name)
+                _logger.warning("Column '%s' does not fit %s, storing it as the inferred type "
+                                "(reported once): %s", name, declared_type, e)
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed-type object columns (e.g. some developer fields) are kept as text
+        return pa.array(values.map(lambda v: None if v is None else str(v)), type=pa.string())
+
+def dataframe_to_table(df):
+    """
+    Builds an Arrow table from a DataFrame. Declared fields come first in
+    schema order, followed by any other columns in their original order.
+    """
+    known = [name for name in RECORD_FIELD_TYPES if name in df.columns]
+    extra = [name for name in df.columns if name not in RECORD_FIELD_TYPES]
+    arrays = [_column_to_arrow(name, df[name]) for name in known + extra]
+    return pa.Table.from_arrays(arrays, names=known + extra)
+
+def compact_ride(df):
+    """
+    Splits a raw record DataFrame into (records, extras).
+
+    records holds only the declared fields with their compact dtypes. extras
+    is the side table of every other field, restricted to the records where
+    at least one of them is set and keyed by the record's position in
+    records (the record_index column), or None if there are no such fields.
+    """
+    df = df.copy(deep=False)
+    for enhanced, plain in ENHANCED_FIELDS.items():
+        if enhanced in df.columns:
+            df[plain] = df[enhanced].combine_first(df[plain]) if plain in df.columns else df[enhanced]
+            df = df.drop(columns=enhanced)
+
+    records = table_to_dataframe(dataframe_to_table(df[[c for c in RECORD_FIELD_TYPES if c in df.columns]]))
+
+    extra_columns = [c for c in df.columns if c not in RECORD_FIELD_TYPES]
+    extras = None
+    if extra_columns:
+        extras = df[extra_columns]
+        extras = extras[extras.notna().any(axis=1)]
+        if extras.empty:
+            extras = None
+        else:
+            extras = extras.reset_index(names=EXTRAS_INDEX_COLUMN)
+    return records, extras
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk store for decoded rides.
+
+Each ride's record stream is written once to its own zstd-compressed Parquet
+file. The common record fields always get the same compact Arrow type (see
+ride_schema.py), so later runs read rides back with a bulk column read
+instead of re-running fitdecode, and can ask for just the columns they need.
+Undeclared fields, the ride's laps and its resampled comparison grids (see
+ride_grids.py) live in separate side-table files next to the ride.
+
+For multi-process serving, rides can also be copied into uncompressed Arrow
+IPC files (the serving store) that every worker memory-maps: the OS page
+cache then holds one copy of a ride for all workers, and loading it needs no
+decompression or Parquet decoding.
+"""
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from cyclingdata.instrumentation import timed
+from cyclingdata.ride_schema import RECORD_FIELD_TYPES, SCHEMA_VERSION, dataframe_to_table, table_to_dataframe
+
+RIDE_FILE_EXTENSION = '.parquet'
+EXTRAS_FILE_EXTENSION = '.extras.parquet'
+LAPS_FILE_EXTENSION = '.laps.parquet'
+GRID_FILE_EXTENSION = '.grid.parquet'
+SERVING_FILE_EXTENSION = '.arrow'
+PARQUET_COMPRESSION = 'zstd'
+
+def extras_path(file_path):
+    """Path of the side table stored next to a ride file."""
+    return file_path[:-len(RIDE_FILE_EXTENSION)] + EXTRAS_FILE_EXTENSION
+
+def laps_path(file_path):
+    """Path of the lap table stored next to a ride file."""
+    return file_path[:-len(RIDE_FILE_EXTENSION)] + LAPS_FILE_EXTENSION
+
+def grid_path(file_path, axis):
+    """Path of one of the comparison grids ('time' or 'distance') stored next to a ride file."""
+    return file_path[:-len(RIDE_FILE_EXTENSION)] + f'.{axis}' + GRID_FILE_EXTENSION
+
+def _write_table(table, file_path):
+    table = table.replace_schema_metadata({b'cyclingdata.schema_version': str(SCHEMA_VERSION).encode()})
+    tmp_path = file_path + '.tmp'
+    pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION)
+    os.replace(tmp_path, file_path)
+
+def _write_side_table(df, file_path):
+    if df is not None:
+        _write_table(dataframe_to_table(df), file_path)
+    elif os.path.exists(file_path):
+        os.remove(file_path)
+
+def save_ride(df, file_path, extras=None, laps=None):
+    """
+    Writes a ride's records DataFrame to a compressed Parquet file (atomically),
+    plus its side table of undeclared fields when extras is given and its lap
+    table when laps is given.
+    """
+    _write_table(dataframe_to_table(df), file_path)
+    _write_side_table(extras, extras_path(file_path))
+    _write_side_table(laps, laps_path(file_path))
+
+def _read_ride_table(file_path, columns=None):
+    if columns is not None:
+        available = pq.read_schema(file_path).names
+        columns = [c for c in columns if c in available]
+    table = pq.read_table(file_path, columns=columns)
+    if 'timestamp' in table.column_names:
+        # Parquet has no second-resolution timestamps, they come back as ms
+        index = table.column_names.index('timestamp')
+        table = table.set_column(index, 'timestamp', table.column(index).cast(RECORD_FIELD_TYPES['timestamp']))
+    return table
+
+@timed('load_ride')
+def load_ride(file_path, columns=None):
+    """
+    Reads a stored ride back into a Pandas DataFrame. Pass columns to read
+    only those columns from disk.
+    """
+    return table_to_dataframe(_read_ride_table(file_path, columns))
+
+def read_ride_columns(file_path):
+    """Column names of a stored ride, read from the file footer only."""
+    return pq.read_schema(file_path).names
+
+def load_ride_extras(file_path):
+    """Reads a ride's side table of undeclared fields, or None if it has none."""
+    try:
+        return table_to_dataframe(pq.read_table(extras_path(file_path)))
+    except FileNotFoundError:
+        return None
+
+def load_ride_laps(file_path):
+    """Reads a ride's lap table, or None if it has no laps."""
+    try:
+        return table_to_dataframe(pq.read_table(laps_path(file_path)))
+    except FileNotFoundError:
+        return None
+
+def save_ride_grids(grids, file_path):
+    """Writes a ride's comparison grids ({axis: DataFrame or None}) next to its ride file."""
+    for axis, grid in grids.items():
+        path = grid_path(file_path, axis)
+        if grid is not None:
+            # float32 as computed: the record schema's integer types do not apply to averages
+            _write_table(pa.Table.from_pandas(grid, preserve_index=False), path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+@timed('load_ride_grid')
+def load_ride_grid(file_path, axis):
+    """
+    Reads one of a ride's comparison grids. Raises FileNotFoundError when it
+    was never written (rides ingested before grids existed) and returns None
+    when the ride has no data for that axis.
+    """
+    try:
+        return table_to_dataframe(pq.read_table(grid_path(file_path, axis)))
+    except FileNotFoundError:
+        if os.path.exists(grid_path(file_path, 'time')):
+            return None  # the grids were written, this one was empty
+        raise
+
+def write_serving_copy(file_path, serving_file_path):
+    """Copies a stored ride into an uncompressed Arrow IPC file for the serving store (atomically)."""
+    table = _read_ride_table(file_path)
+    tmp_path = serving_file_path + '.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, serving_file_path)
+
+@timed('load_serving_ride')
+def load_serving_ride(serving_file_path, columns=None):
+    """
+    Reads a ride from the serving store into a Pandas DataFrame. The file is
+    memory-mapped, so its pages are shared with every other process reading it.
+    """
+    with pa.memory_map(serving_file_path) as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        return table_to_dataframe(table)
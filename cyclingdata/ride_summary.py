@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Workout summaries.
+
+summarize_rides computes the per-ride aggregates for any number of rides in
+one grouped, vectorized pass and returns them as a single tidy table (one row
+per ride). calculate_workout_summary is the single-ride view used by the
+scripts and the Dash apps, built on the same aggregates.
+"""
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from cyclingdata.instrumentation import timed
+
+# source column -> (summary name, aggregation) pairs, in reporting order
+SUMMARY_AGGREGATES = {
+    'power': [('mean_power', 'mean'), ('max_power', 'max')],
+    'heart_rate': [('mean_heart_rate', 'mean'), ('max_heart_rate', 'max')],
+    'speed': [('mean_speed', 'mean'), ('max_speed', 'max')],
+    'cadence': [('mean_cadence', 'mean'), ('max_cadence', 'max')],
+    'altitude': [('min_altitude', 'min'), ('max_altitude', 'max')],
+}
+SUMMARY_COLUMNS = ['timestamp'] + list(SUMMARY_AGGREGATES)
+DEFAULT_BATCH_SIZE = 256
+
+def _timestamp_seconds(df):
+    """Epoch seconds as float64 (NaN where missing), or all-NaN if there is no timestamp column."""
+    if 'timestamp' not in df.columns:
+        return np.full(len(df), np.nan)
+    timestamps = df['timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps, utc=True)
+    # datetime64 -> UTC epoch seconds without going through Python objects
+    values = timestamps.to_numpy(dtype='datetime64[s]')
+    seconds = values.astype('int64').astype('float64')
+    seconds[np.isnat(values)] = np.nan
+    return seconds
+
+def _float_values(df, column):
+    if column not in df.columns:
+        return np.full(len(df), np.nan)
+    values = df[column]
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values, errors='coerce')
+    return values.to_numpy(dtype='float64', na_value=np.nan)
+
+def _summarize_batch(keys, frames):
+    lengths = np.fromiter((len(df) for df in frames), dtype=np.int64, count=len(frames))
+    columns = {'ride': np.repeat(np.arange(len(frames)), lengths)}
+    named_aggregations = {'records': ('ride', 'size')}
+
+    if any('timestamp' in df.columns for df in frames):
+        columns['timestamp'] = np.concatenate([_timestamp_seconds(df) for df in frames])
+        named_aggregations['start'] = ('timestamp', 'min')
+        named_aggregations['end'] = ('timestamp', 'max')
+    for column, aggregations in SUMMARY_AGGREGATES.items():
+        if any(column in df.columns for df in frames):
+            columns[column] = np.concatenate([_float_values(df, column) for df in frames])
+            for name, how in aggregations:
+                named_aggregations[name] = (column, how)
+
+    grouped = pd.DataFrame(columns).groupby('ride', sort=True).agg(**named_aggregations)
+    # rides with no rows at all do not show up in the groupby
+    grouped = grouped.reindex(np.arange(len(frames)))
+    grouped['records'] = grouped['records'].fillna(0).astype('int64')
+    grouped.index = pd.Index(keys, name='ride')
+    return grouped
+
+def summarize_rides(rides, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Computes duration, mean/max power, heart rate, speed and cadence and the
+    altitude range of many rides at once.
+
+    rides is a dict (or iterable of pairs) of ride key -> DataFrame. Rides are
+    stacked batch_size at a time into flat arrays and aggregated with a single
+    groupby per batch, so the cost does not grow with Python-level loops over
+    columns and statistics. Returns a DataFrame indexed by ride key with
+    start_time, duration, records and one column per aggregate; aggregates of
+    columns a ride does not have are NaN.
+    """
+    if hasattr(rides, 'items'):
+        rides = rides.items()
+
+    batches = []
+    keys, frames = [], []
+    for key, df in rides:
+        keys.append(key)
+        frames.append(df)
+        if len(frames) >= batch_size:
+            batches.append(_summarize_batch(keys, frames))
+            keys, frames = [], []
+    if frames:
+        batches.append(_summarize_batch(keys, frames))
+    if not batches:
+        return pd.DataFrame(index=pd.Index([], name='ride'))
+
+    summary = pd.concat(batches)
+    if 'start' in summary.columns:
+        summary.insert(0, 'start_time', pd.to_datetime(summary['start'], unit='s', utc=True))
+        summary.insert(1, 'duration', pd.to_timedelta(summary['end'] - summary['start'], unit='s'))
+        summary = summary.drop(columns=['start', 'end'])
+    if 'min_altitude' in summary.columns:
+        summary['altitude_gain'] = summary['max_altitude'] - summary['min_altitude']
+    return summary
+
+@timed('calculate_workout_summary')
+def calculate_workout_summary(df):
+    """
+    Calculates summary stats for relevant numerical columns in a workout DataFrame
+    """
+    if df.empty:
+        return "No data to summarize."
+
+    summary = {}
+
+    #basic descriptive stats for numerical columns
+    numerical_cols = df.select_dtypes(include=['number'])
+    summary['basic_stats'] = numerical_cols.describe()
+
+    row = summarize_rides([(None, df)]).iloc[0]
+    if 'timestamp' in df.columns:
+        summary['duration'] = row['duration'] if pd.notna(row['duration']) else timedelta(0)
+    for column, aggregations in SUMMARY_AGGREGATES.items():
+        if column in df.columns:
+            for name, _ in aggregations:
+                summary[name] = row[name]
+    if 'altitude' in df.columns:
+        summary['altitude_gain'] = row['altitude_gain']
+
+    return summary
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: ingests rides as they arrive in the archive, without a restart.
+
+RideWatcher runs in a background thread and notices .fit/.fit.gz files
+that are added to, changed in or deleted from the root directory, either
+from filesystem events (watchdog, i.e. inotify, FSEvents or
+ReadDirectoryChangesW, when it is installed) or by polling. Polling stats
+the directories, not the files: adding, renaming or deleting a file changes
+its directory's mtime, so a poll of a multi-thousand-file archive is a few
+hundred stats and only the directories that changed are listed again. (A
+file rewritten in place keeps its directory's mtime; the next full ingest
+picks it up.)
+
+A noticed file is ingested once its size and mtime have stayed the same for
+settle_s, so a ride the sync client is still writing is not decoded
+half-way. Ingesting calls update_ingest_manifest with just the noticed paths
+(no walk of the archive), which updates the manifest, the ride store and the
+ride index. Running Dash apps pick the new rides up on their next refresh
+tick (see the live_refresh_s setting), also from another process.
+"""
+import os
+import threading
+import time
+from cyclingdata.fit_ingest import FIT_SOURCE_SUFFIXES, find_fit_sources, load_manifest, update_ingest_manifest
+from cyclingdata.instrumentation import stage_timer
+
+DEFAULT_POLL_INTERVAL_S = 1.0
+DEFAULT_SETTLE_S = 2.0
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class RideWatcher:
+    """
+    Ingests new, changed and deleted rides under root_directory in the
+    background until stop() is called. Ingest options are those of
+    update_ingest_manifest. on_ingest(rides, source_paths), if given, is called
+    after each ingest with the manifest's ride entries and the paths that
+    were ingested. use_events=False polls even when watchdog is installed
+    (some network and synced folders deliver no events).
+    """
+
+    def __init__(self, root_directory, cache_directory, decompressed_directory=None, fields=None,
+                 poll_interval_s=DEFAULT_POLL_INTERVAL_S, settle_s=DEFAULT_SETTLE_S, use_events=True,
+                 on_ingest=None):
+        self.root_directory = root_directory
+        self.cache_directory = cache_directory
+        self.decompressed_directory = decompressed_directory
+        self.fields = fields
+        self.poll_interval_s = poll_interval_s
+        self.settle_s = settle_s
+        self.use_events = use_events
+        self.on_ingest = on_ingest
+        self.ingested = 0
+        self._excluded = [os.path.normcase(os.path.abspath(d)) + os.sep
+                          for d in (cache_directory, decompressed_directory) if d]
+        self._pending = {}  # source path -> [stat key, monotonic time of its last change]
+        self._directories = {}  # polling: directory -> (mtime_ns, {file name: stat key})
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def start(self):
+        if self.use_events:
+            self._observer = self._start_observer()
+        if self._observer is None:
+            self._add_directory(self.root_directory, notice_files=False)
+        self._thread = threading.Thread(target=self._run, name='ride-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+
+    def notice(self, path):
+        """Queues a source file that was added, changed or deleted."""
+        if not path.lower().endswith(FIT_SOURCE_SUFFIXES) or self._is_excluded(path):
+            return
+        with self._lock:
+            self._pending.setdefault(path, [None, time.monotonic()])
+
+    def notice_removed_directory(self, directory):
+        """Queues the ingested rides under a directory that was deleted or moved away."""
+        prefix = os.path.join(directory, '')
+        for source_path in load_manifest(self.cache_directory)['rides']:
+            if source_path.startswith(prefix):
+                self.notice(source_path)
+
+    def _is_excluded(self, path):
+        path = os.path.normcase(os.path.abspath(path))
+        return any(path.startswith(excluded) for excluded in self._excluded)
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed (pip install cyclingdata[watch]); polling the archive for new rides.")
+            return None
+
+        watcher = self
+
+        class SourceEventHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                paths = [event.src_path, getattr(event, 'dest_path', None)]
+                for path in filter(None, paths):
+                    if not event.is_directory:
+                        watcher.notice(path)
+                    elif os.path.isdir(path):
+                        if event.event_type in ('created', 'moved'):
+                            # a directory moved in may bring its files without events of their own
+                            for source_path in find_fit_sources(path):
+                                watcher.notice(source_path)
+                    elif event.event_type in ('deleted', 'moved'):
+                        # likewise the files of a directory deleted or moved away
+                        watcher.notice_removed_directory(path)
+
+        observer = Observer()
+        observer.schedule(SourceEventHandler(), self.root_directory, recursive=True)
+        observer.start()
+        return observer
+
+    def _scan_directory(self, directory, notice_new_directories):
+        """Lists one directory for polling: its source files' stat keys, and new subdirectories are added."""
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        files = {}
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.path not in self._directories:
+                    self._add_directory(entry.path, notice_new_directories)
+            elif entry.name.lower().endswith(FIT_SOURCE_SUFFIXES):
+                stat = entry.stat()
+                files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        self._directories[directory] = (mtime_ns, files)
+        return files
+
+    def _add_directory(self, directory, notice_files=True):
+        """Records a directory tree for polling; notice_files queues the files in it as new."""
+        if self._is_excluded(directory + os.sep):
+            return
+        files = self._scan_directory(directory, notice_files)
+        if notice_files and files:
+            for name in files:
+                self.notice(os.path.join(directory, name))
+
+    def _poll_directories(self):
+        for directory, (mtime_ns, files) in list(self._directories.items()):
+            try:
+                changed = os.stat(directory).st_mtime_ns != mtime_ns
+            except FileNotFoundError:
+                changed = True
+            if not changed:
+                continue
+            current_files = self._scan_directory(directory, notice_new_directories=True)
+            if current_files is None:
+                del self._directories[directory]
+                current_files = {}
+            for name in files.keys() | current_files.keys():
+                if files.get(name) != current_files.get(name):
+                    self.notice(os.path.join(directory, name))
+
+    def _settled_paths(self):
+        """Pending paths whose size and mtime have not changed for settle_s (or that are gone)."""
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            for path, state in list(self._pending.items()):
+                stat_key = _stat_key(path)
+                if stat_key != state[0]:
+                    state[0], state[1] = stat_key, now
+                elif now - state[1] >= self.settle_s:
+                    settled.append(path)
+                    del self._pending[path]
+        return settled
+
+    def _ingest(self, source_paths):
+        with stage_timer('watch_ingest', files=len(source_paths)):
+            rides = update_ingest_manifest(self.root_directory, self.cache_directory, self.decompressed_directory,
+                                           workers=1, fields=self.fields, source_paths=source_paths)
+        self.ingested += len(source_paths)
+        print(f"Ingested {len(source_paths)} new, changed or deleted rides: "
+              f"{', '.join(os.path.basename(path) for path in source_paths)}")
+        if self.on_ingest is not None:
+            self.on_ingest(rides, source_paths)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval_s):
+            try:
+                if self._observer is None:
+                    self._poll_directories()
+                source_paths = self._settled_paths()
+                if source_paths:
+                    self._ingest(source_paths)
+            except Exception as e:
+                # keep watching; the files are picked up again by the next full ingest
+                print(f"Error ingesting new rides: {e}")
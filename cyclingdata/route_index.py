@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Route and segment index over the rides' GPS tracks.
+
+At ingest each ride's track is reduced to the grid cells it passes through
+(CELL_DEGREES squares, about 110 m north-south), which are stored in the
+ride_cells table of the ride index (see fit_ingest.sync_ride_index).
+Gaps between recorded positions are filled in first, so sparse "smart
+recording" tracks do not skip cells.
+
+Finding the efforts on a segment (a start and end point, or a polyline
+through the route) is then two steps:
+
+1. Candidates come from indexed lookups only: rides with a cell near the
+   start, near the end and near every SEGMENT_SAMPLE_M along the polyline.
+2. Only the candidates' position, time, distance, power and heart rate
+   columns are read from the ride store and matched point by point. An
+   effort runs from the closest approach to the start to the next closest
+   approach to the end, and must pass every polyline point on the way.
+
+With only a start and end point any route between them counts; pass a
+polyline to pin the route down.
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import numpy as np
+import pandas as pd
+from cyclingdata.power_metrics import power_per_second
+from cyclingdata.ride_index import connect_ride_index, rides_in_cells
+
+SEMICIRCLES_PER_DEGREE = 2 ** 31 / 180
+METRES_PER_DEGREE = 111195.0  # of latitude, on a spherical earth
+CELL_DEGREES = 0.001
+CELL_COLUMNS = int(round(360 / CELL_DEGREES)) + 1
+MAX_FILL_GAP_M = 1000 # positions further apart are a GPS jump or a transfer, not a road between them
+MATCH_RADIUS_M = 30 # how close a track has to come to the segment's points
+SEGMENT_SAMPLE_M = 200 # spacing of the polyline points a matching track must pass
+MATCH_THREADS = 8 # candidate rides read and matched at once
+
+TRACK_COLUMNS = ['timestamp', 'position_lat', 'position_long', 'distance', 'power', 'heart_rate']
+EFFORT_COLUMNS = ['ride_id', 'start_time', 'elapsed_s', 'distance_m', 'mean_power', 'mean_heart_rate', 'mean_speed']
+
+def track_degrees(df):
+    """(latitude, longitude) in degrees of the records with a position, and the mask of those records."""
+    if df is None or 'position_lat' not in df.columns or 'position_long' not in df.columns:
+        return np.zeros(0), np.zeros(0), np.zeros(len(df) if df is not None else 0, dtype=bool)
+    lat = df['position_lat'].to_numpy(dtype='float64', na_value=np.nan) / SEMICIRCLES_PER_DEGREE
+    lon = df['position_long'].to_numpy(dtype='float64', na_value=np.nan) / SEMICIRCLES_PER_DEGREE
+    present = ~np.isnan(lat) & ~np.isnan(lon)
+    return lat[present], lon[present], present
+
+def distance_m(lat, lon, point_lat, point_lon):
+    """Distances in metres from (lat, lon) arrays to one point (equirectangular, fine at segment scale)."""
+    dx = (lon - point_lon) * math.cos(math.radians(point_lat))
+    dy = lat - point_lat
+    return np.hypot(dx, dy) * METRES_PER_DEGREE
+
+def cell_ids(lat, lon):
+    """The grid cell of each position."""
+    rows = np.floor((np.asarray(lat) + 90) / CELL_DEGREES).astype('int64')
+    columns = np.floor((np.asarray(lon) + 180) / CELL_DEGREES).astype('int64')
+    return rows * CELL_COLUMNS + columns
+
+def _fill_gaps(lat, lon, max_step_deg):
+    """The track with points interpolated wherever consecutive positions are more than max_step_deg apart."""
+    if len(lat) < 2:
+        return lat, lon
+    dlat, dlon = np.diff(lat), np.diff(lon)
+    gap = np.maximum(np.abs(dlat), np.abs(dlon))
+    steps = np.ceil(gap / max_step_deg).astype('int64')
+    steps[(steps < 1) | (gap * METRES_PER_DEGREE > MAX_FILL_GAP_M)] = 1
+    starts = np.repeat(np.arange(len(dlat)), steps)
+    fractions = (np.arange(len(starts)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    return (np.concatenate((lat[starts] + dlat[starts] * fractions, lat[-1:])),
+            np.concatenate((lon[starts] + dlon[starts] * fractions, lon[-1:])))
+
+def ride_cells(df):
+    """The distinct grid cells a ride's track passes through, as an int64 array."""
+    lat, lon, _ = track_degrees(df)
+    lat, lon = _fill_gaps(lat, lon, CELL_DEGREES / 2)
+    return np.unique(cell_ids(lat, lon))
+
+def neighbourhood_cells(lat, lon, radius_m):
+    """The cells within radius_m of a point."""
+    dlat = radius_m / METRES_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    rows = np.arange(math.floor((lat - dlat + 90) / CELL_DEGREES), math.floor((lat + dlat + 90) / CELL_DEGREES) + 1)
+    columns = np.arange(math.floor((lon - dlon + 180) / CELL_DEGREES),
+                        math.floor((lon + dlon + 180) / CELL_DEGREES) + 1)
+    return (rows[:, None] * CELL_COLUMNS + columns[None, :]).ravel()
+
+def segment_points(points, spacing_m=SEGMENT_SAMPLE_M):
+    """
+    A segment given as [(lat, lon), ...] in degrees (start, optional route
+    points, end) as points at most spacing_m apart, start and end included.
+    """
+    points = [(float(lat), float(lon)) for lat, lon in points]
+    if len(points) < 2:
+        raise ValueError("A segment needs at least a start and an end point")
+    lat, lon = np.array(points).T
+    lat, lon = _fill_gaps(lat, lon, spacing_m / METRES_PER_DEGREE)
+    return list(zip(lat, lon))
+
+def has_ride_cells(cache_directory):
+    """Whether the ingest has indexed any ride's track cells (read-only)."""
+    with closing(connect_ride_index(cache_directory)) as conn:
+        return conn.execute('SELECT 1 FROM ride_cells LIMIT 1').fetchone() is not None
+
+def candidate_rides(cache_directory, points, radius_m=MATCH_RADIUS_M):
+    """Ids of the indexed rides with cells near every one of points, from the index alone."""
+    with closing(connect_ride_index(cache_directory)) as conn:
+        # the ends first: they usually narrow the candidates down the most
+        ordered = [points[0], points[-1]] + points[1:-1]
+        candidates = None
+        for lat, lon in ordered:
+            near = rides_in_cells(conn, neighbourhood_cells(lat, lon, radius_m))
+            candidates = near if candidates is None else candidates & near
+            if not candidates:
+                break
+    return candidates or set()
+
+def _closest_passes(distances, radius_m):
+    """The index of the closest point of each run of consecutive points within radius_m."""
+    near = np.concatenate(([False], distances <= radius_m, [False]))
+    edges = np.flatnonzero(np.diff(near.astype('int8')))
+    return np.array([start + int(np.argmin(distances[start:end])) for start, end in zip(edges[::2], edges[1::2])],
+                    dtype='int64')
+
+def match_efforts(df, points, radius_m=MATCH_RADIUS_M):
+    """
+    The efforts of one ride on a segment (points from segment_points), as
+    (first, last) positions in the ride's records, in ride order.
+    """
+    lat, lon, present = track_degrees(df)
+    if len(lat) < 2:
+        return []
+    record_positions = np.flatnonzero(present)
+    start_passes = _closest_passes(distance_m(lat, lon, *points[0]), radius_m)
+    end_passes = _closest_passes(distance_m(lat, lon, *points[-1]), radius_m)
+
+    efforts = []
+    for i, start in enumerate(start_passes):
+        later_ends = end_passes[end_passes > start]
+        if len(later_ends) == 0:
+            break
+        end = later_ends[0]
+        if i + 1 < len(start_passes) and start_passes[i + 1] < end:
+            continue  # the rider came back to the start before reaching the end
+        track_lat, track_lon = lat[start:end + 1], lon[start:end + 1]
+        if all(distance_m(track_lat, track_lon, *point).min() <= radius_m for point in points[1:-1]):
+            efforts.append((record_positions[start], record_positions[end]))
+    return efforts
+
+def effort_summary(ride_id, df, first, last):
+    """One row of find_segment_efforts for records first..last of a ride."""
+    effort = df.iloc[first:last + 1]
+    start_time, end_time = effort['timestamp'].iloc[0], effort['timestamp'].iloc[-1]
+    elapsed_s = (end_time - start_time).total_seconds()
+    distance = np.nan
+    if 'distance' in effort.columns and effort['distance'].notna().any():
+        distance = float(effort['distance'].iloc[-1] - effort['distance'].iloc[0])
+    mean_power = np.nan
+    if 'power' in effort.columns and effort['power'].notna().any():
+        mean_power = float(power_per_second(effort).mean())
+    mean_heart_rate = np.nan
+    if 'heart_rate' in effort.columns and effort['heart_rate'].notna().any():
+        mean_heart_rate = float(effort['heart_rate'].astype('float64').mean())
+    return {
+        'ride_id': ride_id,
+        'start_time': start_time,
+        'elapsed_s': elapsed_s,
+        'distance_m': distance,
+        'mean_power': mean_power,
+        'mean_heart_rate': mean_heart_rate,
+        'mean_speed': distance / elapsed_s if elapsed_s > 0 else np.nan,
+    }
+
+def find_segment_efforts(cache_directory, rides, segment, radius_m=MATCH_RADIUS_M):
+    """
+    Every effort on a segment across rides (source path -> manifest entry),
+    fastest first, as a DataFrame with EFFORT_COLUMNS (times in seconds,
+    distance in metres, speed in m/s; NaN where the ride did not record
+    the column). segment is [(lat, lon), ...] in
+    degrees: start, optional points along the route, end.
+    """
+    from cyclingdata.fit_ingest import load_cached_ride
+
+    points = segment_points(segment)
+    if not has_ride_cells(cache_directory):
+        print("The ride index has no track cells yet; run an ingest to build them.")
+    candidates = sorted(ride_id for ride_id in candidate_rides(cache_directory, points, radius_m)
+                        if rides.get(ride_id, {}).get('cache_file'))
+
+    def efforts_of(ride_id):
+        df = load_cached_ride(rides[ride_id], cache_directory, TRACK_COLUMNS)
+        if df is None or 'timestamp' not in df.columns:
+            return []
+        return [effort_summary(ride_id, df, first, last) for first, last in match_efforts(df, points, radius_m)]
+
+    with ThreadPoolExecutor(max_workers=MATCH_THREADS) as executor:
+        efforts = [effort for ride_efforts in executor.map(efforts_of, candidates) for effort in ride_efforts]
+    return pd.DataFrame(efforts, columns=EFFORT_COLUMNS).sort_values('elapsed_s', ignore_index=True)
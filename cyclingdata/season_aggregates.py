@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Season-wide aggregates computed out of core.
+
+Rides are streamed from the ride cache one at a time into a SeasonAggregate,
+a small running state that never holds more than one ride's records:
+
+* weekly and monthly totals (rides, time, distance, work),
+* time-in-zone histograms for power (5 W bins) and heart rate (1 bpm bins),
+  which any zone model can be read from afterwards,
+* the season best-effort (mean-maximal power) curve on a fixed duration grid.
+
+Aggregates from separate runs can be merged, and the state is checkpointed
+to JSON so an interrupted pass over a large archive resumes where it stopped.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from cyclingdata.power_metrics import mean_max_power, power_curve_durations, power_per_second
+
+SEASON_CHECKPOINT_FILE_NAME = 'season_aggregates.json'
+SEASON_CHECKPOINT_VERSION = 2
+DEFAULT_CHECKPOINT_EVERY = 50
+
+POWER_BIN_W = 5
+POWER_BINS = 400  # 0-2000 W, higher values land in the last bin
+HEART_RATE_BINS = 256  # 1 bpm bins
+# one grid for every ride (up to 24 h) so best-effort curves combine elementwise
+BEST_EFFORT_DURATIONS = power_curve_durations(24 * 3600)
+
+# Coggan power zones as fractions of FTP (lower edges of zones 2-7)
+POWER_ZONES_FTP = [0.55, 0.75, 0.90, 1.05, 1.20, 1.50]
+
+TOTAL_COLUMNS = ['rides', 'duration_s', 'recorded_s', 'distance_m', 'work_j']
+SEASON_COLUMNS = ['timestamp', 'distance', 'power', 'heart_rate']
+
+def _record_seconds(timestamps):
+    """Seconds each record stands for: the time since the previous one, at most 1 s."""
+    seconds = timestamps.to_numpy(dtype='datetime64[s]').astype('int64').astype('float64')
+    return np.clip(np.diff(seconds, prepend=seconds[:1] - 1), 0.0, 1.0)
+
+def _histogram(values, weights, bin_width, bins):
+    values = values.to_numpy(dtype='float64', na_value=np.nan)
+    present = np.isfinite(values)
+    positions = np.clip((values[present] // bin_width).astype(np.int64), 0, bins - 1)
+    return np.bincount(positions, weights=weights[present], minlength=bins)
+
+class SeasonAggregate:
+    """
+    Mergeable running aggregates over any number of rides. Use add_ride for
+    each ride, merge to combine two aggregates, and save/load to checkpoint.
+    """
+
+    def __init__(self):
+        self.rides = {}  # ride id -> content hash of every ride counted so far
+        self.weekly = {}  # 'YYYY-Www' -> totals
+        self.monthly = {}  # 'YYYY-MM' -> totals
+        self.power_seconds = np.zeros(POWER_BINS)
+        self.heart_rate_seconds = np.zeros(HEART_RATE_BINS)
+        self.best_effort = np.full(len(BEST_EFFORT_DURATIONS), np.nan)
+
+    def add_ride(self, ride_id, sha1, df):
+        """Adds one ride's records (timestamp, distance, power and heart_rate columns are used)."""
+        self.rides[ride_id] = sha1
+        if df is None or df.empty or 'timestamp' not in df.columns:
+            return
+        df = df[df['timestamp'].notna()]
+        if df.empty:
+            return
+
+        seconds = _record_seconds(df['timestamp'])
+        start = df['timestamp'].iloc[0]
+        totals = {
+            'rides': 1,
+            'duration_s': (df['timestamp'].iloc[-1] - start).total_seconds(),
+            'recorded_s': float(seconds.sum()),
+            'distance_m': 0.0,
+            'work_j': 0.0,
+        }
+        if 'distance' in df.columns and df['distance'].notna().any():
+            totals['distance_m'] = float(df['distance'].max() - df['distance'].min())
+        if 'power' in df.columns:
+            power = df['power']
+            totals['work_j'] = float(np.nansum(power.to_numpy(dtype='float64', na_value=np.nan) * seconds))
+            self.power_seconds += _histogram(power, seconds, POWER_BIN_W, POWER_BINS)
+            curve = mean_max_power(power_per_second(df), BEST_EFFORT_DURATIONS).to_numpy()
+            self.best_effort = np.fmax(self.best_effort, curve)
+        if 'heart_rate' in df.columns:
+            self.heart_rate_seconds += _histogram(df['heart_rate'], seconds, 1, HEART_RATE_BINS)
+
+        _add_totals(self.weekly, start.strftime('%G-W%V'), totals)
+        _add_totals(self.monthly, start.strftime('%Y-%m'), totals)
+
+    def merge(self, other):
+        """Adds another aggregate over a disjoint set of rides into this one."""
+        self.rides.update(other.rides)
+        for period, totals in other.weekly.items():
+            _add_totals(self.weekly, period, totals)
+        for period, totals in other.monthly.items():
+            _add_totals(self.monthly, period, totals)
+        self.power_seconds += other.power_seconds
+        self.heart_rate_seconds += other.heart_rate_seconds
+        self.best_effort = np.fmax(self.best_effort, other.best_effort)
+        return self
+
+    def weekly_totals(self):
+        return _totals_frame(self.weekly, 'week')
+
+    def monthly_totals(self):
+        return _totals_frame(self.monthly, 'month')
+
+    def power_zone_seconds(self, ftp, zones=POWER_ZONES_FTP):
+        """Seconds spent in each power zone, with zone edges given as fractions of ftp."""
+        edges = [0] + [int(round(ftp * fraction / POWER_BIN_W)) for fraction in zones] + [POWER_BINS]
+        return _zone_seconds(self.power_seconds, edges, 'power_zone')
+
+    def heart_rate_zone_seconds(self, zone_edges_bpm):
+        """Seconds spent in each heart rate zone, given the lower edges (bpm) of zones 2 and up."""
+        edges = [0] + [int(edge) for edge in zone_edges_bpm] + [HEART_RATE_BINS]
+        return _zone_seconds(self.heart_rate_seconds, edges, 'heart_rate_zone')
+
+    def best_effort_curve(self):
+        """Season mean-maximal power, indexed by duration in seconds (durations nobody rode are dropped)."""
+        curve = pd.Series(self.best_effort, index=pd.Index(BEST_EFFORT_DURATIONS, name='duration_s'), name='power')
+        return curve.dropna()
+
+    def to_json(self):
+        return {
+            'version': SEASON_CHECKPOINT_VERSION,
+            'rides': self.rides,
+            'weekly': self.weekly,
+            'monthly': self.monthly,
+            'power_seconds': self.power_seconds.tolist(),
+            'heart_rate_seconds': self.heart_rate_seconds.tolist(),
+            'best_effort': [None if np.isnan(value) else value for value in self.best_effort.tolist()],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        aggregate = cls()
+        aggregate.rides = data['rides']
+        aggregate.weekly = data['weekly']
+        aggregate.monthly = data['monthly']
+        aggregate.power_seconds = np.asarray(data['power_seconds'], dtype='float64')
+        aggregate.heart_rate_seconds = np.asarray(data['heart_rate_seconds'], dtype='float64')
+        aggregate.best_effort = np.array([np.nan if value is None else value for value in data['best_effort']], dtype='float64')
+        return aggregate
+
+    def save(self, path):
+        """Writes the aggregate to path atomically (a crash never leaves a half-written checkpoint)."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_json(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a checkpoint, or returns an empty aggregate if there is none or it is from an older layout."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return cls()
+        if data.get('version') != SEASON_CHECKPOINT_VERSION:
+            return cls()
+        return cls.from_json(data)
+
+def _add_totals(periods, period, totals):
+    current = periods.setdefault(period, dict.fromkeys(TOTAL_COLUMNS, 0))
+    for column in TOTAL_COLUMNS:
+        current[column] += totals[column]
+
+def _totals_frame(periods, index_name):
+    totals = pd.DataFrame.from_dict(periods, orient='index', columns=TOTAL_COLUMNS).sort_index()
+    totals.index.name = index_name
+    return totals
+
+def _zone_seconds(histogram, edges, index_name):
+    seconds = [histogram[low:high].sum() for low, high in zip(edges[:-1], edges[1:])]
+    return pd.Series(seconds, index=pd.RangeIndex(1, len(seconds) + 1, name=index_name), name='seconds')
+
+def season_checkpoint_path(cache_directory):
+    return os.path.join(cache_directory, SEASON_CHECKPOINT_FILE_NAME)
+
+def aggregate_season(rides, load_ride, checkpoint_path=None, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+    """
+    Streams rides into a SeasonAggregate one at a time.
+
+    rides maps ride id -> content hash (e.g. sha1 of each manifest entry)
+    and load_ride(ride_id) returns that ride's DataFrame. With a
+    checkpoint_path the aggregate resumes from the last checkpoint, skipping
+    rides it already counted, and is saved every checkpoint_every rides and
+    at the end. If a counted ride has since changed or disappeared the
+    checkpoint is discarded and the season is aggregated from scratch, since
+    best-effort maxima cannot be subtracted again.
+    """
+    aggregate = SeasonAggregate.load(checkpoint_path) if checkpoint_path else SeasonAggregate()
+    if any(rides.get(ride_id) != sha1 for ride_id, sha1 in aggregate.rides.items()):
+        print("Rides changed since the season checkpoint, aggregating the season from scratch.")
+        aggregate = SeasonAggregate()
+
+    pending = [ride_id for ride_id in rides if ride_id not in aggregate.rides]
+    for count, ride_id in enumerate(pending, start=1):
+        aggregate.add_ride(ride_id, rides[ride_id], load_ride(ride_id))
+        if checkpoint_path and count % checkpoint_every == 0:
+            aggregate.save(checkpoint_path)
+    if checkpoint_path and (pending or not os.path.exists(checkpoint_path)):
+        aggregate.save(checkpoint_path)
+    return aggregate
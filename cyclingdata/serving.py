@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Production serving: several worker processes answering dashboard callbacks
+from one shared, read-only ride store.
+
+Dash's built-in server (app.run) is a single-process development server. To
+serve several users, the rides are first copied into the serving store
+(fit_ingest.build_serving_store: uncompressed Arrow files that each worker
+memory-maps, so the OS keeps one copy of a ride in its page cache for all
+workers and nothing is decoded or decompressed per worker). Then the Dash app
+is built once and handed to a WSGI server:
+
+* gunicorn (Linux/macOS) runs web_workers forked processes with threads
+  each. The app is built before the fork, so the workers share the ride
+  listing and index without rebuilding them.
+* waitress (Windows, where gunicorn does not run) serves from one process
+  with threads threads.
+* without either, Flask's threaded development server is used and a hint is
+  printed.
+
+Each worker keeps its own ride and render caches, and /metrics reports the
+worker that answered. For an external gunicorn, use the create_server factory:
+
+    CYCLINGDATA_CACHE=D:/rides/cache gunicorn -w 4 --threads 4 --preload 'cyclingdata.serving:create_server()'
+"""
+import importlib
+import os
+from cyclingdata.config import CACHE_ENV_VAR
+from cyclingdata.fit_ingest import build_serving_store, cached_rides
+
+DASHBOARD_MODULES = {
+    'graphs': 'cyclingdata.graphs_app',
+    'summary': 'cyclingdata.summary_app',
+}
+DEFAULT_WEB_WORKERS = min(os.cpu_count() or 1, 4)
+DEFAULT_THREADS = 4
+GUNICORN_TIMEOUT_S = 120 # a cold ride load plus rendering can take a few seconds on a busy worker
+
+def dashboard_module(app_name):
+    """The graphs_app or summary_app module."""
+    if app_name not in DASHBOARD_MODULES:
+        raise ValueError(f"Unknown dashboard '{app_name}', expected one of {', '.join(DASHBOARD_MODULES)}")
+    return importlib.import_module(DASHBOARD_MODULES[app_name])
+
+def create_production_app(app_name, cache_directory, rides, **options):
+    """
+    Builds the serving store for rides and a Dash app that reads from it.
+    options are dashboard settings (see the app's DEFAULT_SETTINGS).
+    """
+    written = build_serving_store(rides, cache_directory)
+    if written:
+        print(f"Copied {written} rides into the serving store.")
+    return dashboard_module(app_name).create_app(cache_directory, rides, serving_store=True, **options)
+
+def create_server(app='graphs', cache_directory=None, **options):
+    """
+    WSGI application factory for an external server such as gunicorn. Serves
+    the rides already in the cache (CYCLINGDATA_CACHE by default) without
+    scanning the archive. Run gunicorn with --preload so the serving store is
+    built once and not by every worker.
+    """
+    cache_directory = cache_directory or os.environ.get(CACHE_ENV_VAR)
+    if not cache_directory:
+        raise ValueError(f"cache_directory (or {CACHE_ENV_VAR}) is required")
+    return create_production_app(app, cache_directory, cached_rides(cache_directory), **options).server
+
+def _run_gunicorn(server, host, port, web_workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class DashboardApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', web_workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('timeout', GUNICORN_TIMEOUT_S)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return server
+
+    DashboardApplication().run()
+
+def run_production_server(app, host='127.0.0.1', port=8000, web_workers=None, threads=None):
+    """
+    Serves a Dash app (from create_production_app) with gunicorn, waitress or
+    Flask's threaded server, whichever is available, in that order.
+    """
+    web_workers = web_workers or DEFAULT_WEB_WORKERS
+    threads = threads or DEFAULT_THREADS
+    try:
+        import gunicorn.app.base  # noqa: F401 (does not run on Windows)
+    except ImportError:
+        pass
+    else:
+        print(f"Serving on http://{host}:{port}/ with gunicorn, {web_workers} workers x {threads} threads")
+        return _run_gunicorn(app.server, host, port, web_workers, threads)
+
+    try:
+        import waitress
+    except ImportError:
+        print("Neither gunicorn nor waitress is installed (pip install cyclingdata[serve]); "
+              "falling back to Flask's threaded development server.")
+        app.run(host=host, port=port, debug=False, threaded=True)
+    else:
+        print(f"Serving on http://{host}:{port}/ with waitress, {threads} threads")
+        waitress.serve(app.server, host=host, port=port, threads=threads)
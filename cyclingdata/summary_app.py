@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Dash app to pick a ride and see its summary statistics, with the training
+load (CTL/ATL/TSB) chart of the whole history above it.
+
+Importing this module only defines the layout and callback; create_app
+builds a configured app for a set of ingested rides.
+"""
+import os
+import dash
+from dash import dcc
+from dash import html
+from dash.dependencies import Input, Output
+import pandas as pd
+import plotly.graph_objects as go
+from cyclingdata.dashboard_rides import DashboardRides
+from cyclingdata.fit_ingest import load_cached_ride, load_serving_copy
+from cyclingdata.ride_cache import RideCache
+from cyclingdata.instrumentation import add_metrics_route, profile_capture, register_cache, stage_timer
+from cyclingdata.ride_summary import calculate_workout_summary
+from cyclingdata.training_load import training_load
+
+DEFAULT_PORT = 8050
+
+DEFAULT_SETTINGS = {
+    'ftp_watts': 250, # functional threshold power used for TSS in the training load chart
+    'ride_cache_budget_mb': 512, # memory budget for ride DataFrames kept loaded between callbacks
+    'summary_cache_entries': 256, # rendered ride summaries kept for revisited rides
+    'profile_mode': None, # 'cprofile' or 'pyinstrument' to profile the summary callback (written to profiles/)
+    'serving_store': False, # load rides from the memory-mapped serving store (see fit_ingest.build_serving_store)
+    'live_refresh_s': None, # seconds between checks for rides ingested while the app runs (e.g. by a RideWatcher), None to never check
+}
+settings = dict(DEFAULT_SETTINGS, cache_directory=None)
+
+# The listed rides (a DashboardRides, see dashboard_rides.py) and both
+# caches, created by create_app. Ride DataFrames are only loaded when
+# selected, through the size-bounded LRU cache.
+rides = None
+ride_cache = None
+summary_cache = None
+
+def build_summary_component(selected_file):
+    df = ride_cache.get(selected_file)
+    if df is None:
+        return None  # not cached, so the summary is built once the ride can be loaded
+    summary = calculate_workout_summary(df)
+    output_components = [html.H3(f"Summary for: {os.path.basename(selected_file)}")]
+    for key, value in summary.items():
+        if isinstance(value, pd.DataFrame):
+            output_components.append(html.H4(key.replace('_', ' ').title()))
+            output_components.append(html.Div(value.to_string().replace('\n', html.Br().__str__())))
+        else:
+            output_components.append(html.P(f"{key.replace('_', ' ').title()}: {value}"))
+    return html.Div(output_components)
+
+def update_summary(selected_file):
+    if selected_file:
+        entry = rides.get(selected_file) or {}
+        with stage_timer('update_summary'), profile_capture('update_summary', settings['profile_mode']):
+            component = summary_cache.get((selected_file, entry.get('sha1')))
+        if component is None:
+            return html.P("Error: Selected file not found in processed data.")
+        return component
+    else:
+        return html.P("Please select a .fit file to analyze.")
+
+def build_training_load_figure():
+    """Fitness (CTL), fatigue (ATL), form (TSB) and daily TSS up to today, read from the ride index."""
+    load = training_load(settings['cache_directory'], settings['ftp_watts'], end=pd.Timestamp.now(tz='UTC'))
+    if load.empty:
+        return go.Figure()
+    # plain datetime64 values: plotly copies tz-aware Timestamps one object at a time
+    dates = load.index.tz_localize(None).to_numpy()
+    traces = [
+        go.Bar(x=dates, y=load['tss'].to_numpy(), name='TSS', marker_color='rgba(120, 120, 120, 0.4)', yaxis='y2'),
+        go.Scatter(x=dates, y=load['ctl'].to_numpy(), mode='lines', name='Fitness (CTL)'),
+        go.Scatter(x=dates, y=load['atl'].to_numpy(), mode='lines', name='Fatigue (ATL)'),
+        go.Scatter(x=dates, y=load['tsb'].to_numpy(), mode='lines', name='Form (TSB)'),
+    ]
+    layout = go.Layout(
+        title="Training Load",
+        yaxis={'title': "CTL / ATL / TSB"},
+        yaxis2={'title': "TSS/d", 'overlaying': 'y', 'side': 'right', 'showgrid': False},
+        legend={'orientation': 'h'},
+        height=400,
+    )
+    return go.Figure(data=traces, layout=layout)
+
+def update_training_load(client_version):
+    with stage_timer('update_training_load'):
+        return build_training_load_figure()
+
+def build_layout():
+    return html.Div([
+        html.H1("TrainingPeaks .fit File Analyzer"),
+
+        *rides.layout(settings['live_refresh_s']),
+
+        dcc.Graph(id='training-load-graph'),
+        html.Div(id='output-summary')
+    ])
+
+def create_app(cache_directory, ride_entries, **options):
+    """
+    Builds the Dash app for ride_entries (source path -> manifest entry, as
+    returned by update_ingest_manifest) cached in cache_directory. options override
+    DEFAULT_SETTINGS. The app also serves the instrumentation metrics at /metrics.
+    """
+    global rides, ride_cache, summary_cache
+    unknown = set(options) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise TypeError(f"Unknown dashboard settings: {', '.join(sorted(unknown))}")
+    settings.update(options)
+    settings['cache_directory'] = cache_directory
+    rides = DashboardRides(cache_directory, ride_entries,
+                           on_changed=lambda source_path: ride_cache.invalidate(source_path))
+
+    load_ride = load_serving_copy if settings['serving_store'] else load_cached_ride
+    ride_cache = RideCache(lambda source_path: load_ride(rides.get(source_path), settings['cache_directory']),
+                           max_bytes=settings['ride_cache_budget_mb'] * 1024 * 1024)
+    # Rendered summaries keyed by (ride, content hash), shared by every browser session
+    summary_cache = RideCache(lambda key: build_summary_component(key[0]),
+                              max_bytes=settings['summary_cache_entries'], sizeof=lambda summary: 1)
+    register_cache('rides', ride_cache)
+    register_cache('summaries', summary_cache)
+
+    app = dash.Dash(__name__)
+    add_metrics_route(app)
+    app.layout = build_layout()
+    rides.register_callback(app)
+    app.callback(Output('output-summary', 'children'), [Input('file-selector', 'value')])(update_summary)
+    # redrawn when the rides change, so newly ingested rides show up in the chart
+    app.callback(Output('training-load-graph', 'figure'), [Input('listing-version', 'data')])(update_training_load)
+    return app
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Fitness, fatigue and form (CTL/ATL/TSB) over the whole ride history, kept
+up to date incrementally in the ride index.
+
+The daily_load table of the ride index has one row per day from the first
+ride on, with the day's training stress and the exponentially weighted
+Chronic and Acute Training Load after that day:
+
+    CTL_d = CTL_(d-1) + (stress_d - CTL_(d-1)) / CTL_DAYS
+    ATL_d = ATL_(d-1) + (stress_d - ATL_(d-1)) / ATL_DAYS
+
+A ride's stress is NP^2 x duration (W^2 s), with the duration from its
+first to its last record as in power_metrics.ride_duration_s, which is its
+TSS times FTP^2 x 36, so the table does not depend on FTP: TSS, CTL and ATL for any FTP
+are the stored values scaled by 100 / (FTP^2 x 3600), since the averages
+are linear. Changing FTP therefore needs no recomputation.
+
+fit_ingest.sync_ride_index calls update_training_load with the days of the
+rides it added, changed or removed. Those days' stress is summed again from
+the rides table, and CTL/ATL are rolled forward from the earliest of them,
+starting from the stored state of the day before. A ride synced today
+touches one row; a ride from years back re-rolls the days since then, a
+few thousand rows. Reading the series (training_load) is a single table
+scan, so a multi-year chart needs no ride loaded.
+
+Days are UTC days of the rides' start times. TSB (form) on a day is the
+CTL minus the ATL of the day before, as in the Performance Manager Chart.
+"""
+from contextlib import closing
+import numpy as np
+import pandas as pd
+from cyclingdata.ride_index import SQL_PARAMETER_BATCH, connect_ride_index
+
+CTL_DAYS = 42
+ATL_DAYS = 7
+SECONDS_PER_DAY = 86400
+
+LOAD_COLUMNS = ['tss', 'ctl', 'atl', 'tsb']
+
+def stress_to_tss(ftp):
+    """Factor that turns stored stress (W^2 s) into TSS for ftp in watts."""
+    return 100 / (ftp ** 2 * 3600)
+
+def ride_days(conn, ride_ids):
+    """The days (since the epoch) the indexed rides among ride_ids started on."""
+    ride_ids = list(ride_ids)
+    days = set()
+    for start in range(0, len(ride_ids), SQL_PARAMETER_BATCH):
+        batch = ride_ids[start:start + SQL_PARAMETER_BATCH]
+        days.update(day for day, in conn.execute(
+            f"SELECT start_time / {SECONDS_PER_DAY} FROM rides "
+            f"WHERE start_time IS NOT NULL AND ride_id IN ({', '.join('?' * len(batch))})", batch))
+    return days
+
+def _daily_stress(conn, first_day, last_day):
+    """Stress of every day from first_day to last_day that has rides with power, summed from the rides table."""
+    return dict(conn.execute(
+        f"SELECT start_time / {SECONDS_PER_DAY} AS day, SUM(normalized_power * normalized_power * duration_s) "
+        "FROM rides WHERE start_time >= ? AND start_time < ? AND normalized_power IS NOT NULL GROUP BY day",
+        (first_day * SECONDS_PER_DAY, (last_day + 1) * SECONDS_PER_DAY)))
+
+def _rolled(previous, stress, days):
+    """The exponentially weighted load after each day of stress, starting from previous."""
+    weights = np.concatenate(([previous], stress))
+    return pd.Series(weights).ewm(alpha=1 / days, adjust=False).mean().to_numpy()[1:]
+
+def update_training_load(conn, days):
+    """
+    Brings the daily_load table in line with the rides table after the rides
+    of days (days since the epoch) were added, changed or removed: sums
+    those days' stress again and rolls CTL/ATL forward from the earliest.
+    """
+    days = sorted(day for day in days if day is not None)
+    if not days:
+        return
+    first_day, last_day = days[0], days[-1]
+    stored_last = conn.execute('SELECT MAX(day) FROM daily_load').fetchone()[0]
+    end_day = last_day if stored_last is None else max(last_day, stored_last)
+
+    stress = dict(conn.execute('SELECT day, stress FROM daily_load WHERE day >= ?', (first_day,)))
+    recomputed = _daily_stress(conn, first_day, last_day)
+    for day in days:
+        stress[day] = recomputed.get(day) or 0.0
+    previous = conn.execute('SELECT ctl, atl FROM daily_load WHERE day = ?', (first_day - 1,)).fetchone()
+    previous_ctl, previous_atl = previous or (0.0, 0.0)
+
+    all_days = np.arange(first_day, end_day + 1)
+    daily = np.array([stress.get(int(day), 0.0) for day in all_days])
+    ctl = _rolled(previous_ctl, daily, CTL_DAYS)
+    atl = _rolled(previous_atl, daily, ATL_DAYS)
+    conn.executemany('INSERT OR REPLACE INTO daily_load (day, stress, ctl, atl) VALUES (?, ?, ?, ?)',
+                     zip(all_days.tolist(), daily.tolist(), ctl.tolist(), atl.tolist()))
+
+def training_load(cache_directory, ftp, end=None):
+    """
+    Daily TSS, CTL (fitness), ATL (fatigue) and TSB (form) for ftp in watts,
+    as a DataFrame indexed by UTC date from the first ride on. end (a date)
+    extends the series past the last ride with rest days, e.g. to today.
+    """
+    with closing(connect_ride_index(cache_directory)) as conn:
+        daily = pd.read_sql_query('SELECT day, stress, ctl, atl FROM daily_load ORDER BY day', conn)
+    if daily.empty:
+        return pd.DataFrame(columns=LOAD_COLUMNS, index=pd.DatetimeIndex([], name='date'))
+
+    days = daily['day'].to_numpy()
+    stress, ctl, atl = (daily[column].to_numpy() for column in ('stress', 'ctl', 'atl'))
+    if end is not None:
+        end_day = int(pd.Timestamp(end).value // (SECONDS_PER_DAY * 10 ** 9))
+        rest = np.arange(1, end_day - days[-1] + 1)
+        if len(rest):
+            # without new stress the averages only decay
+            days = np.concatenate((days, days[-1] + rest))
+            stress = np.concatenate((stress, np.zeros(len(rest))))
+            ctl = np.concatenate((ctl, ctl[-1] * (1 - 1 / CTL_DAYS) ** rest))
+            atl = np.concatenate((atl, atl[-1] * (1 - 1 / ATL_DAYS) ** rest))
+
+    scale = stress_to_tss(ftp)
+    load = pd.DataFrame({'tss': stress * scale, 'ctl': ctl * scale, 'atl': atl * scale},
+                        index=pd.DatetimeIndex(pd.to_datetime(days * SECONDS_PER_DAY, unit='s', utc=True), name='date'))
+    load['tsb'] = (load['ctl'] - load['atl']).shift(1, fill_value=0.0)
+    return load
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+FIT files for the tests. FitWriter builds exactly the messages a decoder
+test lists: definitions in either byte order, normal and compressed-timestamp
+data messages; concatenate its output for chained files. write_ride writes a
+whole synthetic ride from benchmarks/synthetic_fit.py for the ingest tests.
+"""
+import gzip
+import os
+import struct
+from benchmarks.synthetic_fit import DEFAULT_START, crc16, make_fit
+
+# FIT base type -> struct format
+BASE_TYPE_FORMATS = {0x00: 'B', 0x01: 'b', 0x02: 'B', 0x83: 'h', 0x84: 'H', 0x85: 'i', 0x86: 'I',
+                     0x88: 'f', 0x8C: 'I'}
+
+class FitWriter:
+    """Collects messages and returns them as one FIT file."""
+
+    def __init__(self):
+        self.body = bytearray()
+        self.layouts = {}
+
+    def define(self, local_type, global_number, fields, big_endian=False):
+        """Defines local_type as global_number with fields [(field number, base type)]."""
+        endian = '>' if big_endian else '<'
+        self.body += struct.pack(endian + 'BBBHB', 0x40 | local_type, 0, int(big_endian), global_number,
+                                 len(fields))
+        for number, base_type in fields:
+            self.body += struct.pack('BBB', number, struct.calcsize(BASE_TYPE_FORMATS[base_type]), base_type)
+        self.layouts[local_type] = struct.Struct(endian + ''.join(BASE_TYPE_FORMATS[t] for _, t in fields))
+        return self
+
+    def data(self, local_type, *values):
+        self.body += bytes([local_type]) + self.layouts[local_type].pack(*values)
+        return self
+
+    def compressed(self, local_type, time_offset, *values):
+        """A data message with a compressed timestamp header (time_offset is the low 5 bits)."""
+        self.body += bytes([0x80 | local_type << 5 | time_offset]) + self.layouts[local_type].pack(*values)
+        return self
+
+    def to_bytes(self):
+        header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(self.body), b'.FIT')
+        header += struct.pack('<H', crc16(header))
+        fit = header + bytes(self.body)
+        return fit + struct.pack('<H', crc16(fit))
+
+def write_ride(directory, name, day=0, duration_s=600, seed=0, compress=False):
+    """Writes a synthetic ride starting day days after DEFAULT_START and returns its path."""
+    fit = make_fit(DEFAULT_START + day * 86400, duration_s, seed=seed)
+    path = os.path.join(directory, name)
+    with (gzip.open if compress else open)(path, 'wb') as f:
+        f.write(fit)
+    return path
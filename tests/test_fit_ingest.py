@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Duplicate detection, eviction and re-decoding in update_ingest_manifest."""
+import os
+import shutil
+from contextlib import closing
+import pytest
+from cyclingdata import fit_ingest
+from cyclingdata.fit_ingest import load_manifest, update_ingest_manifest
+from cyclingdata.ride_index import connect_ride_index, indexed_ride_hashes, query_ride_summaries
+from cyclingdata.ride_store import RIDE_FILE_EXTENSION
+from cyclingdata.route_index import has_ride_cells
+from fit_writer import write_ride
+
+@pytest.fixture
+def archive(tmp_path):
+    root = tmp_path / 'rides'
+    root.mkdir()
+    return str(root), str(tmp_path / 'cache')
+
+def ingested(rides):
+    return sorted(os.path.basename(p) for p, entry in rides.items() if entry.get('cache_file'))
+
+def duplicates(rides):
+    return {os.path.basename(p): os.path.basename(entry['duplicate_of'])
+            for p, entry in rides.items() if entry.get('duplicate_of')}
+
+def indexed(cache):
+    with closing(connect_ride_index(cache)) as conn:
+        return sorted(os.path.basename(p) for p in indexed_ride_hashes(conn))
+
+def cache_files(cache, rides, name):
+    entry = next(entry for p, entry in rides.items() if os.path.basename(p) == name)
+    return os.path.join(cache, entry['cache_file'])
+
+def test_copies_are_ingested_once(archive):
+    root, cache = archive
+    write_ride(root, 'a.fit')
+    write_ride(root, 'a.fit.gz', compress=True)
+    write_ride(root, 'b.fit', day=1)
+    rides = update_ingest_manifest(root, cache)
+    assert ingested(rides) == ['a.fit', 'b.fit']
+    assert duplicates(rides) == {'a.fit.gz': 'a.fit'}
+    assert indexed(cache) == ingested(rides)
+    assert update_ingest_manifest(root, cache) == rides
+
+def test_copy_takes_over_when_the_original_goes(archive):
+    root, cache = archive
+    write_ride(root, 'a.fit')
+    write_ride(root, 'copy.fit')
+    rides = update_ingest_manifest(root, cache)
+    original = os.path.join(root, next(iter(duplicates(rides).values())))
+    cached = os.path.join(cache, rides[original]['cache_file'])
+    os.remove(original)
+    rides = update_ingest_manifest(root, cache)
+    assert len(rides) == 1 and not duplicates(rides)
+    assert ingested(rides) == indexed(cache) == [os.path.basename(p) for p in rides]
+    assert not os.path.exists(cached)
+
+def test_lowest_path_wins_whatever_the_order(archive, monkeypatch):
+    root, cache = archive
+    for name in ('c.fit', 'b.fit.gz', 'a.fit'):
+        write_ride(root, name, compress=name.endswith('.gz'))
+    scan = fit_ingest.scan_fit_sources
+    monkeypatch.setattr(fit_ingest, 'scan_fit_sources',
+                        lambda *args, **kwargs: iter(sorted(scan(*args, **kwargs), reverse=True)))
+    rides = update_ingest_manifest(root, cache)
+    assert ingested(rides) == indexed(cache) == ['a.fit']
+    assert duplicates(rides) == {'b.fit.gz': 'a.fit', 'c.fit': 'a.fit'}
+    # c.fit was decoded before a.fit turned up, and evicted again
+    prefix = rides[os.path.join(root, 'a.fit')]['cache_file'][:-len(RIDE_FILE_EXTENSION)]
+    assert all(name.startswith(prefix) for name in os.listdir(cache) if name.endswith(RIDE_FILE_EXTENSION))
+
+def test_vanished_ride_is_evicted(archive):
+    root, cache = archive
+    write_ride(root, 'a.fit')
+    write_ride(root, 'b.fit', day=1)
+    rides = update_ingest_manifest(root, cache)
+    cached = cache_files(cache, rides, 'b.fit')
+    os.remove(os.path.join(root, 'b.fit'))
+    rides = update_ingest_manifest(root, cache)
+    assert ingested(rides) == indexed(cache) == ['a.fit']
+    assert not os.path.exists(cached)
+    assert list(load_manifest(cache)['rides']) == list(rides)
+
+def test_changed_original_releases_its_copy(archive):
+    root, cache = archive
+    write_ride(root, 'a.fit')
+    shutil.copy(os.path.join(root, 'a.fit'), os.path.join(root, 'b.fit'))
+    rides = update_ingest_manifest(root, cache)
+    copy, original = next(iter(duplicates(rides).items()))
+    sha1 = rides[os.path.join(root, original)]['sha1']
+    write_ride(root, original, seed=1)  # another ride under the original's name
+    rides = update_ingest_manifest(root, cache)
+    assert not duplicates(rides)
+    assert ingested(rides) == indexed(cache) == ['a.fit', 'b.fit']
+    assert rides[os.path.join(root, original)]['sha1'] != sha1
+
+def test_process_pool_matches_serial(tmp_path):
+    root = str(tmp_path / 'rides')
+    os.mkdir(root)
+    for day in range(4):
+        write_ride(root, f'ride{day}.fit' + ('.gz' if day % 2 else ''), day=day, compress=day % 2 == 1)
+    shutil.copy(os.path.join(root, 'ride0.fit'), os.path.join(root, 'copy.fit'))
+    serial = update_ingest_manifest(root, str(tmp_path / 'serial'))
+    pooled = update_ingest_manifest(root, str(tmp_path / 'pooled'), workers=2)
+    assert ingested(pooled) == ingested(serial) == ['copy.fit', 'ride1.fit.gz', 'ride2.fit', 'ride3.fit.gz']
+    assert duplicates(pooled) == duplicates(serial) == {'ride0.fit': 'copy.fit'}
+    assert indexed(str(tmp_path / 'pooled')) == ingested(pooled)
+
+def test_full_ingest_after_a_narrow_one_refreshes_the_index(archive):
+    root, cache = archive
+    for day in range(3):
+        write_ride(root, f'ride{day}.fit', day=day)
+    update_ingest_manifest(root, cache, fields=['record.timestamp', 'record.power'])
+    summaries = query_ride_summaries(cache)
+    assert summaries['mean_heart_rate'].isna().all() and not has_ride_cells(cache)
+
+    update_ingest_manifest(root, cache)
+    summaries = query_ride_summaries(cache)
+    assert summaries['mean_heart_rate'].notna().all() and summaries['mean_speed'].notna().all()
+    assert has_ride_cells(cache)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""W' balance against straightforward per-record loops."""
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from cyclingdata.power_metrics import w_prime_balance
+
+CP = 250
+W_PRIME = 20000
+
+def ride(seed=0, seconds=1800):
+    """1 Hz intervals around CP, with missing power, a 40 s dropout and a repeated timestamp."""
+    rng = np.random.default_rng(seed)
+    offsets = np.arange(seconds)
+    offsets = np.concatenate((offsets[:seconds // 3], offsets[seconds // 3 + 40:]))
+    offsets[seconds // 2] = offsets[seconds // 2 - 1]
+    watts = np.where((offsets // 120) % 2 == 0, 380.0, 150.0) + rng.normal(0, 25, len(offsets))
+    power = pd.array(np.maximum(watts, 0).round().astype('int64'), dtype='UInt16')
+    power[rng.choice(len(offsets), 20, replace=False)] = pd.NA
+    timestamps = pd.to_datetime(1715000000 + offsets, unit='s', utc=True)
+    return pd.DataFrame({'timestamp': timestamps, 'power': power})
+
+def steps(df):
+    """(watts, seconds of work at that power, seconds of gap at 0 W) per record, as the model counts them."""
+    seconds = df['timestamp'].to_numpy(dtype='datetime64[s]').astype('int64')
+    watts = df['power'].astype('float64').fillna(0.0).to_numpy()
+    result = []
+    for i, (second, power) in enumerate(zip(seconds, watts)):
+        elapsed = 1 if i == 0 else max(second - seconds[i - 1], 0)
+        result.append((power, min(elapsed, 1), elapsed - min(elapsed, 1)))
+    return result
+
+def naive_differential(df, cp, w_prime):
+    balance, out = w_prime, []
+    for power, work_s, gap_s in steps(df):
+        # the gap since the previous record is recovery at 0 W, then the record's own second
+        balance = w_prime - (w_prime - balance) * math.exp(-cp * gap_s / w_prime)
+        if power > cp:
+            balance -= (power - cp) * work_s
+        else:
+            balance = w_prime - (w_prime - balance) * math.exp(-(cp - power) * work_s / w_prime)
+        out.append(balance)
+    return out
+
+def naive_integral(df, cp, w_prime):
+    records = steps(df)
+    below = [(power, work_s) for power, work_s, _ in records if power < cp and work_s > 0]
+    recovery_s = sum(work_s for _, work_s in below) + sum(gap_s for _, _, gap_s in records)
+    recovery_power = sum(power * work_s for power, work_s in below) / recovery_s
+    tau = 546 * math.exp(-0.01 * (cp - recovery_power)) + 316
+
+    times = np.cumsum([work_s + gap_s for _, work_s, gap_s in records])
+    spent = [max(power - cp, 0) * work_s for power, work_s, _ in records]
+    return [w_prime - sum(spent[j] * math.exp(-(times[i] - times[j]) / tau) for j in range(i + 1))
+            for i in range(len(records))]
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_differential_matches_loop(seed):
+    df = ride(seed)
+    expected = naive_differential(df, CP, W_PRIME)
+    assert w_prime_balance(df, CP, W_PRIME).tolist() == pytest.approx(expected, abs=1e-6)
+
+def test_integral_matches_loop():
+    df = ride(2, seconds=900)
+    expected = naive_integral(df, CP, W_PRIME)
+    assert w_prime_balance(df, CP, W_PRIME, method='integral').tolist() == pytest.approx(expected, abs=1e-6)
+
+def test_records_without_timestamp():
+    df = ride(3, seconds=300)
+    df.loc[10, 'timestamp'] = pd.NaT
+    balance = w_prime_balance(df, CP, W_PRIME)
+    assert math.isnan(balance[10])
+    assert balance.drop(index=10).tolist() == pytest.approx(
+        naive_differential(df.drop(index=10), CP, W_PRIME), abs=1e-6)
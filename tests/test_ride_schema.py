@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""Declared column types in the ride store."""
+import logging
+import pandas as pd
+import pyarrow as pa
+from cyclingdata import ride_schema
+from cyclingdata.ride_schema import dataframe_to_table
+
+def test_misfit_column_is_reported_once(caplog, monkeypatch):
+    monkeypatch.setattr(ride_schema, '_misfit_columns', set())
+    with caplog.at_level(logging.WARNING, logger='cyclingdata.ride_schema'):
+        tables = [dataframe_to_table(pd.DataFrame({'heart_rate': [120, 300 + i], 'power': [200, 210]}))
+                  for i in range(3)]
+    assert [record.getMessage().split(' does')[0] for record in caplog.records] == ["Column 'heart_rate'"]
+    assert tables[0].schema.field('heart_rate').type == pa.int64()
+    assert tables[0].schema.field('power').type == pa.uint16()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""The daily_load table against a rebuild from scratch and against per-ride TSS."""
+import os
+import pandas as pd
+import pytest
+from cyclingdata.fit_ingest import load_cached_ride, update_ingest_manifest
+from cyclingdata.power_metrics import ride_power_metrics
+from cyclingdata.training_load import training_load
+from fit_writer import write_ride
+
+FTP = 250
+
+def test_incremental_matches_rebuild(tmp_path):
+    root, cache = str(tmp_path / 'rides'), str(tmp_path / 'cache')
+    os.mkdir(root)
+    for day in (10, 12, 15):
+        write_ride(root, f'day{day}.fit', day=day, seed=day)
+    update_ingest_manifest(root, cache)
+
+    write_ride(root, 'day40.fit', day=40, seed=40)  # a new ride at the end
+    update_ingest_manifest(root, cache)
+    write_ride(root, 'day2.fit', day=2, seed=2)  # an old ride: the days after it are rolled again
+    write_ride(root, 'day12-second.fit', day=12, seed=99)  # a second ride on a day that has one
+    update_ingest_manifest(root, cache)
+    write_ride(root, 'day15.fit', day=15, duration_s=1200, seed=15)  # a changed ride
+    os.remove(os.path.join(root, 'day10.fit'))  # a removed ride
+    update_ingest_manifest(root, cache)
+
+    rebuilt = str(tmp_path / 'rebuilt')
+    update_ingest_manifest(root, rebuilt)
+    end = pd.Timestamp('2024-07-01')
+    incremental = training_load(cache, FTP, end=end)
+    full = training_load(rebuilt, FTP, end=end)
+    assert len(full) == 55 and (full['tss'] > 0).sum() == 4
+    pd.testing.assert_frame_equal(incremental, full, check_exact=False, rtol=1e-9)
+
+def test_daily_tss_matches_ride_tss(tmp_path):
+    root, cache = str(tmp_path / 'rides'), str(tmp_path / 'cache')
+    os.mkdir(root)
+    write_ride(root, 'ride.fit', day=3, duration_s=1800, seed=7)
+    rides = update_ingest_manifest(root, cache)
+    df = load_cached_ride(rides[os.path.join(root, 'ride.fit')], cache)
+    tss = ride_power_metrics(df, FTP)['training_stress_score']
+    load = training_load(cache, FTP)
+    assert load['tss'].max() == pytest.approx(tss, rel=1e-9)